@@ -1,7 +1,12 @@
 import asyncio
+import logging
 from aiogram import Bot, Dispatcher, F
-from config import BOT_TOKEN, ADMIN_ID
-from db import init_db
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from config import BOT_TOKEN, ADMIN_ID, BOT_MODE, TELEGRAM_API_URL, REMINDERS_ENABLED
+from config import FSM_STORAGE, FSM_WRITE_DELAY_MS, FSM_STATE_TTL_HOURS, UPDATE_CONCURRENCY
+from config import WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, HEALTH_PATH
+from db import init_db, rebuild_fleet_summary, AsyncSessionLocal
 from handlers.add_machine import router as add_machine_router, start_add_machine
 from handlers.reports import router as reports_router, send_excel_report, choose_plot, send_summary
 from handlers.reminders import router as reminders_router, reminders_task
@@ -9,12 +14,21 @@ from handlers.payments import router as payments_router, start_payments
 from handlers.models import router as models_router, show_models
 from handlers.clients import router as clients_router, show_clients
 from db import delete_coffee_machine, delete_payment, delete_coffee_machine_by_tenant, delete_payment_by_tenant
+from db import get_pool_stats, get_query_stats, reconcile_machine_totals, rebuild_payment_month_rollup
+from db import get_machine_cache_stats
 
 from aiogram.filters import Command
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
 from keyboards import main_menu_kb
+from webhook import run_webhook
+from fsm_storage import PostgresStorage
+from concurrency import ChatEventIsolation
+from cache_sync import DataChangeListener
+from utils.render_pool import render_pool
 
 # Укажите свой chat_id для напоминаний
 ADMIN_CHAT_ID = ADMIN_ID
@@ -28,6 +42,24 @@ def setup_routers(dp: Dispatcher):
     dp.include_router(clients_router)
 
 
+def create_bot() -> Bot:
+    # TELEGRAM_API_URL — свой сервер Bot API или локальная заглушка вместо api.telegram.org
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+        return Bot(token=BOT_TOKEN, session=session)
+    return Bot(token=BOT_TOKEN)
+
+
+def create_fsm_storage() -> BaseStorage:
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    return PostgresStorage(
+        AsyncSessionLocal,
+        write_delay=FSM_WRITE_DELAY_MS / 1000,
+        ttl=FSM_STATE_TTL_HOURS * 3600,
+    )
+
+
 class DeleteMachineFSM(StatesGroup):
     waiting_input = State()
 
@@ -37,8 +69,14 @@ class DeletePaymentFSM(StatesGroup):
 
 async def main():
     await init_db()
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher()
+    await rebuild_fleet_summary()
+    bot = create_bot()
+    storage = create_fsm_storage()
+    if isinstance(storage, PostgresStorage):
+        await storage.cleanup_expired()
+    # Очередь чата и общий лимит — в изоляции событий: состояние FSM читается уже под блокировкой
+    update_limiter = ChatEventIsolation(UPDATE_CONCURRENCY)
+    dp = Dispatcher(storage=storage, events_isolation=update_limiter)
     setup_routers(dp)
 
     @dp.message(Command("start"))
@@ -145,9 +183,67 @@ async def main():
             else:
                 await msg.answer(f"Платежи по арендатору '{arg}' не найдены.")
 
+    @dp.message(Command("db_stats"))
+    async def db_stats_cmd(msg: Message):
+        stats = get_pool_stats()
+        await msg.answer(
+            f"Пул соединений: {stats['size']} (+{stats['max_overflow']} overflow)\n"
+            f"Занято: {stats['checked_out']}, свободно: {stats['checked_in']}, overflow: {stats['overflow']}\n"
+            f"Ожидание соединения: {stats.get('wait_count', 0)} раз, "
+            f"среднее {stats.get('wait_avg_ms', 0):.1f} мс, максимум {stats.get('wait_max_ms', 0):.1f} мс"
+        )
+        cache = get_machine_cache_stats()
+        await msg.answer(
+            f"Кэш машин: {cache['size']}/{cache['max_size']}, "
+            f"попаданий {cache['hits']}, промахов {cache['misses']} ({cache['hit_rate']:.0%})"
+        )
+        updates = update_limiter.stats()
+        await msg.answer(
+            f"Обновления: в работе {updates['in_flight']}/{updates['limit']}, "
+            f"в очереди {updates['queued']} (макс. {updates['max_queued']}), "
+            f"обработано {updates['processed']}"
+        )
+        top_queries = get_query_stats(top=5)
+        if top_queries:
+            lines = [
+                f"{q['count']}× ср. {q['avg_ms']:.1f} мс, макс. {q['max_ms']:.1f} мс — {q['statement'][:120]}"
+                for q in top_queries
+            ]
+            await msg.answer("Самые затратные запросы:\n" + "\n".join(lines))
+
+    @dp.message(Command("reconcile"))
+    async def reconcile_cmd(msg: Message):
+        fixed = await reconcile_machine_totals()
+        await rebuild_payment_month_rollup()
+        await msg.answer(f"Итоги по платежам пересчитаны. Исправлено сделок: {fixed}. Помесячные суммы пересобраны.")
+
     # Запуск автонапоминаний в фоне
-    asyncio.create_task(reminders_task(bot, ADMIN_CHAT_ID))
-    await dp.start_polling(bot)
+    if REMINDERS_ENABLED:
+        asyncio.create_task(reminders_task(bot, ADMIN_CHAT_ID))
+    # Процессы отрисовки Excel и графиков поднимаем заранее, чтобы первый отчёт не ждал импортов
+    await render_pool.start()
+    # Кэши процесса сбрасываются по записям других реплик (LISTEN data_changed)
+    cache_listener = DataChangeListener()
+    cache_listener.start()
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(
+                bot, dp,
+                base_url=WEBHOOK_BASE_URL,
+                path=WEBHOOK_PATH,
+                secret=WEBHOOK_SECRET,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                health_path=HEALTH_PATH,
+            )
+        else:
+            # Webhook, оставшийся от запуска в режиме webhook, блокирует getUpdates
+            await bot.delete_webhook(drop_pending_updates=False)
+            await dp.start_polling(bot)
+    finally:
+        await cache_listener.stop()
+        await render_pool.shutdown()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     asyncio.run(main()) 
\ No newline at end of file
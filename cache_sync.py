@@ -0,0 +1,105 @@
+"""
+Согласование кэшей в памяти процесса между репликами бота.
+
+Каталог моделей, кэш машин, показатели /summary и версия данных (ключ кэша готовых отчётов)
+живут в памяти каждого процесса. Триггеры из migrations/0008_data_change_notify.py шлют
+NOTIFY data_changed на каждую запись в таблицы сделок; слушатель держит отдельное соединение
+с LISTEN и по уведомлению о чужой записи сбрасывает зависящие от таблицы кэши
+(db.apply_remote_change). Свои записи процесс уже учёл сам — их узнаём по application_name.
+
+Пока соединение с LISTEN не установлено, уведомления теряются, поэтому после каждого
+(пере)подключения все кэши сбрасываются целиком.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+import asyncpg
+
+from config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+from db import REPLICA_NAME, apply_remote_change, reset_local_caches
+
+logger = logging.getLogger("cache_sync")
+
+CHANNEL = "data_changed"
+
+# Пауза перед переподключением и период проверки соединения, секунды
+RETRY_DELAY = 5
+KEEPALIVE_INTERVAL = 30
+
+
+async def _connect():
+    return await asyncpg.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME,
+        server_settings={"application_name": f"{REPLICA_NAME}-listen"},
+    )
+
+
+class DataChangeListener:
+    """Фоновая задача LISTEN data_changed с переподключением; start() и stop() — из main()."""
+
+    def __init__(self, connect=_connect, retry_delay: float = RETRY_DELAY, keepalive: float = KEEPALIVE_INTERVAL):
+        self._connect = connect
+        self.retry_delay = retry_delay
+        self.keepalive = keepalive
+        self.received = 0
+        self.applied = 0
+        self.connected = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        self.received += 1
+        table, _, origin = payload.partition(" ")
+        if origin == REPLICA_NAME:
+            return
+        self.applied += 1
+        apply_remote_change(table)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Соединение LISTEN %s потеряно, переподключимся через %s с", CHANNEL, self.retry_delay)
+            self.connected.clear()
+            await asyncio.sleep(self.retry_delay)
+
+    async def _listen(self) -> None:
+        conn = await self._connect()
+        lost = asyncio.Event()
+        conn.add_termination_listener(lambda _conn: lost.set())
+        try:
+            await conn.add_listener(CHANNEL, self._on_notify)
+            # Записи других реплик до подписки прошли мимо нас
+            reset_local_caches()
+            self.connected.set()
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), timeout=self.keepalive)
+                except asyncio.TimeoutError:
+                    # Оборванное без FIN соединение замечаем только по неудачному запросу
+                    await conn.execute("SELECT 1")
+            raise ConnectionError("соединение закрыто сервером")
+        finally:
+            if not conn.is_closed():
+                await conn.close()
@@ -0,0 +1,93 @@
+"""
+Параллельная обработка обновлений с ограничением и порядком внутри чата.
+
+aiogram запускает каждое обновление отдельной задачей (и в polling, и в webhook),
+поэтому тяжёлый /report в одном чате не должен задерживать остальные. Изоляция событий
+ограничивает число одновременно работающих обработчиков общим семафором, а обновления
+одного чата пропускает строго по очереди — переходы FSM не перемешиваются.
+
+Это именно events_isolation диспетчера, а не outer middleware: FSMContextMiddleware читает
+состояние уже под блокировкой, поэтому следующее обновление чата видит состояние,
+выставленное предыдущим. Обновления без чата и пользователя (без контекста FSM)
+идут мимо изоляции.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Hashable
+
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+
+logger = logging.getLogger("concurrency")
+
+
+class _ChatQueue:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # сколько обновлений чата ждут или обрабатываются
+
+
+class ChatEventIsolation(BaseEventIsolation):
+    """
+    Изоляция событий для Dispatcher(events_isolation=...): не больше limit обработчиков
+    одновременно, обновления одного чата — по одному в порядке поступления.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit)
+        self._chats: dict[Hashable, _ChatQueue] = {}
+        self.queued = 0
+        self.in_flight = 0
+        self.max_queued = 0
+        self.processed = 0
+
+    @staticmethod
+    def _chat_key(key: StorageKey) -> Hashable:
+        # Весь чат, а не пара чат-пользователь: в группе шаги разных людей тоже не перемешиваются
+        return key.bot_id, key.chat_id, key.business_connection_id
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        chat_key = self._chat_key(key)
+        queue = self._chats.get(chat_key)
+        if queue is None:
+            queue = self._chats[chat_key] = _ChatQueue()
+        queue.users += 1
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        started = False
+        try:
+            # Сначала очередь чата, потом общий лимит: ждущие в одном чате не занимают слотов
+            async with queue.lock:
+                async with self._semaphore:
+                    self.queued -= 1
+                    started = True
+                    self.in_flight += 1
+                    try:
+                        yield
+                    finally:
+                        self.in_flight -= 1
+                        self.processed += 1
+        finally:
+            if not started:
+                self.queued -= 1
+            queue.users -= 1
+            if queue.users == 0:
+                del self._chats[chat_key]
+
+    async def close(self) -> None:
+        self._chats.clear()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "processed": self.processed,
+            "chats": len(self._chats),
+        }
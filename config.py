@@ -10,3 +10,52 @@ DB_PORT = int(os.getenv('DB_PORT', 5432))
 DB_USER = os.getenv('DB_USER', 'postgres')
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'postgres')
 DB_NAME = os.getenv('DB_NAME', 'coffee_rent')
+
+# Пул соединений с БД
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # секунды, -1 — не пересоздавать
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000))  # 0 — без ограничения
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 100))  # кэш prepared statements asyncpg
+
+# Логирование SQL
+DB_ECHO = os.getenv('DB_ECHO', 'false').lower() in ('1', 'true', 'yes')  # полный вывод всех запросов
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', 500))  # порог медленного запроса, -1 — не логировать
+
+# Кэш каталога моделей: через сколько секунд перечитывать из БД (0 — только при изменениях через бота)
+MODEL_CACHE_TTL = float(os.getenv('MODEL_CACHE_TTL', 300))
+# Кэш машин по id: сколько машин держать в памяти (0 — не кэшировать)
+MACHINE_CACHE_SIZE = int(os.getenv('MACHINE_CACHE_SIZE', 1000))
+
+# Дисковый кэш отрисованных графиков (по умолчанию в смонтированном томе backups)
+PLOT_CACHE_DIR = os.getenv('PLOT_CACHE_DIR', 'backups/plot_cache')
+PLOT_CACHE_MAX_MB = float(os.getenv('PLOT_CACHE_MAX_MB', 100))  # 0 — не кэшировать
+
+# Режим получения обновлений: polling (getUpdates) или webhook (aiohttp-сервер за обратным прокси)
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')  # внешний https-адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # сверяется с заголовком X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+HEALTH_PATH = os.getenv('HEALTH_PATH', '/health')
+# Адрес Bot API (свой сервер telegram-bot-api или локальная заглушка), пусто — api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
+# Фоновые напоминания о платежах; при нескольких репликах включайте только в одной
+REMINDERS_ENABLED = os.getenv('REMINDERS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Хранилище состояний диалогов (FSM): postgres — общее для реплик и переживает перезапуск, memory — в памяти процесса
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'postgres').lower()
+# Буфер записи FSM, 0 — писать сразу. В webhook по умолчанию 0: следующее обновление чата может
+# прийти в другую реплику и должно увидеть состояние уже в БД (буфер — только при липкой маршрутизации по чату)
+FSM_WRITE_DELAY_MS = float(os.getenv('FSM_WRITE_DELAY_MS', 0 if BOT_MODE == 'webhook' else 100))
+FSM_STATE_TTL_HOURS = float(os.getenv('FSM_STATE_TTL_HOURS', 24))  # через сколько брошенный диалог удаляется
+
+# Сколько обновлений обрабатывать одновременно (обновления одного чата всегда идут по очереди)
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 8))
+
+# Пул процессов для отрисовки Excel и графиков (0 — в потоке основного процесса)
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', 2))
+RENDER_TIMEOUT = float(os.getenv('RENDER_TIMEOUT', 120))  # секунды на один отчёт или график
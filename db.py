@@ -1,27 +1,214 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select, update, delete
+from sqlalchemy import select, update, delete, insert, func, case, or_, and_, cast, Date, true, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
-from models import Base, CoffeeMachineORM, PaymentORM, MachineModelORM
+from config import (
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_STATEMENT_TIMEOUT_MS,
+    DB_STATEMENT_CACHE_SIZE,
+    DB_ECHO,
+    DB_SLOW_QUERY_MS,
+    MODEL_CACHE_TTL,
+    MACHINE_CACHE_SIZE,
+)
+from models import Base, CoffeeMachineORM, PaymentORM, MachineModelORM, PaymentMonthRollupORM
+from utils.query_log import QueryStats, install_query_logging
+from utils.fleet_summary import FleetSummary, SummaryEntry, due_date_for
+from migrate import run_migrations
 from datetime import date
-from typing import Optional
-from sqlalchemy.orm import selectinload
+from typing import AsyncIterator, Optional
+from sqlalchemy.orm import selectinload, aliased
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
 
 
+logger = logging.getLogger("db")
+
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+# Имя процесса в application_name соединений: по нему триггеры NOTIFY data_changed
+# подписывают изменения, и реплика пропускает уведомления о собственных записях (см. cache_sync.py)
+REPLICA_NAME = f"pro_accounter-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Пул соединений, который запоминает, сколько ждали свободного соединения.
+    Считаются только выдачи, которым пришлось ждать: все соединения и overflow уже заняты.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _exhausted(self) -> bool:
+        # max_overflow=-1 — overflow без ограничения, ждать не приходится
+        return self._max_overflow > -1 and self.checkedout() >= self.size() + self._max_overflow
+
+    def _do_get(self):
+        if not self._exhausted():
+            return super()._do_get()
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            self.wait_count += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+
+def _connect_args() -> dict:
+    server_settings = {"application_name": REPLICA_NAME}
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        server_settings["statement_timeout"] = str(DB_STATEMENT_TIMEOUT_MS)
+    return {"statement_cache_size": DB_STATEMENT_CACHE_SIZE, "server_settings": server_settings}
+
+
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=DB_ECHO,
+    future=True,
+    poolclass=InstrumentedPool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    pool_recycle=DB_POOL_RECYCLE,
+    connect_args=_connect_args(),
+)
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+query_stats = QueryStats()
+install_query_logging(engine, query_stats, DB_SLOW_QUERY_MS)
+
+
+def get_pool_stats() -> dict:
+    """Снимок состояния пула соединений: занятые, свободные, overflow и время ожидания."""
+    pool = engine.pool
+    stats = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": DB_MAX_OVERFLOW,
+    }
+    if isinstance(pool, InstrumentedPool):
+        stats["wait_count"] = pool.wait_count
+        stats["wait_avg_ms"] = pool.wait_total / pool.wait_count * 1000 if pool.wait_count else 0.0
+        stats["wait_max_ms"] = pool.wait_max * 1000
+    return stats
+
+
+def get_query_stats(top: int | None = None) -> list[dict]:
+    """Гистограммы задержек SQL-запросов, самые затратные по суммарному времени — первыми."""
+    return query_stats.snapshot(top)
+
 async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    """Приводит схему БД к актуальной версии (см. migrations/)"""
+    await run_migrations()
+
+# --- Версия данных ---
+# Счётчик изменений: растёт при каждой записи через db.py этого процесса и по уведомлениям
+# о записях других реплик (apply_remote_change). Ключ для кэшей производных данных (готовых отчётов и т.п.).
+_data_version = 0
+
+def get_data_version() -> int:
+    return _data_version
+
+def bump_data_version() -> None:
+    global _data_version
+    _data_version += 1
 
 # --- Работа с моделями кофемашин ---
+class ModelCatalogCache:
+    """
+    Каталог моделей в памяти процесса с индексами по id и по имени.
+    Сбрасывается при изменениях каталога через бота и, если задан ttl (сек), по времени —
+    на случай правок в БД в обход бота.
+    """
+
+    def __init__(self, ttl: float = 0):
+        self.ttl = ttl
+        self.loads = 0
+        self._models: Optional[list] = None
+        self._by_id: dict = {}
+        self._by_name: dict = {}
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        if self._models is None:
+            return False
+        return self.ttl <= 0 or time.monotonic() - self._loaded_at < self.ttl
+
+    async def _catalog(self) -> tuple[list, dict, dict]:
+        """Каталог и индексы: из кэша, а если он устарел — прочитанные из БД."""
+        if self._is_fresh():
+            return self._models, self._by_id, self._by_name
+        async with self._lock:
+            if self._is_fresh():
+                return self._models, self._by_id, self._by_name
+            generation = self._generation
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(select(MachineModelORM).order_by(MachineModelORM.id))
+                models = list(result.scalars().all())
+            by_id = {m.id: m for m in models}
+            by_name = {m.name: m for m in models}
+            # Каталог сбросили, пока шёл запрос: прочитанное отдаём этому вызову, но не кэшируем —
+            # следующий вызов перечитает каталог уже после изменения
+            if generation == self._generation:
+                self._by_id = by_id
+                self._by_name = by_name
+                self._models = models
+                self._loaded_at = time.monotonic()
+                self.loads += 1
+            return models, by_id, by_name
+
+    async def get_all(self) -> list:
+        models, _, _ = await self._catalog()
+        return list(models)
+
+    async def get_by_id(self, model_id: int):
+        _, by_id, _ = await self._catalog()
+        return by_id.get(model_id)
+
+    async def get_by_name(self, name: str):
+        _, _, by_name = await self._catalog()
+        return by_name.get(name)
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._models = None
+        self._by_id = {}
+        self._by_name = {}
+
+
+model_catalog = ModelCatalogCache(ttl=MODEL_CACHE_TTL)
+
+def invalidate_model_cache():
+    """Сбросить кэш каталога моделей (после изменений в обход add/delete_machine_model)"""
+    model_catalog.invalidate()
+    bump_data_version()
+
 async def get_all_machine_models():
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(MachineModelORM))
-        return result.scalars().all()
+    return await model_catalog.get_all()
+
+async def get_machine_model_by_id(model_id: int):
+    return await model_catalog.get_by_id(model_id)
 
 async def add_machine_model(name: str, default_rent: float, full_price: float):
     async with AsyncSessionLocal() as session:
@@ -29,20 +216,177 @@ async def add_machine_model(name: str, default_rent: float, full_price: float):
         session.add(model)
         await session.commit()
         await session.refresh(model)
-        return model
+    model_catalog.invalidate()
+    bump_data_version()
+    return model
 
 async def delete_machine_model(model_id: int):
     async with AsyncSessionLocal() as session:
         await session.execute(delete(MachineModelORM).where(MachineModelORM.id == model_id))
         await session.commit()
+    model_catalog.invalidate()
+    bump_data_version()
+
+# --- Кэш машин по id ---
+class MachineCache:
+    """
+    Ограниченный LRU-кэш машин (без платежей) по id со счётчиками попаданий.
+    Любая функция db.py, меняющая машину или её итоги, сбрасывает соответствующие записи;
+    изменения в обход db.py кэш не видит.
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict = OrderedDict()
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, machine_id: int):
+        machine = self._items.get(machine_id)
+        if machine is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(machine_id)
+        self.hits += 1
+        return machine
+
+    def put(self, machine, generation: int) -> None:
+        """Сохранить машину, если с момента начала чтения (generation) кэш не сбрасывали."""
+        if self.max_size <= 0 or generation != self._generation:
+            return
+        self._items[machine.id] = machine
+        self._items.move_to_end(machine.id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, machine_ids) -> None:
+        self._generation += 1
+        for machine_id in machine_ids:
+            self._items.pop(machine_id, None)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._items.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+machine_cache = MachineCache(max_size=MACHINE_CACHE_SIZE)
+
+def get_machine_cache_stats() -> dict:
+    """Размер кэша машин и счётчики попаданий/промахов"""
+    return machine_cache.stats()
+
+# --- Показатели /summary ---
+fleet_summary = FleetSummary()
+_fleet_summary_lock = asyncio.Lock()
+
+def _summary_select():
+    return select(
+        CoffeeMachineORM.id,
+        CoffeeMachineORM.status,
+        CoffeeMachineORM.deposit,
+        CoffeeMachineORM.rent_price,
+        CoffeeMachineORM.in_1C,
+        CoffeeMachineORM.start_date,
+        CoffeeMachineORM.last_payment_date,
+    )
+
+def _summary_entry(row) -> SummaryEntry:
+    return SummaryEntry(
+        machine_id=row.id,
+        deposit=row.deposit or 0,
+        rent_price=row.rent_price or 0,
+        in_1C=bool(row.in_1C),
+        due_date=due_date_for(row.start_date, row.last_payment_date),
+    )
+
+async def rebuild_fleet_summary():
+    """Построить показатели /summary по всем активным сделкам (при старте бота)"""
+    async with _fleet_summary_lock:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(_summary_select().where(CoffeeMachineORM.status == "active"))
+            fleet_summary.rebuild(_summary_entry(row) for row in result.all())
+
+async def _sync_fleet_summary(machine_ids) -> None:
+    """Перечитать из БД только изменённые машины и обновить по ним показатели /summary"""
+    if not fleet_summary.loaded or not machine_ids:
+        return
+    # Синхронизации идут по очереди, чтобы более раннее чтение не затёрло более позднее
+    async with _fleet_summary_lock:
+        if not fleet_summary.loaded:
+            return
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(_summary_select().where(CoffeeMachineORM.id.in_(machine_ids)))
+            rows = result.all()
+        for row in rows:
+            if row.status == "active":
+                fleet_summary.upsert(_summary_entry(row))
+            else:
+                fleet_summary.remove(row.id)
+        for machine_id in set(machine_ids) - {row.id for row in rows}:
+            fleet_summary.remove(machine_id)
+
+async def get_fleet_summary() -> dict:
+    """Показатели /summary на сегодня; при первом обращении строятся из БД"""
+    if not fleet_summary.loaded:
+        await rebuild_fleet_summary()
+    return fleet_summary.snapshot(date.today())
+
+async def _on_machines_changed(machine_ids) -> None:
+    """Вызывается после commit любой записи, затрагивающей машины: версия данных, кэш и /summary"""
+    machine_ids = {machine_id for machine_id in machine_ids if machine_id is not None}
+    bump_data_version()
+    machine_cache.invalidate(machine_ids)
+    try:
+        await _sync_fleet_summary(machine_ids)
+    except Exception:
+        # Данные уже записаны; показатели пересоберутся из БД при следующем /summary
+        logger.exception("Не удалось обновить показатели /summary, будут пересобраны")
+        fleet_summary.clear()
+
+def apply_remote_change(table: str) -> None:
+    """
+    Изменение таблицы другой репликой (NOTIFY data_changed): сбросить зависящие от неё кэши.
+    Какие именно строки изменились, уведомление не говорит, поэтому кэши сбрасываются целиком;
+    /summary пересоберётся из БД при следующем обращении.
+    """
+    if table == "machine_models":
+        model_catalog.invalidate()
+    else:
+        machine_cache.clear()
+        fleet_summary.clear()
+    bump_data_version()
+
+def reset_local_caches() -> None:
+    """Сбросить все кэши процесса — когда уведомления о чужих записях могли потеряться."""
+    model_catalog.invalidate()
+    machine_cache.clear()
+    fleet_summary.clear()
+    bump_data_version()
 
 async def delete_coffee_machine(machine_id: int):
     async with AsyncSessionLocal() as session:
-        # Удаляем связанные платежи
+        # Удаляем связанные платежи и их помесячные суммы
+        await session.execute(delete(PaymentMonthRollupORM).where(PaymentMonthRollupORM.machine_id == machine_id))
         await session.execute(delete(PaymentORM).where(PaymentORM.machine_id == machine_id))
         # Удаляем саму кофемашину
         await session.execute(delete(CoffeeMachineORM).where(CoffeeMachineORM.id == machine_id))
         await session.commit()
+    await _on_machines_changed([machine_id])
 
 async def delete_coffee_machine_by_tenant(tenant: str) -> int:
     """
@@ -60,16 +404,169 @@ async def delete_coffee_machine_by_tenant(tenant: str) -> int:
         ids = [row[0] for row in result.all()]
         if not ids:
             return 0
+        await session.execute(delete(PaymentMonthRollupORM).where(PaymentMonthRollupORM.machine_id.in_(ids)))
         await session.execute(delete(PaymentORM).where(PaymentORM.machine_id.in_(ids)))
         await session.execute(delete(CoffeeMachineORM).where(CoffeeMachineORM.id.in_(ids)))
         await session.commit()
-        return len(ids)
+    await _on_machines_changed(ids)
+    return len(ids)
+
+# --- Денормализованные итоги по платежам в coffee_machines ---
+def _machine_totals_subqueries():
+    total_paid = (
+        select(func.coalesce(func.sum(PaymentORM.amount), 0.0))
+        .where(PaymentORM.machine_id == CoffeeMachineORM.id)
+        .scalar_subquery()
+    )
+    payments_count = (
+        select(func.count(PaymentORM.id))
+        .where(PaymentORM.machine_id == CoffeeMachineORM.id)
+        .scalar_subquery()
+    )
+    last_payment_date = (
+        select(func.max(PaymentORM.payment_date))
+        .where(PaymentORM.machine_id == CoffeeMachineORM.id)
+        .scalar_subquery()
+    )
+    return total_paid, payments_count, last_payment_date
+
+async def _refresh_machine_totals(session, machine_ids):
+    """Пересчитать итоги по платежам для машин в текущей транзакции"""
+    machine_ids = {machine_id for machine_id in machine_ids if machine_id is not None}
+    if not machine_ids:
+        return
+    total_paid, payments_count, last_payment_date = _machine_totals_subqueries()
+    await session.execute(
+        update(CoffeeMachineORM)
+        .where(CoffeeMachineORM.id.in_(machine_ids))
+        .values(total_paid=total_paid, payments_count=payments_count, last_payment_date=last_payment_date)
+        .execution_options(synchronize_session=False)
+    )
+
+async def reconcile_machine_totals() -> int:
+    """
+    Пересобрать total_paid, payments_count и last_payment_date из таблицы платежей.
+    Возвращает количество машин, у которых итоги расходились.
+    """
+    total_paid, payments_count, last_payment_date = _machine_totals_subqueries()
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            update(CoffeeMachineORM)
+            .where(or_(
+                CoffeeMachineORM.total_paid != total_paid,
+                CoffeeMachineORM.payments_count != payments_count,
+                CoffeeMachineORM.last_payment_date.is_distinct_from(last_payment_date),
+            ))
+            .values(total_paid=total_paid, payments_count=payments_count, last_payment_date=last_payment_date)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+    # Какие именно машины исправлены, UPDATE не сообщает — сбрасываем кэш целиком
+    machine_cache.clear()
+    bump_data_version()
+    if fleet_summary.loaded:
+        await rebuild_fleet_summary()
+    return result.rowcount
+
+# --- Помесячные суммы платежей (payment_month_rollup) ---
+def _payment_month():
+    return cast(func.date_trunc('month', PaymentORM.payment_date), Date)
+
+def _rollup_source(*criteria):
+    month = _payment_month()
+    return (
+        select(
+            PaymentORM.machine_id,
+            month,
+            func.sum(PaymentORM.amount),
+            func.count(PaymentORM.id),
+            func.min(PaymentORM.payment_date),
+        )
+        .where(PaymentORM.machine_id.is_not(None), *criteria)
+        .group_by(PaymentORM.machine_id, month)
+    )
+
+_ROLLUP_COLUMNS = ["machine_id", "month", "amount_sum", "count", "first_payment_date"]
+
+async def _refresh_month_rollup(session, machine_dates):
+    """Пересчитать помесячные суммы для пар (машина, дата платежа) в текущей транзакции"""
+    pairs = {(machine_id, d.replace(day=1)) for machine_id, d in machine_dates if machine_id is not None}
+    if not pairs:
+        return
+    machine_ids = {machine_id for machine_id, _ in pairs}
+    months = {month for _, month in pairs}
+    await session.execute(
+        delete(PaymentMonthRollupORM).where(
+            PaymentMonthRollupORM.machine_id.in_(machine_ids),
+            PaymentMonthRollupORM.month.in_(months),
+        )
+    )
+    await session.execute(
+        insert(PaymentMonthRollupORM).from_select(
+            _ROLLUP_COLUMNS,
+            _rollup_source(PaymentORM.machine_id.in_(machine_ids), _payment_month().in_(months)),
+        )
+    )
+
+async def rebuild_payment_month_rollup():
+    """Полностью пересобрать помесячные суммы из таблицы платежей"""
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(PaymentMonthRollupORM))
+        await session.execute(insert(PaymentMonthRollupORM).from_select(_ROLLUP_COLUMNS, _rollup_source()))
+        await session.commit()
+    bump_data_version()
+
+async def get_payment_month_rollup(machine_ids: Optional[list[int]] = None) -> dict[int, list]:
+    """Помесячные суммы по машинам: {machine_id: [строки по возрастанию месяца]}"""
+    stmt = select(PaymentMonthRollupORM).order_by(PaymentMonthRollupORM.machine_id, PaymentMonthRollupORM.month)
+    if machine_ids is not None:
+        if not machine_ids:
+            return {}
+        stmt = stmt.where(PaymentMonthRollupORM.machine_id.in_(machine_ids))
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(stmt)
+        grouped: dict[int, list] = {}
+        for row in result.scalars().all():
+            grouped.setdefault(row.machine_id, []).append(row)
+        return grouped
+
+async def get_monthly_payment_totals():
+    """Сумма и количество платежей по месяцам для всего парка: строки (month, amount_sum, count)"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(
+                PaymentMonthRollupORM.month,
+                func.sum(PaymentMonthRollupORM.amount_sum).label("amount_sum"),
+                func.sum(PaymentMonthRollupORM.count).label("count"),
+            )
+            .group_by(PaymentMonthRollupORM.month)
+            .order_by(PaymentMonthRollupORM.month)
+        )
+        return result.all()
+
+async def get_model_counts():
+    """Количество сделок по моделям одним GROUP BY: строки (model, count), самые частые первыми"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(CoffeeMachineORM.model, func.count(CoffeeMachineORM.id).label("count"))
+            .group_by(CoffeeMachineORM.model)
+            .order_by(func.count(CoffeeMachineORM.id).desc(), CoffeeMachineORM.model)
+        )
+        return result.all()
 
 # Удаление платежа
 async def delete_payment(payment_id: int):
     async with AsyncSessionLocal() as session:
-        await session.execute(delete(PaymentORM).where(PaymentORM.id == payment_id))
+        result = await session.execute(
+            delete(PaymentORM)
+            .where(PaymentORM.id == payment_id)
+            .returning(PaymentORM.machine_id, PaymentORM.payment_date)
+        )
+        deleted = result.all()
+        await _refresh_machine_totals(session, [row[0] for row in deleted])
+        await _refresh_month_rollup(session, deleted)
         await session.commit()
+    await _on_machines_changed([row[0] for row in deleted])
 
 async def delete_payment_by_tenant(tenant: str) -> int:
     """
@@ -82,14 +579,19 @@ async def delete_payment_by_tenant(tenant: str) -> int:
     pattern = f"%{tenant}%"
     async with AsyncSessionLocal() as session:
         result = await session.execute(
-            select(PaymentORM.id).where(PaymentORM.tenant.ilike(pattern))
+            select(PaymentORM.id, PaymentORM.machine_id, PaymentORM.payment_date)
+            .where(PaymentORM.tenant.ilike(pattern))
         )
-        ids = [row[0] for row in result.all()]
-        if not ids:
+        rows = result.all()
+        if not rows:
             return 0
+        ids = [row[0] for row in rows]
         await session.execute(delete(PaymentORM).where(PaymentORM.id.in_(ids)))
+        await _refresh_machine_totals(session, [row[1] for row in rows])
+        await _refresh_month_rollup(session, [(row[1], row[2]) for row in rows])
         await session.commit()
-        return len(ids)
+    await _on_machines_changed([row[1] for row in rows])
+    return len(ids)
 
 # CRUD-функции
 async def add_coffee_machine(machine_data: dict):
@@ -98,7 +600,8 @@ async def add_coffee_machine(machine_data: dict):
         session.add(machine)
         await session.commit()
         await session.refresh(machine)
-        return machine
+    await _on_machines_changed([machine.id])
+    return machine
 
 async def get_all_machines():
     async with AsyncSessionLocal() as session:
@@ -107,13 +610,297 @@ async def get_all_machines():
         )
         return result.scalars().all()
 
+# Размер пачки при потоковом чтении машин для отчётов
+REPORT_CHUNK_SIZE = 500
+
+async def get_machines(status: Optional[str] = None):
+    """Получить машины без платежей (итоги по платежам хранятся в самих машинах)"""
+    stmt = select(CoffeeMachineORM).order_by(CoffeeMachineORM.id)
+    if status is not None:
+        stmt = stmt.where(CoffeeMachineORM.status == status)
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+def _status_clause(statuses):
+    """Условие по статусам сделок; "closed" — любая закрытая сделка"""
+    named = [s for s in statuses if s != "closed"]
+    clauses = []
+    if "closed" in statuses:
+        clauses.append(CoffeeMachineORM.status != "active")
+    if named:
+        clauses.append(CoffeeMachineORM.status.in_(named))
+    return or_(*clauses)
+
+def _date_range_clause(column, date_from: Optional[date], date_to: Optional[date]):
+    """Условие column BETWEEN date_from AND date_to, любая граница может отсутствовать"""
+    clauses = []
+    if date_from is not None:
+        clauses.append(column >= date_from)
+    if date_to is not None:
+        clauses.append(column <= date_to)
+    return and_(true(), *clauses)
+
+async def iter_machines(
+    status: Optional[str] = None,
+    columns: Optional[list[str]] = None,
+    with_payments: bool = False,
+    chunk_size: int = REPORT_CHUNK_SIZE,
+    statuses: tuple[str, ...] = (),
+    started_from: Optional[date] = None,
+    started_to: Optional[date] = None,
+) -> AsyncIterator[list]:
+    """
+    Потоково отдаёт машины пачками по chunk_size (серверный курсор + yield_per),
+    чтобы отчёты не держали в памяти весь парк сразу.
+    columns — имена колонок coffee_machines: тогда выбираются только они и отдаются строки Row;
+    with_payments — платежи каждой пачки подгружаются одним selectinload-запросом
+    (только для выборки целых объектов).
+    statuses, started_from/started_to — фильтры отчётов по статусам и дате начала сделки.
+    """
+    if columns:
+        if with_payments:
+            raise ValueError("with_payments работает только без columns")
+        stmt = select(*(getattr(CoffeeMachineORM, name) for name in columns))
+    else:
+        stmt = select(CoffeeMachineORM)
+        if with_payments:
+            stmt = stmt.options(selectinload(CoffeeMachineORM.payments_rel))
+    stmt = stmt.order_by(CoffeeMachineORM.id).execution_options(yield_per=chunk_size)
+    if status is not None:
+        stmt = stmt.where(CoffeeMachineORM.status == status)
+    if statuses:
+        stmt = stmt.where(_status_clause(statuses))
+    if started_from is not None or started_to is not None:
+        stmt = stmt.where(_date_range_clause(CoffeeMachineORM.start_date, started_from, started_to))
+    async with AsyncSessionLocal() as session:
+        result = await (session.stream(stmt) if columns else session.stream_scalars(stmt))
+        async for chunk in result.partitions():
+            yield chunk
+            # Отданные объекты больше не нужны сессии — не копим их в identity map
+            session.expunge_all()
+
+# Колонки Excel-отчёта: машины и платежи читаются столбцами, без ORM-объектов
+REPORT_MACHINE_COLUMNS = [
+    "id", "start_date", "tenant", "model", "barcode", "rent_price", "deposit", "full_price",
+    "phone", "in_1C", "status", "deal_type", "comment", "total_paid",
+]
+REPORT_PAYMENT_COLUMNS = ["id", "machine_id", "tenant", "amount", "payment_date", "is_deposit", "is_buyout"]
+
+async def _stream_columns(session, stmt, names: list[str], chunk_size: int) -> dict[str, list]:
+    columns = {name: [] for name in names}
+    result = await session.stream(stmt.execution_options(yield_per=chunk_size))
+    async for chunk in result.partitions():
+        for name, values in zip(names, zip(*chunk)):
+            columns[name].extend(values)
+    return columns
+
+async def fetch_report_columns(
+    chunk_size: int = REPORT_CHUNK_SIZE,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    statuses: tuple[str, ...] = (),
+) -> tuple[dict[str, list], dict[str, list]]:
+    """
+    Данные Excel-отчёта запросами Core, сразу по столбцам: {колонка: [значения]}.
+    Машины — по id, платежи — по (machine_id, payment_date, id); платежи без машины не попадают в отчёт.
+    Фильтры выполняются в SQL: статусы — по машинам и их платежам; период — платежи по payment_date,
+    машины начатые в периоде или с платежами в нём. С периодом у машин две вычисляемые колонки:
+    listed — сделка начата в периоде (попадает на листы сделок), paid_before — оплачено до начала
+    периода (для остатка на дату платежа).
+    """
+    machine_columns = [getattr(CoffeeMachineORM, name) for name in REPORT_MACHINE_COLUMNS]
+    machine_names = list(REPORT_MACHINE_COLUMNS)
+    machines_stmt = select(*machine_columns).order_by(CoffeeMachineORM.id)
+    payments_stmt = (
+        select(*(getattr(PaymentORM, name) for name in REPORT_PAYMENT_COLUMNS))
+        .where(PaymentORM.machine_id.is_not(None))
+        .order_by(PaymentORM.machine_id, PaymentORM.payment_date, PaymentORM.id)
+    )
+    if statuses:
+        machines_stmt = machines_stmt.where(_status_clause(statuses))
+        payments_stmt = payments_stmt.where(
+            PaymentORM.machine_id.in_(select(CoffeeMachineORM.id).where(_status_clause(statuses)))
+        )
+    if date_from is not None or date_to is not None:
+        started = _date_range_clause(CoffeeMachineORM.start_date, date_from, date_to)
+        paid_in_period = _date_range_clause(PaymentORM.payment_date, date_from, date_to)
+        paid_before = literal(0.0)
+        if date_from is not None:
+            paid_before = select(func.coalesce(func.sum(PaymentORM.amount), 0.0)).where(
+                PaymentORM.machine_id == CoffeeMachineORM.id,
+                PaymentORM.payment_date < date_from,
+            ).scalar_subquery()
+        machines_stmt = machines_stmt.add_columns(
+            started.label("listed"), paid_before.label("paid_before"),
+        ).where(or_(
+            started,
+            CoffeeMachineORM.id.in_(select(PaymentORM.machine_id).where(paid_in_period)),
+        ))
+        machine_names += ["listed", "paid_before"]
+        payments_stmt = payments_stmt.where(paid_in_period)
+    async with AsyncSessionLocal() as session:
+        machines = await _stream_columns(session, machines_stmt, machine_names, chunk_size)
+        payments = await _stream_columns(session, payments_stmt, REPORT_PAYMENT_COLUMNS, chunk_size)
+    return machines, payments
+
+async def get_machine_by_id(machine_id: int, with_payments: bool = False):
+    """Получить одну машину по первичному ключу (опционально вместе с платежами)"""
+    if not with_payments:
+        machine = machine_cache.get(machine_id)
+        if machine is not None:
+            return machine
+    generation = machine_cache.generation
+    stmt = select(CoffeeMachineORM).where(CoffeeMachineORM.id == machine_id)
+    if with_payments:
+        stmt = stmt.options(selectinload(CoffeeMachineORM.payments_rel))
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(stmt)
+        machine = result.scalar_one_or_none()
+    if machine is not None and not with_payments:
+        machine_cache.put(machine, generation)
+    return machine
+
+async def get_machines_by_ids(machine_ids: list[int], with_payments: bool = False):
+    """Получить несколько машин по списку id (опционально вместе с платежами)"""
+    if not machine_ids:
+        return []
+    stmt = select(CoffeeMachineORM).where(CoffeeMachineORM.id.in_(machine_ids)).order_by(CoffeeMachineORM.id)
+    if with_payments:
+        stmt = stmt.options(selectinload(CoffeeMachineORM.payments_rel))
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+async def get_machines_with_totals(status: Optional[str] = None):
+    """
+    Получить все машины вместе с агрегатами по платежам одним запросом.
+    Каждая строка содержит: machine, total_paid, deposit_total,
+    first_payment_date, last_payment_date, payment_count.
+    """
+    machine = aliased(CoffeeMachineORM, name="machine")
+    stmt = (
+        select(
+            machine,
+            func.coalesce(func.sum(PaymentORM.amount), 0.0).label("total_paid"),
+            func.coalesce(
+                func.sum(case((PaymentORM.is_deposit.is_(True), PaymentORM.amount), else_=0.0)), 0.0
+            ).label("deposit_total"),
+            func.min(PaymentORM.payment_date).label("first_payment_date"),
+            func.max(PaymentORM.payment_date).label("last_payment_date"),
+            func.count(PaymentORM.id).label("payment_count"),
+        )
+        .outerjoin(PaymentORM, PaymentORM.machine_id == machine.id)
+        .group_by(machine.id)
+        .order_by(machine.id)
+    )
+    if status is not None:
+        stmt = stmt.where(machine.status == status)
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(stmt)
+        return result.all()
+
 async def add_payment(payment_data: dict):
     async with AsyncSessionLocal() as session:
         payment = PaymentORM(**payment_data)
         session.add(payment)
+        if payment_data.get("machine_id") is not None:
+            # Итоги машины обновляем в той же транзакции, что и вставку платежа
+            await session.execute(
+                update(CoffeeMachineORM)
+                .where(CoffeeMachineORM.id == payment_data["machine_id"])
+                .values(
+                    total_paid=CoffeeMachineORM.total_paid + payment_data["amount"],
+                    payments_count=CoffeeMachineORM.payments_count + 1,
+                    last_payment_date=func.greatest(
+                        func.coalesce(CoffeeMachineORM.last_payment_date, payment_data["payment_date"]),
+                        payment_data["payment_date"],
+                    ),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            # Текущий (или задним числом — прошлый) месяц обновляем инкрементально
+            rollup = pg_insert(PaymentMonthRollupORM).values(
+                machine_id=payment_data["machine_id"],
+                month=payment_data["payment_date"].replace(day=1),
+                amount_sum=payment_data["amount"],
+                count=1,
+                first_payment_date=payment_data["payment_date"],
+            )
+            await session.execute(
+                rollup.on_conflict_do_update(
+                    index_elements=[PaymentMonthRollupORM.machine_id, PaymentMonthRollupORM.month],
+                    set_={
+                        "amount_sum": PaymentMonthRollupORM.amount_sum + rollup.excluded.amount_sum,
+                        "count": PaymentMonthRollupORM.count + 1,
+                        "first_payment_date": func.least(
+                            PaymentMonthRollupORM.first_payment_date, rollup.excluded.first_payment_date
+                        ),
+                    },
+                )
+            )
         await session.commit()
         await session.refresh(payment)
-        return payment
+    await _on_machines_changed([payment_data.get("machine_id")])
+    return payment
+
+async def add_payments_bulk(payments: list[dict]) -> list[int]:
+    """
+    Вставляет пачку платежей одной транзакцией (многострочный INSERT ... RETURNING id)
+    и пересчитывает итоги и помесячные суммы затронутых машин.
+    Все machine_id должны существовать, иначе ValueError и ничего не вставляется.
+    Пустой tenant берётся из машины. Выкуп закрывает сделку, как и при вводе платежа вручную:
+    status='buyout', buyout и buyout_date — дата последнего выкупа машины в пачке.
+    Возвращает id платежей в порядке входного списка.
+    """
+    if not payments:
+        return []
+    machine_ids = {p["machine_id"] for p in payments}
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(CoffeeMachineORM.id, CoffeeMachineORM.tenant).where(CoffeeMachineORM.id.in_(machine_ids))
+        )
+        tenants = dict(result.all())
+        missing = machine_ids - tenants.keys()
+        if missing:
+            raise ValueError(f"Не найдены сделки с id: {', '.join(map(str, sorted(missing)))}")
+
+        rows = [
+            {
+                "machine_id": p["machine_id"],
+                "tenant": p.get("tenant") or tenants[p["machine_id"]],
+                "amount": p["amount"],
+                "payment_date": p["payment_date"],
+                "is_deposit": p.get("is_deposit", False),
+                "is_buyout": p.get("is_buyout", False),
+            }
+            for p in payments
+        ]
+        result = await session.execute(
+            insert(PaymentORM).returning(PaymentORM.id, sort_by_parameter_order=True),
+            rows,
+        )
+        payment_ids = list(result.scalars().all())
+        await _refresh_machine_totals(session, machine_ids)
+        await _refresh_month_rollup(session, [(row["machine_id"], row["payment_date"]) for row in rows])
+        buyout_dates: dict[int, date] = {}
+        for row in rows:
+            if row["is_buyout"]:
+                machine_id = row["machine_id"]
+                buyout_dates[machine_id] = max(row["payment_date"], buyout_dates.get(machine_id, row["payment_date"]))
+        by_date: dict[date, list[int]] = {}
+        for machine_id, buyout_date in buyout_dates.items():
+            by_date.setdefault(buyout_date, []).append(machine_id)
+        for buyout_date, ids in by_date.items():
+            await session.execute(
+                update(CoffeeMachineORM)
+                .where(CoffeeMachineORM.id.in_(ids))
+                .values(status="buyout", buyout=True, buyout_date=buyout_date)
+                .execution_options(synchronize_session=False)
+            )
+        await session.commit()
+    await _on_machines_changed(machine_ids)
+    return payment_ids
 
 async def get_payments_by_machine(machine_id: int):
     async with AsyncSessionLocal() as session:
@@ -134,13 +921,10 @@ async def update_machine_status(machine_id: int, status: str, buyout: bool = Fal
             .values(**values)
         )
         await session.commit()
+    await _on_machines_changed([machine_id])
 
 async def get_machine_model_by_name(model_name: str):
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(MachineModelORM).where(MachineModelORM.name == model_name)
-        )
-        return result.scalar_one_or_none()
+    return await model_catalog.get_by_name(model_name)
 
 async def update_machine_full_price(machine_id: int, new_price: float):
     async with AsyncSessionLocal() as session:
@@ -148,6 +932,7 @@ async def update_machine_full_price(machine_id: int, new_price: float):
             update(CoffeeMachineORM).where(CoffeeMachineORM.id == machine_id).values(full_price=new_price)
         )
         await session.commit()
+    await _on_machines_changed([machine_id])
 
 async def update_machine_deal_type(machine_id: int, new_type: str):
     async with AsyncSessionLocal() as session:
@@ -155,6 +940,7 @@ async def update_machine_deal_type(machine_id: int, new_type: str):
             update(CoffeeMachineORM).where(CoffeeMachineORM.id == machine_id).values(deal_type=new_type)
         )
         await session.commit()
+    await _on_machines_changed([machine_id])
 
 async def update_machine_1c(machine_id: int, new_1c: bool):
     async with AsyncSessionLocal() as session:
@@ -162,6 +948,7 @@ async def update_machine_1c(machine_id: int, new_1c: bool):
             update(CoffeeMachineORM).where(CoffeeMachineORM.id == machine_id).values(in_1C=new_1c)
         )
         await session.commit()
+    await _on_machines_changed([machine_id])
 
 async def update_machine_rent_price(machine_id: int, new_rent: float):
     async with AsyncSessionLocal() as session:
@@ -169,6 +956,7 @@ async def update_machine_rent_price(machine_id: int, new_rent: float):
             update(CoffeeMachineORM).where(CoffeeMachineORM.id == machine_id).values(rent_price=new_rent)
         )
         await session.commit()
+    await _on_machines_changed([machine_id])
 
 async def get_last_payment_date(machine_id: int) -> Optional[date]:
     """Получить дату последнего платежа для машины"""
@@ -0,0 +1,201 @@
+"""
+Хранилище FSM aiogram в PostgreSQL (таблица fsm_state).
+
+Незавершённые диалоги (добавление сделки, платежа, редактирование и т.д.) переживают
+перезапуск и видны всем процессам бота. Запись идёт через небольшой буфер: изменения
+состояния и данных одного обработчика копятся FSM_WRITE_DELAY_MS и уходят одним UPSERT
+на все ключи; чтение сначала смотрит в буфер, поэтому процесс всегда видит свои записи.
+Диалоги, брошенные дольше FSM_STATE_TTL_HOURS, не читаются и периодически удаляются.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy import delete, func, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import FsmStateORM
+
+logger = logging.getLogger("fsm_storage")
+
+_KEY_COLUMNS = ("bot_id", "chat_id", "user_id", "thread_id", "business_connection_id", "destiny")
+
+# Как часто удалять брошенные диалоги, секунды
+CLEANUP_INTERVAL = 3600
+
+
+def _row_key(key: StorageKey) -> tuple:
+    return (key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.business_connection_id or "", key.destiny)
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class PostgresStorage(BaseStorage):
+    """
+    BaseStorage поверх общего пула соединений бота.
+    write_delay=0 — запись сразу в БД (без буфера); max_pending — размер буфера,
+    при котором он сбрасывается не дожидаясь таймера.
+    """
+
+    def __init__(self, session_factory, write_delay: float = 0.1, ttl: float = 24 * 3600, max_pending: int = 500):
+        self.session_factory = session_factory
+        self.write_delay = write_delay
+        self.ttl = ttl
+        self.max_pending = max_pending
+        # Ключ -> {"state": ..., "data": ...}; записываются только заданные поля
+        self._pending: dict[tuple, dict] = {}
+        # Записи, которые сейчас уходят в БД: до коммита читаем их отсюда
+        self._flushing: dict[tuple, dict] = {}
+        self._flush_lock = asyncio.Lock()
+        # Есть незаписанные изменения: фоновая задача без них спит, а не просыпается каждые write_delay
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_cleanup = time.monotonic()
+
+    # --- BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._write(key, "state", _state_name(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        found, value = self._buffered(key, "state")
+        if found:
+            return value
+        row = await self._load(key)
+        return row.state if row is not None else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._write(key, "data", dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        found, value = self._buffered(key, "data")
+        if found:
+            return dict(value)
+        row = await self._load(key)
+        return dict(row.data) if row is not None and row.data else {}
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    # --- Буфер записи ---
+
+    def _buffered(self, key: StorageKey, field: str) -> tuple[bool, Any]:
+        row_key = _row_key(key)
+        for source in (self._pending, self._flushing):
+            entry = source.get(row_key)
+            if entry is not None and field in entry:
+                return True, entry[field]
+        return False, None
+
+    async def _write(self, key: StorageKey, field: str, value) -> None:
+        self._pending.setdefault(_row_key(key), {})[field] = value
+        if self.write_delay <= 0 or len(self._pending) >= self.max_pending:
+            await self.flush()
+        else:
+            self._dirty.set()
+            self._ensure_task()
+
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            until_cleanup = CLEANUP_INTERVAL - (time.monotonic() - self._last_cleanup)
+            try:
+                await asyncio.wait_for(self._dirty.wait(), timeout=max(until_cleanup, 0))
+            except asyncio.TimeoutError:
+                pass
+            if self._dirty.is_set():
+                await asyncio.sleep(self.write_delay)
+                self._dirty.clear()
+                await self.flush()
+                # Не записалось — повторим через write_delay
+                if self._pending:
+                    self._dirty.set()
+            if time.monotonic() - self._last_cleanup >= CLEANUP_INTERVAL:
+                self._last_cleanup = time.monotonic()
+                try:
+                    await self.cleanup_expired()
+                except Exception:
+                    logger.exception("Не удалось удалить устаревшие состояния FSM")
+
+    async def flush(self) -> None:
+        """Записывает накопленные изменения; при ошибке оставляет их в буфере до следующей попытки."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            self._flushing, self._pending = self._pending, {}
+            try:
+                await self._write_entries(self._flushing)
+            except Exception:
+                logger.exception("Не удалось записать состояния FSM, повторим позже")
+                # Более новые записи из буфера важнее неудавшихся
+                for row_key, entry in self._flushing.items():
+                    self._pending[row_key] = {**entry, **self._pending.get(row_key, {})}
+            finally:
+                self._flushing = {}
+
+    async def _write_entries(self, entries: dict[tuple, dict]) -> None:
+        removed = []
+        by_fields: dict[tuple, list[dict]] = {}
+        for row_key, entry in entries.items():
+            # state.clear(): пустое состояние и данные — строка больше не нужна
+            if entry.get("state", ...) is None and entry.get("data", ...) == {}:
+                removed.append(row_key)
+                continue
+            row = dict(zip(_KEY_COLUMNS, row_key))
+            row.update(entry)
+            by_fields.setdefault(tuple(sorted(entry)), []).append(row)
+
+        async with self.session_factory() as session:
+            if removed:
+                key_columns = tuple_(*(getattr(FsmStateORM, c) for c in _KEY_COLUMNS))
+                await session.execute(delete(FsmStateORM).where(key_columns.in_(removed)))
+            for fields, rows in by_fields.items():
+                stmt = pg_insert(FsmStateORM).values(rows)
+                changes = {field: stmt.excluded[field] for field in fields}
+                changes["updated_at"] = func.now()
+                await session.execute(stmt.on_conflict_do_update(index_elements=list(_KEY_COLUMNS), set_=changes))
+            await session.commit()
+
+    # --- Чтение и очистка ---
+
+    def _expires_before(self):
+        return func.now() - timedelta(seconds=self.ttl)
+
+    async def _load(self, key: StorageKey):
+        row_key = _row_key(key)
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(FsmStateORM.state, FsmStateORM.data).where(
+                    *(getattr(FsmStateORM, c) == v for c, v in zip(_KEY_COLUMNS, row_key)),
+                    FsmStateORM.updated_at > self._expires_before(),
+                )
+            )
+            return result.first()
+
+    async def cleanup_expired(self) -> int:
+        """Удаляет диалоги, которые не менялись дольше TTL. Возвращает число удалённых."""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                delete(FsmStateORM).where(FsmStateORM.updated_at < self._expires_before())
+            )
+            await session.commit()
+        if result.rowcount:
+            logger.info("Удалено брошенных диалогов FSM: %s", result.rowcount)
+        return result.rowcount
@@ -3,7 +3,7 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
-from db import add_coffee_machine, get_all_machine_models
+from db import add_coffee_machine, get_all_machine_models, get_machine_model_by_id
 from utils.models_list import MODELS
 from utils.validators import validate_kg_phone, normalize_kg_phone
 from datetime import date, timedelta
@@ -37,8 +37,7 @@ async def start_add_machine(msg: Message, state: FSMContext):
 @router.callback_query(AddMachine.model, F.data.startswith("model_"))
 async def select_model(callback: CallbackQuery, state: FSMContext):
     model_id = int(callback.data.split("_")[1])
-    models = await get_all_machine_models()
-    model = next((m for m in models if m.id == model_id), None)
+    model = await get_machine_model_by_id(model_id)
     if not model:
         await callback.message.answer("Модель не найдена", reply_markup=main_menu_kb)
         await callback.answer()
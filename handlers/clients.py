@@ -4,15 +4,14 @@ from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
 from db import (
-    get_all_machines,
+    get_machine_by_id,
     update_machine_full_price,
     update_machine_deal_type,
     update_machine_1c,
     update_machine_rent_price,
     update_machine_status,
-    get_payments_by_machine,
     get_all_machine_models,
-    get_last_payment_date,
+    get_machines_with_totals,
 )
 from datetime import date, timedelta
 
@@ -24,13 +23,11 @@ async def get_client_info(machine):
     models = {m.name: m for m in await get_all_machine_models()}
     full_price = machine.full_price if machine.full_price else (models[machine.model].full_price if machine.model in models else 0)
     
-    # Получаем все платежи
-    all_payments = await get_payments_by_machine(machine.id)
-    total_paid = sum(p.amount for p in all_payments) + (machine.deposit if machine.deposit else 0)
+    # Итоги по платежам хранятся в самой машине
+    total_paid = machine.total_paid + (machine.deposit if machine.deposit else 0)
     remaining = max(full_price - total_paid, 0)
     
-    # Получаем дату последнего платежа
-    last_payment_date = await get_last_payment_date(machine.id)
+    last_payment_date = machine.last_payment_date
     if last_payment_date is None:
         last_payment_date = machine.start_date
     
@@ -80,24 +77,18 @@ class EditFSM(StatesGroup):
 
 @router.message(Command("clients"))
 async def show_clients(msg: Message, state: FSMContext):
-    machines = await get_all_machines()
-    active_machines = [m for m in machines if m.status == "active"]
+    active_rows = await get_machines_with_totals(status="active")
     
-    if not active_machines:
+    if not active_rows:
         await msg.answer("📋 Нет активных клиентов")
         return
     
     # Создаем кнопки с более подробной информацией
     kb_buttons = []
-    for m in active_machines:
-        # Получаем информацию о платежах
-        all_payments = await get_payments_by_machine(m.id)
-        total_paid = sum(p.amount for p in all_payments) + (m.deposit if m.deposit else 0)
-        
-        # Получаем дату последнего платежа
-        last_payment_date = await get_last_payment_date(m.id)
-        if last_payment_date is None:
-            last_payment_date = m.start_date
+    for row in active_rows:
+        m = row.machine
+        # Дата последнего платежа уже посчитана в агрегирующем запросе
+        last_payment_date = row.last_payment_date or m.start_date
         
         # Рассчитываем дату следующего платежа
         next_payment_date = last_payment_date + timedelta(days=32)
@@ -120,7 +111,7 @@ async def show_clients(msg: Message, state: FSMContext):
     
     kb = InlineKeyboardMarkup(inline_keyboard=kb_buttons)
     
-    summary_text = f"📋 **Активные клиенты ({len(active_machines)})**\n\n"
+    summary_text = f"📋 **Активные клиенты ({len(active_rows)})**\n\n"
     summary_text += f"🔴 ПРОШЛА - платеж просрочен\n"
     summary_text += f"🔴 СЕГОДНЯ - платеж сегодня\n"
     summary_text += f"🟡 Xд - платеж через X дней (срочно)\n"
@@ -136,8 +127,7 @@ async def select_client(callback: CallbackQuery, state: FSMContext):
     machine_id = int(callback.data.split("_")[1])
     
     # Получаем информацию о машине
-    machines = await get_all_machines()
-    machine = next((m for m in machines if m.id == machine_id), None)
+    machine = await get_machine_by_id(machine_id)
     
     if not machine:
         await callback.message.answer("Клиент не найден!")
@@ -163,8 +153,7 @@ async def select_client(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(EditFSM.action, F.data == "edit_price")
 async def edit_price_start(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    machines = await get_all_machines()
-    machine = next((m for m in machines if m.id == data["machine_id"]), None)
+    machine = await get_machine_by_id(data["machine_id"])
     
     if machine:
         current_price = machine.full_price if machine.full_price else "Не установлена"
@@ -191,8 +180,7 @@ async def edit_price_save(msg: Message, state: FSMContext):
     await update_machine_full_price(data["machine_id"], price)
     
     # Показываем обновленную информацию
-    machines = await get_all_machines()
-    machine = next((m for m in machines if m.id == data["machine_id"]), None)
+    machine = await get_machine_by_id(data["machine_id"])
     
     if machine:
         await msg.answer(f"✅ **Стоимость успешно обновлена!**\n\n"
@@ -209,8 +197,7 @@ async def edit_price_save(msg: Message, state: FSMContext):
 @router.callback_query(EditFSM.action, F.data == "edit_dealtype")
 async def edit_dealtype_start(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    machines = await get_all_machines()
-    machine = next((m for m in machines if m.id == data["machine_id"]), None)
+    machine = await get_machine_by_id(data["machine_id"])
     
     if machine:
         await callback.message.answer(f"📊 **Изменение типа сделки**\n\n"
@@ -236,8 +223,7 @@ async def edit_dealtype_save(callback: CallbackQuery, state: FSMContext):
     await update_machine_deal_type(data["machine_id"], new_type)
     
     # Показываем обновленную информацию
-    machines = await get_all_machines()
-    machine = next((m for m in machines if m.id == data["machine_id"]), None)
+    machine = await get_machine_by_id(data["machine_id"])
     
     if machine:
         await callback.message.answer(f"✅ **Тип сделки успешно обновлен!**\n\n"
@@ -255,8 +241,7 @@ async def edit_dealtype_save(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(EditFSM.action, F.data == "edit_1c")
 async def edit_1c_start(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    machines = await get_all_machines()
-    machine = next((m for m in machines if m.id == data["machine_id"]), None)
+    machine = await get_machine_by_id(data["machine_id"])
     
     if machine:
         current_1c = "✅ В 1С" if machine.in_1C else "❌ Без 1С"
@@ -283,8 +268,7 @@ async def edit_1c_save(callback: CallbackQuery, state: FSMContext):
     await update_machine_1c(data["machine_id"], new_1c)
     
     # Показываем обновленную информацию
-    machines = await get_all_machines()
-    machine = next((m for m in machines if m.id == data["machine_id"]), None)
+    machine = await get_machine_by_id(data["machine_id"])
     
     if machine:
         new_1c_text = "✅ В 1С" if new_1c else "❌ Без 1С"
@@ -303,8 +287,7 @@ async def edit_1c_save(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(EditFSM.action, F.data == "edit_rent")
 async def edit_rent_start(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    machines = await get_all_machines()
-    machine = next((m for m in machines if m.id == data["machine_id"]), None)
+    machine = await get_machine_by_id(data["machine_id"])
     
     if machine:
         await callback.message.answer(f"💵 **Изменение суммы аренды**\n\n"
@@ -323,8 +306,8 @@ async def edit_rent_start(callback: CallbackQuery, state: FSMContext):
 async def close_deal(callback: CallbackQuery, state: FSMContext):
     """Закрыть аренду без выкупа: статус 'returned', buyout=False."""
     data = await state.get_data()
-    machines = await get_all_machines()
-    machine = next((m for m in machines if m.id == data.get("machine_id")), None)
+    machine_id = data.get("machine_id")
+    machine = await get_machine_by_id(machine_id) if machine_id is not None else None
 
     if not machine:
         await callback.message.answer("Клиент не найден!")
@@ -348,8 +331,7 @@ async def edit_rent_save(msg: Message, state: FSMContext):
     await update_machine_rent_price(data["machine_id"], rent)
     
     # Показываем обновленную информацию
-    machines = await get_all_machines()
-    machine = next((m for m in machines if m.id == data["machine_id"]), None)
+    machine = await get_machine_by_id(data["machine_id"])
     
     if machine:
         await msg.answer(f"✅ **Сумма аренды успешно обновлена!**\n\n"
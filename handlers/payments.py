@@ -3,15 +3,15 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
-from db import get_all_machines, add_payment
+from db import get_machine_by_id, add_payment
 from datetime import date, timedelta, datetime
-from sqlalchemy import select, update
-from sqlalchemy.ext.asyncio import AsyncSession
-from db import AsyncSessionLocal
-from models import CoffeeMachineORM
+from db import update_machine_status
 from db import get_machine_model_by_name
 from db import get_all_machine_models
-from db import get_payments_by_machine
+from db import get_machines
+from db import add_payments_bulk
+from config import ADMIN_ID
+from utils.payments_import import parse_payments_file
 
 
 router = Router()
@@ -23,22 +23,25 @@ class AddPayment(StatesGroup):
     payment_date = State()
 
 
+class ImportPayments(StatesGroup):
+    waiting_file = State()
+
+
 @router.message(Command("payments"))
 async def start_payments(msg: Message, state: FSMContext):
-    machines = await get_all_machines()
-    active_machines = [m for m in machines if m.status == "active"]
+    active_machines = await get_machines(status="active")
 
     if not active_machines:
         await msg.answer("Нет активных кофемашин для внесения платежей.")
         return
 
+    # Модели нужны только для полной стоимости — загружаем один раз
+    models = {model.name: model for model in await get_all_machine_models()}
+
     kb_buttons = []
     for m in active_machines:
-        # Получаем модель машины для получения полной стоимости
-        models = {m.name: m for m in await get_all_machine_models()}
         full_price = m.full_price if m.full_price else (models[m.model].full_price if m.model in models else 0)
-        all_payments = await get_payments_by_machine(m.id)
-        total_paid = sum(p.amount for p in all_payments) + (m.deposit if m.deposit else 0)
+        total_paid = m.total_paid + (m.deposit if m.deposit else 0)
 
         # Расчет: цена - депозит - выплаты
         remaining = full_price - total_paid
@@ -75,8 +78,7 @@ async def select_payment_type(callback: CallbackQuery, state: FSMContext):
     
     # Определяем сумму по умолчанию
     data = await state.get_data()
-    machines = await get_all_machines()
-    machine = next((m for m in machines if m.id == data["machine_id"]), None)
+    machine = await get_machine_by_id(data["machine_id"])
     
     if payment_type == "rent":
         default_amount = machine.rent_price
@@ -88,8 +90,7 @@ async def select_payment_type(callback: CallbackQuery, state: FSMContext):
         # Рассчитываем остаток для выкупа
         models = {m.name: m for m in await get_all_machine_models()}
         full_price = machine.full_price if machine.full_price else (models[machine.model].full_price if machine.model in models else 0)
-        all_payments = await get_payments_by_machine(machine.id)
-        total_paid = sum(p.amount for p in all_payments)  # Учитываем все платежи включая депозиты
+        total_paid = machine.total_paid  # Учитываем все платежи включая депозиты
         remaining = max(full_price - total_paid, 0)
         await callback.message.answer(f"Полная стоимость: {full_price}\nУже оплачено: {total_paid}\nОстаток к доплате: {remaining}\nВведите сумму выкупа:")
     
@@ -101,8 +102,7 @@ async def input_payment_amount(msg: Message, state: FSMContext):
     if msg.text == '.':
         # Используем дефолтную сумму
         data = await state.get_data()
-        machines = await get_all_machines()
-        machine = next((m for m in machines if m.id == data["machine_id"]), None)
+        machine = await get_machine_by_id(data["machine_id"])
         
         if data["payment_type"] == "rent":
             amount = machine.rent_price
@@ -149,27 +149,13 @@ async def input_payment_date(msg: Message, state: FSMContext):
     }
     
     # Получаем данные машины для tenant
-    machines = await get_all_machines()
-    machine = next((m for m in machines if m.id == data["machine_id"]), None)
+    machine = await get_machine_by_id(data["machine_id"])
     if machine:
         payment_data["tenant"] = machine.tenant
         
-        # Обновляем статус машины в зависимости от типа платежа
-        async with AsyncSessionLocal() as session:
-            if data["payment_type"] == "buyout":
-                # Выкуп - меняем статус
-                await session.execute(
-                    update(CoffeeMachineORM)
-                    .where(CoffeeMachineORM.id == data["machine_id"])
-                    .values(
-                        status="buyout",
-                        buyout=True,
-                        buyout_date=payment_date
-                    )
-                )
-
-            
-            await session.commit()
+        # Выкуп - меняем статус
+        if data["payment_type"] == "buyout":
+            await update_machine_status(data["machine_id"], "buyout", buyout=True, buyout_date=payment_date)
     
     await add_payment(payment_data)
     
@@ -178,4 +164,42 @@ async def input_payment_date(msg: Message, state: FSMContext):
                     f"Сумма: {data['amount']}\n"
                     f"Дата: {payment_date}")
     
-    await state.clear() 
\ No newline at end of file
+    await state.clear()
+
+
+@router.message(Command("import_payments"))
+async def start_import_payments(msg: Message, state: FSMContext):
+    """Массовая загрузка платежей из Excel/CSV (только для администратора)"""
+    if msg.from_user is None or msg.from_user.id != ADMIN_ID:
+        await msg.answer("Команда доступна только администратору.")
+        return
+    await msg.answer(
+        "Отправьте файл .xlsx или .csv с колонками: ID сделки, Сумма, Дата платежа "
+        "(необязательно: Арендатор, Тип — Аренда/Депозит/Выкуп)."
+    )
+    await state.set_state(ImportPayments.waiting_file)
+
+
+@router.message(ImportPayments.waiting_file, F.document)
+async def import_payments_file(msg: Message, state: FSMContext):
+    buffer = await msg.bot.download(msg.document)
+    try:
+        payments = parse_payments_file(buffer.read(), msg.document.file_name or "")
+        if not payments:
+            await msg.answer("В файле нет платежей.")
+            return
+        payment_ids = await add_payments_bulk(payments)
+    except ValueError as e:
+        await msg.answer(f"Импорт не выполнен. {e}")
+        return
+    finally:
+        await state.clear()
+
+    total = sum(p["amount"] for p in payments)
+    await msg.answer(f"Импортировано платежей: {len(payment_ids)} на сумму {total:.2f}")
+
+
+@router.message(ImportPayments.waiting_file)
+async def import_payments_not_file(msg: Message, state: FSMContext):
+    await msg.answer("Ожидается файл .xlsx или .csv. Импорт отменён.")
+    await state.clear()
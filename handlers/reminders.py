@@ -1,6 +1,6 @@
 from aiogram import Router
 from aiogram.types import Message
-from db import get_all_machines, get_last_payment_date
+from db import get_machines_with_totals
 from datetime import date, timedelta
 import asyncio
 
@@ -10,17 +10,12 @@ router = Router()
 
 async def reminders_task(bot, chat_id):
     while True:
-        machines = await get_all_machines()
-        for machine in machines:
-            if str(machine.status) != "active":
-                continue
-            
-            # Получаем дату последнего платежа
-            last_payment_date = await get_last_payment_date(machine.id)
+        rows = await get_machines_with_totals(status="active")
+        for row in rows:
+            machine = row.machine
             
             # Если платежей нет, используем дату начала сделки
-            if last_payment_date is None:
-                last_payment_date = machine.start_date
+            last_payment_date = row.last_payment_date or machine.start_date
             
             # Рассчитываем дату следующего платежа от последнего платежа
             next_payment_date = last_payment_date + timedelta(days=32)
@@ -1,131 +1,170 @@
 from aiogram import Router, F
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, BufferedInputFile
-from aiogram.filters import Command
-from db import get_all_machines, get_payments_by_machine, get_all_machine_models, get_last_payment_date
-from utils.excel import generate_excel_report, generate_profit_share_report
+from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import ExceptionTypeFilter
+from aiogram.types import ErrorEvent
+from db import get_all_machine_models, get_model_counts
+from db import get_machines_with_totals, iter_machines, get_fleet_summary
+from db import get_payment_month_rollup, get_monthly_payment_totals, get_data_version, fetch_report_columns
+from utils.report_frames import render_excel_report, render_csv_export, render_parquet_export, PARQUET_AVAILABLE
+from utils.report_frames import render_profit_share_report
 from datetime import date, timedelta, datetime
-from utils.plots import plot_top_models, plot_starts_per_day, plot_starts_per_week
+from utils.plots import plot_top_models, plot_starts_per_day, plot_starts_per_week, plot_payments_dynamic, plot_cache
+from utils.report_cache import ReportCache
+from utils.report_filters import ReportFilters, NO_FILTERS, FILTERS_USAGE, parse_report_filters
+from utils.render_pool import render_pool, RenderError, RenderTimeout
 import asyncio
+from functools import partial
 
 router = Router()
 
+# Готовые отчёты и их file_id, действительные до следующей записи в БД
+report_cache = ReportCache()
+
+# Колонки машины, нужные для отчёта по распределению прибыли, и колонки помесячных выплат
+PROFIT_SHARE_COLUMNS = ["id", "start_date", "tenant", "deal_type", "model", "rent_price", "status"]
+PROFIT_SHARE_PAYOUT_COLUMNS = ["machine_id", "month", "amount_sum", "first_payment_date"]
+
 # Здесь будет логика генерации Excel-отчетов и графиков 
 
+@router.error(ExceptionTypeFilter(RenderError))
+async def render_failed(event: ErrorEvent):
+    """Отчёт или график не отрисовался в пуле — сообщаем пользователю вместо молчания"""
+    if isinstance(event.exception, RenderTimeout):
+        text = "Отчёт формируется слишком долго, попробуйте позже."
+    else:
+        text = "Не удалось сформировать отчёт, попробуйте ещё раз."
+    message = event.update.message or (event.update.callback_query and event.update.callback_query.message)
+    if message is not None:
+        await message.answer(text)
+    return True
+
+
+async def send_cached_report(msg: Message, key: str, filename: str, build):
+    """
+    Отправляет отчёт из кэша, если данные не менялись с прошлой сборки:
+    сначала по file_id Telegram, иначе готовыми байтами; build() вызывается только при промахе.
+    """
+    version = get_data_version()
+    cached = report_cache.get(key, version)
+    if cached is not None and cached.file_id:
+        try:
+            await msg.answer_document(cached.file_id)
+            return
+        except TelegramBadRequest:
+            # Telegram больше не принимает file_id — загрузим файл заново
+            report_cache.set_file_id(key, version, None)
+    if cached is None:
+        cached = report_cache.put(key, version, await build(), filename)
+    sent = await msg.answer_document(BufferedInputFile(cached.content, filename=cached.filename))
+    if sent is not None and sent.document is not None:
+        report_cache.set_file_id(key, version, sent.document.file_id)
+
+
+async def _parse_filters(msg: Message, args: str | None, usage: str) -> ReportFilters | None:
+    """Фильтры из аргументов команды; при ошибке отвечает подсказкой и возвращает None"""
+    try:
+        return parse_report_filters(args)
+    except ValueError as e:
+        await msg.answer(f"{e}.\n{usage}\n{FILTERS_USAGE}")
+        return None
+
+
 @router.message(Command("report"))
-async def send_excel_report(msg: Message):
-    machines = await get_all_machines()
-    models = {m.name: m for m in await get_all_machine_models()}
-    
-    # Разделяем на активные и закрытые сделки
-    active_machines = [m for m in machines if m.status == "active"]
-    closed_machines = [m for m in machines if m.status != "active"]
-    
-    # Преобразуем данные для Excel - активные кофемашины
-    active_machines_data = []
-    payments_data = []
-    closed_machines_data = []
-    
-    # Обрабатываем активные сделки
-    for m in active_machines:
-        # Получаем полную стоимость (индивидуальная или из модели)
-        full_price = m.full_price if m.full_price else (models[m.model].full_price if m.model in models else 0)
-        # Считаем сумму всех платежей (включая депозиты)
-        all_payments = await get_payments_by_machine(m.id)
-        total_paid = sum(p.amount for p in all_payments) + (m.deposit if m.deposit else 0)
-        remain = full_price - total_paid
-        
-        active_machines_data.append({
-            "Дата начала": m.start_date,
-            "Арендатор": m.tenant,
-            "Модель": m.model,
-            "Штрих-код": m.barcode,
-            "Оплата": m.rent_price,
-            "Залог": m.deposit,
-            "Полная стоимость": full_price,
-            "Телефон": m.phone,
-            "1С_статус": m.in_1C,
-            "Статус": "Открыта",
-            "Тип сделки": m.deal_type,
-            "Комментарий": m.comment or "",
-            "Остаток к выплате": remain,
-        })
-        
-        # Платежи по активной машине
-        for p in all_payments:
-            remain_p = max(full_price - sum(x.amount for x in all_payments if x.payment_date <= p.payment_date), 0)
-            payments_data.append({
-                "Модель кофемашины": m.model,
-                "Арендатор": p.tenant,
-                "Сумма": p.amount,
-                "Дата платежа": p.payment_date,
-                "Тип": "Депозит" if p.is_deposit else ("Выкуп" if p.is_buyout else "Аренда"),
-                "Остаток к доплате": remain_p,
-            })
-    
-    # Обрабатываем закрытые сделки
-    for m in closed_machines:
-        # Определяем статус
-        if m.status == "buyout":
-            status = "Закрыта (выкуп)"
-        elif m.status == "returned":
-            status = "Закрыта (возврат)"
-        elif m.status == "damaged":
-            status = "Закрыта (повреждена)"
-        else:
-            status = "Закрыта"
-            
-        # Получаем полную стоимость
-        full_price = m.full_price if m.full_price else (models[m.model].full_price if m.model in models else 0)
-        # Считаем сумму всех платежей (включая депозиты)
-        all_payments = await get_payments_by_machine(m.id)
-        total_paid = sum(p.amount for p in all_payments)
-        remain = max(full_price - total_paid, 0)
-        
-        closed_machines_data.append({
-            "Дата начала": m.start_date,
-            "Арендатор": m.tenant,
-            "Модель": m.model,
-            "Штрих-код": m.barcode,
-            "Оплата": m.rent_price,
-            "Залог": m.deposit,
-            "Полная стоимость": full_price,
-            "Телефон": m.phone,
-            "1С_статус": m.in_1C,
-            "Статус": status,
-            "Тип сделки": m.deal_type,
-            "Комментарий": m.comment or "",
-            "Остаток к выплате": remain,
-        })
-        
-        # Платежи по закрытой машине
-        for p in all_payments:
-            remain_p = max(full_price - sum(x.amount for x in all_payments if x.payment_date <= p.payment_date), 0)
-            payments_data.append({
-                "Модель кофемашины": m.model,
-                "Арендатор": p.tenant,
-                "Сумма": p.amount,
-                "Дата платежа": p.payment_date,
-                "Тип": "Депозит" if p.is_deposit else ("Выкуп" if p.is_buyout else "Аренда"),
-                "Остаток к доплате": remain_p,
-            })
-    
-    excel = generate_excel_report(active_machines_data, payments_data, closed_machines_data)
-    excel.seek(0)
-    await msg.answer_document(BufferedInputFile(excel.read(), filename="coffee_report.xlsx"))
+async def send_excel_report(msg: Message, command: CommandObject | None = None):
+    filters = await _parse_filters(msg, command and command.args, "Пример: /report 2025-01..2025-06 active")
+    if filters is None:
+        return
+    await send_cached_report(
+        msg, filters.cache_key("report"), filters.filename("coffee_report.xlsx"),
+        partial(build_excel_report, filters),
+    )
+
+
+async def build_excel_report(filters: ReportFilters = NO_FILTERS) -> bytes:
+    return await _render_report(render_excel_report, filters)
+
+
+async def _render_report(render, filters: ReportFilters = NO_FILTERS) -> bytes:
+    model_prices = {m.name: m.full_price for m in await get_all_machine_models()}
+    # Машины и платежи столбцами (Core, без ORM-объектов и словаря на строку), фильтры — в WHERE;
+    # листы собираются по столбцам и пишутся в файл в пуле отрисовки
+    machines, payments = await fetch_report_columns(
+        date_from=filters.date_from, date_to=filters.date_to, statuses=filters.statuses,
+    )
+    output = await render_pool.run(render, machines, payments, model_prices)
+    output.seek(0)
+    return output.read()
+
+
+# Форматы /export: данные /report без книги Excel
+EXPORT_RENDERERS = {
+    "csv": render_csv_export,
+    "parquet": render_parquet_export,
+}
+EXPORT_USAGE = "Использование: /export csv или /export parquet, можно с фильтрами: /export csv 2025 active"
+
+
+@router.message(Command("export"))
+async def send_export(msg: Message, command: CommandObject):
+    fmt, _, args = (command.args or "").strip().partition(" ")
+    fmt = fmt.lower()
+    if fmt not in EXPORT_RENDERERS:
+        await msg.answer(EXPORT_USAGE)
+        return
+    if fmt == "parquet" and not PARQUET_AVAILABLE:
+        await msg.answer("Выгрузка в Parquet недоступна: не установлен pyarrow. Используйте /export csv")
+        return
+    filters = await _parse_filters(msg, args, EXPORT_USAGE)
+    if filters is None:
+        return
+    await send_cached_report(
+        msg, filters.cache_key(f"export_{fmt}"), filters.filename(f"coffee_report_{fmt}.zip"),
+        partial(_render_report, EXPORT_RENDERERS[fmt], filters),
+    )
+
+
+async def send_plot(msg: Message, img, filename: str, caption: str):
+    """Отправляет график; если этот же график уже уходил в Telegram — по сохранённому file_id"""
+    key = getattr(img, "cache_key", None)
+    file_id = plot_cache.get_file_id(key) if key else None
+    if file_id:
+        try:
+            await msg.answer_photo(file_id, caption=caption)
+            return
+        except TelegramBadRequest:
+            plot_cache.set_file_id(key, None)
+    img.seek(0)
+    sent = await msg.answer_photo(BufferedInputFile(img.read(), filename=filename), caption=caption)
+    if key and sent is not None and sent.photo:
+        plot_cache.set_file_id(key, sent.photo[-1].file_id)
+
 
 @router.message(Command("plot"))
 async def choose_plot(msg: Message):
-    # Генерируем сразу график топ моделей
-    machines = await get_all_machines()
-    from collections import Counter
-    models = [m.model for m in machines]
-    counts = Counter(models)
-    data = [{"model": k, "count": v} for k, v in counts.items()]
+    # Генерируем сразу график топ моделей; считает сама БД, машины с платежами не грузим
+    data = [{"model": row.model, "count": row.count} for row in await get_model_counts()]
     img = await plot_top_models(data)
     
     if img:
-        img.seek(0)
-        await msg.answer_photo(BufferedInputFile(img.read(), filename="top_models.png"), caption="Топ моделей кофемашин")
+        await send_plot(msg, img, "top_models.png", "Топ моделей кофемашин")
+    else:
+        await msg.answer("Нет данных для построения графика")
+
+
+@router.message(Command("plot_payments"))
+async def plot_payments(msg: Message):
+    """График суммы платежей по месяцам (по таблице помесячных сумм)"""
+    totals = await get_monthly_payment_totals()
+    if not totals:
+        await msg.answer("Нет платежей для построения графика")
+        return
+    data = [{"month": row.month.strftime("%Y-%m"), "sum": row.amount_sum} for row in totals]
+    img = await plot_payments_dynamic(data)
+
+    if img:
+        await send_plot(msg, img, "payments_dynamic.png", "Платежи по месяцам")
     else:
         await msg.answer("Нет данных для построения графика")
 
@@ -150,15 +189,13 @@ async def plot_starts(msg: Message):
         today = date.today()
         target_month = (today.year, today.month)
 
-    machines = await get_all_machines()
+    rows = await get_machines_with_totals()
     day_counts = {}
 
-    for m in machines:
-        payments = await get_payments_by_machine(m.id)
-        payments = sorted(payments, key=lambda p: p.payment_date)
-        if not payments:
+    for row in rows:
+        first_payment = row.first_payment_date
+        if first_payment is None:
             continue
-        first_payment = payments[0].payment_date
         if (first_payment.year, first_payment.month) != target_month:
             continue
         day = f"{first_payment.day:02d}"
@@ -172,11 +209,7 @@ async def plot_starts(msg: Message):
 
     month_label = f"{target_month[0]:04d}-{target_month[1]:02d}"
     img = await plot_starts_per_day(data, month_label)
-    img.seek(0)
-    await msg.answer_photo(
-        BufferedInputFile(img.read(), filename=f"starts_{month_label}.png"),
-        caption=f"Старт сделок по дням ({month_label})"
-    )
+    await send_plot(msg, img, f"starts_{month_label}.png", f"Старт сделок по дням ({month_label})")
 
 
 @router.message(Command("plot_starts_week"))
@@ -197,16 +230,14 @@ async def plot_starts_week(msg: Message):
         today = date.today()
         target_month = (today.year, today.month)
 
-    machines = await get_all_machines()
+    rows = await get_machines_with_totals()
     week_counts = {}
     week_ranges = {}
 
-    for m in machines:
-        payments = await get_payments_by_machine(m.id)
-        payments = sorted(payments, key=lambda p: p.payment_date)
-        if not payments:
+    for row in rows:
+        first_payment = row.first_payment_date
+        if first_payment is None:
             continue
-        first_payment = payments[0].payment_date
         if (first_payment.year, first_payment.month) != target_month:
             continue
         iso_year, iso_week, _ = first_payment.isocalendar()
@@ -228,74 +259,58 @@ async def plot_starts_week(msg: Message):
 
     month_label = f"{target_month[0]:04d}-{target_month[1]:02d}"
     img = await plot_starts_per_week(data, month_label)
-    img.seek(0)
-    await msg.answer_photo(
-        BufferedInputFile(img.read(), filename=f"starts_week_{month_label}.png"),
-        caption=f"Старт сделок по неделям ({month_label})"
-    )
+    await send_plot(msg, img, f"starts_week_{month_label}.png", f"Старт сделок по неделям ({month_label})")
 
 @router.message(Command("summary"))
 async def send_summary(msg: Message):
-    machines = await get_all_machines()
-    # Теперь просроченные платежи рассчитываются динамически от последнего платежа
-    overdue = []
-    for m in machines:
-        if m.status != "active":
-            continue
-        # Получаем дату последнего платежа
-        last_payment_date = await get_last_payment_date(m.id)
-        if last_payment_date is None:
-            last_payment_date = m.start_date
-        
-        # Рассчитываем дату следующего платежа
-        next_payment_date = last_payment_date + timedelta(days=30)
-        if next_payment_date < date.today():
-            overdue.append(m)
-    # Рассчитываем планируемую прибыль за месяц от активных сделок
-    one_month_sum = sum(m.rent_price for m in machines if m.status == "active")
-    m_act = [m for m in machines if m.status == "active"]
-    text = (f"Всего кофемашин в аренде: {len(m_act)}\nПросрочено платежей: {len(overdue)}"
-            f"\nСумма денег в депозитах: {sum(m.deposit for m in m_act if m.deposit)}"
-            f"\nПланируемая прибыль за месяц: {one_month_sum}"
-            f"\nКоличество сделок, которых нет в 1С: {sum(1 for m in m_act if not m.in_1C)}")
+    # Показатели ведутся в памяти и обновляются при каждой записи в db.py
+    summary = await get_fleet_summary()
+    text = (f"Всего кофемашин в аренде: {summary['active']}\nПросрочено платежей: {summary['overdue']}"
+            f"\nСумма денег в депозитах: {summary['deposit_sum']}"
+            f"\nПланируемая прибыль за месяц: {summary['monthly_income']}"
+            f"\nКоличество сделок, которых нет в 1С: {summary['not_in_1c']}")
     await msg.answer(text) 
 
 
 @router.message(Command("profit"))
-async def send_profit_share(msg: Message):
+async def send_profit_share(msg: Message, command: CommandObject | None = None):
+    filters = await _parse_filters(msg, command and command.args, "Пример: /profit 2025 active")
+    if filters is None:
+        return
+    await send_cached_report(
+        msg, filters.cache_key("profit"), filters.filename("profit_share.xlsx"),
+        partial(build_profit_share_report, filters),
+    )
+
+
+async def build_profit_share_report(filters: ReportFilters = NO_FILTERS) -> bytes:
     """
     Формирует Excel с выплатами.
     Лист = месяц старта арендатора.
     В месячных колонках отражаются только фактические платежи из БД,
     без деления сумм и без автодоначисления пустых месяцев.
+    Период фильтрует сделки по дате оформления (когорта), их выплаты показываются целиком.
     """
-    machines = await get_all_machines()
-    rows = []
-
-    for m in machines:
-        payments = await get_payments_by_machine(m.id)
-        payments = sorted(payments, key=lambda p: p.payment_date)
-        first_payment_dt = payments[0].payment_date if payments else m.start_date
-        start_month_label = first_payment_dt.strftime("%Y-%m")
-
-        month_payouts: dict[str, float] = {}
-        for p in payments:
-            month_label = p.payment_date.strftime("%Y-%m")
-            month_payouts[month_label] = month_payouts.get(month_label, 0) + p.amount
-
-        row_base = {
-            "Месяц старта": start_month_label,
-            "Дата первого платежа": first_payment_dt,
-            "Дата оформления": m.start_date,
-            "Арендатор": m.tenant,
-            "Тип сделки": m.deal_type,
-            "Модель": m.model,
-            "Аренда": m.rent_price,
-            "Статус": m.status,
-        }
-        for ml, val in month_payouts.items():
-            row_base[ml] = val
-        rows.append(row_base)
-
-    excel = generate_profit_share_report(rows)
-    await msg.answer_document(BufferedInputFile(excel.read(), filename="profit_share.xlsx"))
+    # Машины — столбцами, выплаты — длинной таблицей из помесячной сводки; листы собирает
+    # один pivot_table в пуле отрисовки (build_profit_share_sheets)
+    machines = {name: [] for name in PROFIT_SHARE_COLUMNS}
+    payouts = {name: [] for name in PROFIT_SHARE_PAYOUT_COLUMNS}
+
+    async for chunk in iter_machines(
+        columns=PROFIT_SHARE_COLUMNS,
+        statuses=filters.statuses,
+        started_from=filters.date_from,
+        started_to=filters.date_to,
+    ):
+        for name in PROFIT_SHARE_COLUMNS:
+            machines[name].extend(getattr(m, name) for m in chunk)
+        rollup = await get_payment_month_rollup([m.id for m in chunk])
+        for machine_id, months in rollup.items():
+            for r in months:
+                payouts["machine_id"].append(machine_id)
+                payouts["month"].append(r.month)
+                payouts["amount_sum"].append(r.amount_sum)
+                payouts["first_payment_date"].append(r.first_payment_date)
+
+    excel = await render_pool.run(render_profit_share_report, machines, payouts)
+    return excel.read()
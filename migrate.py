@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Накатывает версионированные миграции из пакета migrations/.
+Запускается при старте контейнера перед bot.py; повторный запуск ничего не делает.
+"""
+
+import asyncio
+import asyncpg
+from config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+from migrations import apply_migrations
+
+
+async def run_migrations(log=print) -> list[int]:
+    """Подключается к БД и применяет все ещё не применённые миграции"""
+    conn = await asyncpg.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME
+    )
+    try:
+        return await apply_migrations(conn, log=log)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск миграций")
+    print("=" * 50)
+
+    applied = asyncio.run(run_migrations())
+
+    print("=" * 50)
+    if applied:
+        print(f"✅ Применено миграций: {len(applied)}")
+    else:
+        print("ℹ️  Схема уже актуальна")
@@ -0,0 +1,51 @@
+"""Исходная схема: кофемашины, платежи и модели кофемашин."""
+
+DESCRIPTION = "исходная схема таблиц"
+
+
+async def upgrade(conn):
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS coffee_machines (
+            id SERIAL PRIMARY KEY,
+            model VARCHAR(100) NOT NULL,
+            barcode VARCHAR(100) NOT NULL UNIQUE,
+            rent_price DOUBLE PRECISION NOT NULL,
+            tenant VARCHAR(100) NOT NULL,
+            phone VARCHAR(20) NOT NULL,
+            deposit DOUBLE PRECISION NOT NULL,
+            start_date DATE NOT NULL,
+            "in_1C" BOOLEAN,
+            status VARCHAR(20),
+            buyout BOOLEAN,
+            buyout_date DATE,
+            payments DATE[],
+            deal_type VARCHAR(20),
+            comment TEXT,
+            full_price DOUBLE PRECISION
+        )
+        """
+    )
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            id SERIAL PRIMARY KEY,
+            machine_id INTEGER REFERENCES coffee_machines (id),
+            tenant VARCHAR(100) NOT NULL,
+            amount DOUBLE PRECISION NOT NULL,
+            payment_date DATE NOT NULL,
+            is_deposit BOOLEAN,
+            is_buyout BOOLEAN
+        )
+        """
+    )
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS machine_models (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL UNIQUE,
+            default_rent DOUBLE PRECISION NOT NULL,
+            full_price DOUBLE PRECISION NOT NULL
+        )
+        """
+    )
@@ -0,0 +1,7 @@
+"""Удаление устаревшего поля payment_date из coffee_machines (бывший run_migration.py)."""
+
+DESCRIPTION = "удаление поля coffee_machines.payment_date"
+
+
+async def upgrade(conn):
+    await conn.execute("ALTER TABLE coffee_machines DROP COLUMN IF EXISTS payment_date")
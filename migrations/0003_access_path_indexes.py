@@ -0,0 +1,27 @@
+"""Индексы под реальные запросы бота (см. models.py). Строятся без блокировки записи."""
+
+from migrations import create_index_concurrently
+
+DESCRIPTION = "индексы по платежам, активным сделкам и ФИО арендатора"
+TRANSACTIONAL = False  # CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции
+
+INDEXES = [
+    ("ix_payments_machine_id_payment_date",
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_payments_machine_id_payment_date "
+     "ON payments (machine_id, payment_date DESC)"),
+    ("ix_coffee_machines_active",
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_coffee_machines_active "
+     "ON coffee_machines (id) WHERE status = 'active'"),
+    ("ix_coffee_machines_tenant_trgm",
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_coffee_machines_tenant_trgm "
+     "ON coffee_machines USING gin (tenant gin_trgm_ops)"),
+    ("ix_payments_tenant_trgm",
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_payments_tenant_trgm "
+     "ON payments USING gin (tenant gin_trgm_ops)"),
+]
+
+
+async def upgrade(conn):
+    await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, ddl in INDEXES:
+        await create_index_concurrently(conn, name, ddl)
@@ -0,0 +1,31 @@
+"""Денормализованные итоги по платежам в coffee_machines и их первичное заполнение."""
+
+DESCRIPTION = "колонки total_paid, last_payment_date, payments_count в coffee_machines"
+
+
+async def upgrade(conn):
+    await conn.execute(
+        """
+        ALTER TABLE coffee_machines
+            ADD COLUMN IF NOT EXISTS total_paid DOUBLE PRECISION NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS last_payment_date DATE,
+            ADD COLUMN IF NOT EXISTS payments_count INTEGER NOT NULL DEFAULT 0
+        """
+    )
+    await conn.execute(
+        """
+        UPDATE coffee_machines m
+        SET total_paid = agg.total_paid,
+            last_payment_date = agg.last_payment_date,
+            payments_count = agg.payments_count
+        FROM (
+            SELECT machine_id,
+                   SUM(amount) AS total_paid,
+                   MAX(payment_date) AS last_payment_date,
+                   COUNT(*) AS payments_count
+            FROM payments
+            GROUP BY machine_id
+        ) agg
+        WHERE agg.machine_id = m.id
+        """
+    )
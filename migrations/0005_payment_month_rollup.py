@@ -0,0 +1,32 @@
+"""Таблица помесячных сумм платежей для /profit и графика динамики платежей."""
+
+DESCRIPTION = "таблица payment_month_rollup и её первичное заполнение"
+
+
+async def upgrade(conn):
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payment_month_rollup (
+            machine_id INTEGER NOT NULL REFERENCES coffee_machines (id) ON DELETE CASCADE,
+            month DATE NOT NULL,
+            amount_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            first_payment_date DATE NOT NULL,
+            PRIMARY KEY (machine_id, month)
+        )
+        """
+    )
+    await conn.execute(
+        """
+        INSERT INTO payment_month_rollup (machine_id, month, amount_sum, count, first_payment_date)
+        SELECT machine_id,
+               date_trunc('month', payment_date)::date,
+               SUM(amount),
+               COUNT(*),
+               MIN(payment_date)
+        FROM payments
+        WHERE machine_id IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (machine_id, month) DO NOTHING
+        """
+    )
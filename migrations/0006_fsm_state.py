@@ -0,0 +1,22 @@
+"""Таблица состояний FSM, чтобы незавершённые диалоги переживали перезапуск и были общими для реплик."""
+
+DESCRIPTION = "таблица fsm_state для хранилища FSM в PostgreSQL"
+
+
+async def upgrade(conn):
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fsm_state (
+            bot_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            thread_id BIGINT NOT NULL DEFAULT 0,
+            destiny VARCHAR(50) NOT NULL DEFAULT 'default',
+            state VARCHAR(200),
+            data JSONB NOT NULL DEFAULT '{}'::jsonb,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+        )
+        """
+    )
+    await conn.execute("CREATE INDEX IF NOT EXISTS ix_fsm_state_updated_at ON fsm_state (updated_at)")
@@ -0,0 +1,20 @@
+"""Индексы под фильтры отчётов по периоду: платежи по payment_date, сделки по start_date (см. models.py)."""
+
+from migrations import create_index_concurrently
+
+DESCRIPTION = "индексы по дате платежа и дате начала сделки для отчётов за период"
+TRANSACTIONAL = False  # CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции
+
+INDEXES = [
+    ("ix_payments_payment_date",
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_payments_payment_date "
+     "ON payments (payment_date)"),
+    ("ix_coffee_machines_start_date",
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_coffee_machines_start_date "
+     "ON coffee_machines (start_date)"),
+]
+
+
+async def upgrade(conn):
+    for name, ddl in INDEXES:
+        await create_index_concurrently(conn, name, ddl)
@@ -0,0 +1,34 @@
+"""
+Уведомления об изменении данных для согласования кэшей между репликами (см. cache_sync.py).
+
+Триггер уровня оператора на каждой таблице, от которой зависят кэши в памяти процесса,
+шлёт NOTIFY data_changed с именем таблицы и application_name записавшего соединения —
+по нему реплика отличает свои записи от чужих. Одинаковые уведомления внутри транзакции
+PostgreSQL склеивает, так что массовая загрузка даёт одно уведомление на таблицу.
+"""
+
+DESCRIPTION = "триггеры NOTIFY data_changed на таблицах с данными сделок"
+
+CHANNEL = "data_changed"
+TABLES = ("coffee_machines", "payments", "payment_month_rollup", "machine_models")
+
+
+async def upgrade(conn):
+    await conn.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION notify_data_changed() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM pg_notify('{CHANNEL}', TG_TABLE_NAME || ' ' || current_setting('application_name'));
+            RETURN NULL;
+        END
+        $$
+        """
+    )
+    for table in TABLES:
+        await conn.execute(f"DROP TRIGGER IF EXISTS {table}_data_changed ON {table}")
+        await conn.execute(
+            f"CREATE TRIGGER {table}_data_changed "
+            f"AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION notify_data_changed()"
+        )
@@ -0,0 +1,17 @@
+"""Бизнес-подключение в ключе состояния FSM: диалоги одного чата через разные бизнес-аккаунты не смешиваются."""
+
+DESCRIPTION = "business_connection_id в первичном ключе fsm_state"
+
+
+async def upgrade(conn):
+    # '' — обновление не через бизнес-подключение, как thread_id = 0 без темы форума
+    await conn.execute(
+        "ALTER TABLE fsm_state ADD COLUMN IF NOT EXISTS business_connection_id VARCHAR(100) NOT NULL DEFAULT ''"
+    )
+    await conn.execute(
+        """
+        ALTER TABLE fsm_state
+            DROP CONSTRAINT IF EXISTS fsm_state_pkey,
+            ADD PRIMARY KEY (bot_id, chat_id, user_id, thread_id, business_connection_id, destiny)
+        """
+    )
@@ -0,0 +1,128 @@
+"""
+Версионированные миграции схемы БД.
+
+Каждая миграция — модуль NNNN_описание.py в этом пакете с функцией
+`async def upgrade(conn)` (conn — соединение asyncpg) и необязательными атрибутами:
+- DESCRIPTION — человекочитаемое описание;
+- TRANSACTIONAL — False, если миграция не может выполняться в транзакции
+  (например, CREATE INDEX CONCURRENTLY). Такие миграции обязаны быть идемпотентными.
+
+Применённые версии хранятся в таблице schema_version.
+"""
+
+import importlib
+import pkgutil
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable
+
+_MODULE_RE = re.compile(r"^(\d{4})_(\w+)$")
+
+# Ключ advisory lock, чтобы две реплики не накатывали миграции одновременно
+MIGRATION_LOCK_KEY = 726_501_001
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    description: str
+    transactional: bool
+    upgrade: Callable[..., Awaitable[None]]
+
+
+def discover_migrations() -> list[Migration]:
+    """Находит модули миграций и возвращает их по возрастанию версии."""
+    migrations = []
+    for module_info in pkgutil.iter_modules([str(Path(__file__).parent)]):
+        match = _MODULE_RE.match(module_info.name)
+        if not match:
+            continue
+        module = importlib.import_module(f"{__name__}.{module_info.name}")
+        migrations.append(Migration(
+            version=int(match.group(1)),
+            name=module_info.name,
+            description=getattr(module, "DESCRIPTION", match.group(2)),
+            transactional=getattr(module, "TRANSACTIONAL", True),
+            upgrade=module.upgrade,
+        ))
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Повторяющиеся номера миграций: {versions}")
+    return migrations
+
+
+async def ensure_version_table(conn) -> None:
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(200) NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+
+
+async def get_applied_versions(conn) -> set[int]:
+    rows = await conn.fetch("SELECT version FROM schema_version")
+    return {row["version"] for row in rows}
+
+
+async def create_index_concurrently(conn, name: str, ddl: str) -> None:
+    """
+    Создаёт индекс через CREATE INDEX CONCURRENTLY IF NOT EXISTS.
+    Если прошлая попытка оборвалась и оставила невалидный индекс — удаляет его и строит заново.
+    """
+    is_valid = await conn.fetchval(
+        """
+        SELECT i.indisvalid FROM pg_class c
+        JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = $1
+        """,
+        name,
+    )
+    if is_valid is False:
+        await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+    await conn.execute(ddl)
+
+
+async def apply_migrations(conn, migrations: list[Migration] | None = None, log=print) -> list[int]:
+    """
+    Применяет ещё не применённые миграции по порядку.
+    Транзакционные миграции выполняются вместе с записью в schema_version в одной транзакции.
+    Возвращает список применённых версий.
+    """
+    if migrations is None:
+        migrations = discover_migrations()
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_KEY)
+    try:
+        await ensure_version_table(conn)
+        applied = await get_applied_versions(conn)
+        done = []
+        for migration in migrations:
+            if migration.version in applied:
+                continue
+            log(f"⏳ {migration.name}: {migration.description}")
+            if migration.transactional:
+                async with conn.transaction():
+                    await migration.upgrade(conn)
+                    await _mark_applied(conn, migration)
+            else:
+                await migration.upgrade(conn)
+                await _mark_applied(conn, migration)
+            log(f"✅ {migration.name}")
+            done.append(migration.version)
+        return done
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
+
+
+async def _mark_applied(conn, migration: Migration) -> None:
+    await conn.execute(
+        "INSERT INTO schema_version (version, name) VALUES ($1, $2) ON CONFLICT (version) DO NOTHING",
+        migration.version,
+        migration.name,
+    )
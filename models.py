@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, Date, Boolean, ForeignKey, ARRAY, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Date, DateTime, Boolean, ForeignKey, ARRAY, Text, Index, text, func
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import date
@@ -25,8 +26,22 @@ class CoffeeMachineORM(Base):
     deal_type = Column(String(20), default='Аренда')  # Аренда или Рассрочка
     comment = Column(Text, nullable=True)
     full_price = Column(Float, nullable=True)  # Индивидуальная стоимость
+    # Денормализованные итоги по платежам, обновляются в одной транзакции с платежами
+    total_paid = Column(Float, nullable=False, default=0, server_default='0')
+    last_payment_date = Column(Date, nullable=True)
+    payments_count = Column(Integer, nullable=False, default=0, server_default='0')
     payments_rel = relationship('PaymentORM', back_populates='machine')
 
+    __table_args__ = (
+        # Частичный индекс: почти все экраны работают только с активными сделками
+        Index('ix_coffee_machines_active', 'id', postgresql_where=text("status = 'active'")),
+        # Триграммный индекс для поиска по ФИО через ilike('%...%'), нужен pg_trgm
+        Index(
+            'ix_coffee_machines_tenant_trgm', 'tenant',
+            postgresql_using='gin', postgresql_ops={'tenant': 'gin_trgm_ops'},
+        ),
+    )
+
 class PaymentORM(Base):
     __tablename__ = 'payments'
     id = Column(Integer, primary_key=True)
@@ -38,6 +53,20 @@ class PaymentORM(Base):
     is_buyout = Column(Boolean, default=False)
     machine = relationship('CoffeeMachineORM', back_populates='payments_rel')
 
+    __table_args__ = (
+        Index(
+            'ix_payments_tenant_trgm', 'tenant',
+            postgresql_using='gin', postgresql_ops={'tenant': 'gin_trgm_ops'},
+        ),
+    )
+
+
+# Платежи машины и последний платёж: WHERE machine_id = ? ORDER BY payment_date DESC
+Index('ix_payments_machine_id_payment_date', PaymentORM.machine_id, PaymentORM.payment_date.desc())
+# Отчёты за период: WHERE payment_date BETWEEN ? AND ? / WHERE start_date BETWEEN ? AND ?
+Index('ix_payments_payment_date', PaymentORM.payment_date)
+Index('ix_coffee_machines_start_date', CoffeeMachineORM.start_date)
+
 # Pydantic-схемы для валидации и передачи данных
 class CoffeeMachine(BaseModel):
     id: Optional[int] = None
@@ -56,6 +85,9 @@ class CoffeeMachine(BaseModel):
     deal_type: str = "Аренда"
     comment: Optional[str] = None
     full_price: Optional[float] = None
+    total_paid: float = 0
+    last_payment_date: Optional[date] = None
+    payments_count: int = 0
 
 class Payment(BaseModel):
     id: Optional[int] = None
@@ -71,4 +103,31 @@ class MachineModelORM(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False, unique=True)
     default_rent = Column(Float, nullable=False)
-    full_price = Column(Float, nullable=False, default=0) 
\ No newline at end of file
+    full_price = Column(Float, nullable=False, default=0) 
+
+class PaymentMonthRollupORM(Base):
+    """Помесячные суммы платежей по машине; обновляются вместе с платежами."""
+    __tablename__ = 'payment_month_rollup'
+    machine_id = Column(Integer, ForeignKey('coffee_machines.id', ondelete='CASCADE'), primary_key=True)
+    month = Column(Date, primary_key=True)  # первое число месяца
+    amount_sum = Column(Float, nullable=False, default=0, server_default='0')
+    count = Column(Integer, nullable=False, default=0, server_default='0')
+    first_payment_date = Column(Date, nullable=False)  # самый ранний платёж машины в этом месяце
+
+class FsmStateORM(Base):
+    """Состояние и данные незавершённого диалога (FSM aiogram), общие для всех процессов бота."""
+    __tablename__ = 'fsm_state'
+    bot_id = Column(BigInteger, primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    thread_id = Column(BigInteger, primary_key=True, default=0, server_default='0')  # 0 — без темы форума
+    business_connection_id = Column(String(100), primary_key=True, default='', server_default='')  # '' — без бизнес-подключения
+    destiny = Column(String(50), primary_key=True, default='default', server_default='default')
+    state = Column(String(200), nullable=True)
+    data = Column(JSONB, nullable=False, default=dict, server_default=text("'{}'::jsonb"))
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        # Для удаления брошенных диалогов по давности
+        Index('ix_fsm_state_updated_at', 'updated_at'),
+    )
@@ -37,6 +37,9 @@ def mock_coffee_machine():
     machine.deal_type = "Аренда"
     machine.comment = None
     machine.full_price = 300000.0
+    machine.total_paid = 0.0
+    machine.last_payment_date = None
+    machine.payments_count = 0
     machine.payments_rel = []
     return machine
 
@@ -100,3 +103,69 @@ def sample_payment_data():
         "is_buyout": False
     }
 
+
+
+@pytest.fixture
+def make_ledger_row():
+    """Фикстура-фабрика строки из get_machines_with_totals"""
+    def _make(machine, total_paid=0.0, deposit_total=0.0, first_payment_date=None,
+              last_payment_date=None, payment_count=0):
+        row = MagicMock()
+        row.machine = machine
+        row.total_paid = total_paid
+        row.deposit_total = deposit_total
+        row.first_payment_date = first_payment_date
+        row.last_payment_date = last_payment_date
+        row.payment_count = payment_count
+        return row
+    return _make
+
+
+@pytest.fixture
+def make_machine_stream():
+    """Фикстура-фабрика замены iter_machines: отдаёт заданные пачки машин"""
+    def _make(*chunks):
+        async def _stream(*args, **kwargs):
+            for chunk in chunks:
+                yield list(chunk)
+        return MagicMock(side_effect=_stream)
+    return _make
+
+
+@pytest.fixture
+def make_report_columns():
+    """Фабрика столбцов fetch_report_columns из моков машин и платежей"""
+    from db import REPORT_MACHINE_COLUMNS, REPORT_PAYMENT_COLUMNS
+    def _make(machines, payments=()):
+        return (
+            {name: [getattr(m, name) for m in machines] for name in REPORT_MACHINE_COLUMNS},
+            {name: [getattr(p, name) for p in payments] for name in REPORT_PAYMENT_COLUMNS},
+        )
+    return _make
+
+
+@pytest.fixture(autouse=True)
+def reset_db_caches():
+    """Кэши и показатели /summary живут на уровне модулей — сбрасываем их между тестами"""
+    import db
+    from handlers.reports import report_cache
+    db.invalidate_model_cache()
+    db.machine_cache.clear()
+    db.fleet_summary.clear()
+    report_cache.clear()
+    yield
+    db.invalidate_model_cache()
+    db.machine_cache.clear()
+    db.fleet_summary.clear()
+    report_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def isolated_plot_cache(tmp_path, monkeypatch):
+    """Дисковый кэш графиков во временной папке, чтобы тесты не писали в backups/"""
+    import utils.plots
+    from utils.plot_cache import PlotCache
+    cache = PlotCache(tmp_path / "plot_cache", 10 * 1024 * 1024)
+    monkeypatch.setattr(utils.plots, "plot_cache", cache)
+    monkeypatch.setattr("handlers.reports.plot_cache", cache)
+    return cache
@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+import db
+from cache_sync import CHANNEL, DataChangeListener
+
+
+class _FakeConnection:
+    """Заглушка соединения asyncpg: запоминает слушателей и умеет «оборваться»"""
+
+    def __init__(self):
+        self.listeners = {}
+        self.termination_listeners = []
+        self.closed = False
+        self.execute = AsyncMock()
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    def notify(self, payload):
+        self.listeners[CHANNEL](self, 1, CHANNEL, payload)
+
+    def terminate(self):
+        self.closed = True
+        for callback in self.termination_listeners:
+            callback(self)
+
+    def is_closed(self):
+        return self.closed
+
+    async def close(self):
+        self.closed = True
+
+
+class TestApplyRemoteChange:
+    """Тесты для сброса кэшей по записи другой реплики"""
+
+    def test_machine_tables_clear_machine_caches(self):
+        """Тест что изменение машин или платежей сбрасывает кэш машин, /summary и версию данных"""
+        db.machine_cache.put(MagicMock(id=1), db.machine_cache.generation)
+        db.fleet_summary.rebuild([])
+        version = db.get_data_version()
+
+        db.apply_remote_change("payments")
+
+        assert db.machine_cache.stats()["size"] == 0
+        assert db.fleet_summary.loaded is False
+        assert db.get_data_version() == version + 1
+
+    def test_models_table_invalidates_catalog(self):
+        """Тест что изменение каталога моделей сбрасывает только каталог и версию данных"""
+        with patch.object(db.model_catalog, "invalidate") as invalidate:
+            db.fleet_summary.rebuild([])
+            db.apply_remote_change("machine_models")
+
+        invalidate.assert_called_once()
+        assert db.fleet_summary.loaded is True
+        db.fleet_summary.clear()
+
+
+class TestDataChangeListener:
+    """Тесты для слушателя LISTEN data_changed"""
+
+    @pytest.mark.asyncio
+    async def test_applies_only_foreign_changes(self):
+        """Тест что уведомления о своих записях пропускаются, о чужих — сбрасывают кэши"""
+        conn = _FakeConnection()
+        listener = DataChangeListener(connect=AsyncMock(return_value=conn))
+        with patch("cache_sync.apply_remote_change") as apply, patch("cache_sync.reset_local_caches"):
+            listener.start()
+            await asyncio.wait_for(listener.connected.wait(), timeout=1)
+            conn.notify(f"payments {db.REPLICA_NAME}")
+            conn.notify("coffee_machines pro_accounter-other")
+            await listener.stop()
+
+        apply.assert_called_once_with("coffee_machines")
+        assert listener.received == 2 and listener.applied == 1
+        assert conn.closed
+
+    @pytest.mark.asyncio
+    async def test_reconnects_and_resets_caches(self):
+        """Тест что после обрыва соединения слушатель переподключается и сбрасывает все кэши"""
+        first, second = _FakeConnection(), _FakeConnection()
+        connect = AsyncMock(side_effect=[first, second])
+        listener = DataChangeListener(connect=connect, retry_delay=0)
+        with patch("cache_sync.reset_local_caches") as reset:
+            listener.start()
+            await asyncio.wait_for(listener.connected.wait(), timeout=1)
+            first.terminate()
+            for _ in range(50):
+                if connect.await_count == 2 and listener.connected.is_set():
+                    break
+                await asyncio.sleep(0.01)
+            await listener.stop()
+
+        assert connect.await_count == 2
+        assert reset.call_count == 2
+        assert CHANNEL in second.listeners
+
+    @pytest.mark.asyncio
+    async def test_keepalive_failure_triggers_reconnect(self):
+        """Тест что неудачная проверка соединения приводит к переподключению"""
+        broken, healthy = _FakeConnection(), _FakeConnection()
+        broken.execute = AsyncMock(side_effect=ConnectionError("reset"))
+        connect = AsyncMock(side_effect=[broken, healthy])
+        listener = DataChangeListener(connect=connect, retry_delay=0, keepalive=0.01)
+        with patch("cache_sync.reset_local_caches"), patch("cache_sync.logger"):
+            listener.start()
+            for _ in range(50):
+                if connect.await_count == 2:
+                    break
+                await asyncio.sleep(0.01)
+            await listener.stop()
+
+        assert connect.await_count == 2
+        assert broken.closed
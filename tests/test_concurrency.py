@@ -0,0 +1,122 @@
+import asyncio
+import pytest
+from datetime import datetime
+from aiogram import Bot, Dispatcher, F
+from aiogram.filters import StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Chat, Message, Update, User
+from concurrency import ChatEventIsolation
+
+
+class Steps(StatesGroup):
+    a = State()
+    b = State()
+
+
+def _update(update_id, chat_id, text, user_id=None):
+    user_id = user_id or chat_id
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=chat_id, type="private" if user_id == chat_id else "group"),
+            from_user=User(id=user_id, is_bot=False, first_name="Тест"),
+            text=text,
+        ),
+    )
+
+
+@pytest.fixture
+def bot():
+    return Bot(token="42:TEST")
+
+
+def _dispatcher(limit):
+    isolation = ChatEventIsolation(limit)
+    return Dispatcher(storage=MemoryStorage(), events_isolation=isolation), isolation
+
+
+class TestChatEventIsolation:
+    """Тесты для порядка обработки обновлений через настоящий Dispatcher с FSM"""
+
+    @pytest.mark.asyncio
+    async def test_next_update_sees_state_set_by_previous(self, bot):
+        """Тест что второе сообщение чата маршрутизируется по состоянию, выставленному первым"""
+        dp, _ = _dispatcher(limit=10)
+        seen = []
+
+        @dp.message(StateFilter(Steps.a))
+        async def step_a(msg: Message, state: FSMContext):
+            seen.append(("a", msg.text))
+            await asyncio.sleep(0.02)
+            await state.set_state(Steps.b)
+
+        @dp.message(StateFilter(Steps.b))
+        async def step_b(msg: Message, state: FSMContext):
+            seen.append(("b", msg.text))
+
+        await dp.fsm.storage.set_state(
+            key=dp.fsm.get_context(bot, chat_id=1, user_id=1).key, state=Steps.a
+        )
+
+        await asyncio.gather(
+            dp.feed_update(bot, _update(1, 1, "first")),
+            dp.feed_update(bot, _update(2, 1, "second")),
+        )
+
+        assert seen == [("a", "first"), ("b", "second")]
+
+    @pytest.mark.asyncio
+    async def test_global_limit_and_chat_order(self, bot):
+        """Тест общего лимита между чатами и очерёдности внутри группы"""
+        dp, isolation = _dispatcher(limit=2)
+        running = 0
+        max_running = 0
+        log = []
+
+        @dp.message(F.text)
+        async def handler(msg: Message):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            log.append(("start", msg.chat.id, msg.text))
+            await asyncio.sleep(0.01)
+            log.append(("end", msg.chat.id, msg.text))
+            running -= 1
+
+        updates = [_update(i, chat_id=i, text=str(i)) for i in range(1, 6)]
+        # Два участника одной группы — всё равно по очереди
+        updates += [_update(10, -100, "g1", user_id=7), _update(11, -100, "g2", user_id=8)]
+        await asyncio.gather(*(dp.feed_update(bot, update) for update in updates))
+
+        assert max_running == 2
+        group = [entry for entry in log if entry[1] == -100]
+        assert group == [("start", -100, "g1"), ("end", -100, "g1"), ("start", -100, "g2"), ("end", -100, "g2")]
+        stats = isolation.stats()
+        assert stats["processed"] == 7
+        assert stats["in_flight"] == 0 and stats["queued"] == 0 and stats["chats"] == 0
+        assert stats["max_queued"] >= 1
+
+    @pytest.mark.asyncio
+    async def test_error_releases_chat_and_slot(self, bot):
+        """Тест что ошибка обработчика не блокирует чат и общий лимит"""
+        dp, isolation = _dispatcher(limit=1)
+        handled = []
+
+        @dp.message(F.text == "boom")
+        async def failing(msg: Message):
+            raise RuntimeError("boom")
+
+        @dp.message(F.text)
+        async def ok(msg: Message):
+            handled.append(msg.text)
+
+        with pytest.raises(RuntimeError):
+            await dp.feed_update(bot, _update(1, 1, "boom"))
+        await asyncio.wait_for(dp.feed_update(bot, _update(2, 1, "after")), timeout=1)
+
+        assert handled == ["after"]
+        assert isolation.stats()["chats"] == 0
@@ -51,6 +51,42 @@ class TestConfig:
         assert DB_USER is not None
         assert DB_PASSWORD is not None
         assert DB_NAME is not None
-
-
-
+    
+    def test_db_pool_defaults(self):
+        """Тест значений по умолчанию для пула соединений"""
+        with patch.dict(os.environ, {}, clear=True):
+            with patch('config.load_dotenv'):
+                import importlib
+                import config
+                importlib.reload(config)
+                assert config.DB_POOL_SIZE == 5
+                assert config.DB_MAX_OVERFLOW == 10
+                assert config.DB_POOL_PRE_PING is True
+                assert config.DB_STATEMENT_CACHE_SIZE == 100
+    
+    def test_db_pool_from_env(self):
+        """Тест чтения настроек пула из окружения"""
+        env = {"DB_POOL_SIZE": "20", "DB_POOL_PRE_PING": "false", "DB_STATEMENT_TIMEOUT_MS": "0"}
+        with patch.dict(os.environ, env, clear=True):
+            with patch('config.load_dotenv'):
+                import importlib
+                import config
+                importlib.reload(config)
+                assert config.DB_POOL_SIZE == 20
+                assert config.DB_POOL_PRE_PING is False
+                assert config.DB_STATEMENT_TIMEOUT_MS == 0
+    
+    def test_fsm_write_delay_by_mode(self):
+        """Тест что в webhook состояние FSM по умолчанию пишется сразу, а в polling — через буфер"""
+        import importlib
+        import config
+        for mode, expected in (("webhook", 0), ("polling", 100)):
+            with patch.dict(os.environ, {"BOT_MODE": mode}, clear=True):
+                with patch('config.load_dotenv'):
+                    importlib.reload(config)
+                    assert config.FSM_WRITE_DELAY_MS == expected
+        with patch.dict(os.environ, {"BOT_MODE": "webhook", "FSM_WRITE_DELAY_MS": "50"}, clear=True):
+            with patch('config.load_dotenv'):
+                importlib.reload(config)
+                assert config.FSM_WRITE_DELAY_MS == 50
+        importlib.reload(config)
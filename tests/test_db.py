@@ -2,11 +2,13 @@ import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 from datetime import date
 from sqlalchemy import select, update, delete
+from sqlalchemy.dialects import postgresql
 from db import (
     get_all_machine_models,
     add_machine_model,
     delete_machine_model,
     add_coffee_machine,
+    delete_coffee_machine,
     get_all_machines,
     add_payment,
     get_payments_by_machine,
@@ -16,7 +18,32 @@ from db import (
     update_machine_deal_type,
     update_machine_1c,
     update_machine_rent_price,
-    get_last_payment_date
+    get_last_payment_date,
+    get_machines_with_totals,
+    get_machine_by_id,
+    get_machines_by_ids,
+    get_pool_stats,
+    get_machines,
+    delete_payment,
+    delete_payment_by_tenant,
+    reconcile_machine_totals,
+    InstrumentedPool,
+    rebuild_payment_month_rollup,
+    get_payment_month_rollup,
+    get_monthly_payment_totals,
+    get_model_counts,
+    iter_machines,
+    add_payments_bulk,
+    get_machine_model_by_id,
+    ModelCatalogCache,
+    MachineCache,
+    machine_cache,
+    get_machine_cache_stats,
+    fleet_summary,
+    rebuild_fleet_summary,
+    get_fleet_summary,
+    get_data_version,
+    fetch_report_columns,
 )
 from models import CoffeeMachineORM, PaymentORM, MachineModelORM
 
@@ -85,16 +112,107 @@ class TestMachineModels:
             mock_session_local.return_value.__aenter__.return_value = mock_session
             
             mock_result = MagicMock()
-            mock_result.scalar_one_or_none.return_value = mock_machine_model
+            mock_result.scalars.return_value.all.return_value = [mock_machine_model]
             mock_session.execute.return_value = mock_result
             
             result = await get_machine_model_by_name("Saeco Lirika")
             
             assert result is not None
             assert result.name == "Saeco Lirika"
+            assert await get_machine_model_by_name("Нет такой") is None
             mock_session.execute.assert_called_once()
 
 
+class TestModelCatalogCache:
+    """Тесты для кэша каталога моделей"""
+    
+    @staticmethod
+    def _session_returning(models):
+        mock_session = AsyncMock()
+        mock_result = MagicMock()
+        mock_result.scalars.return_value.all.return_value = models
+        mock_session.execute.return_value = mock_result
+        return mock_session
+    
+    @pytest.mark.asyncio
+    async def test_catalog_loaded_once(self, mock_machine_model):
+        """Тест что каталог читается из БД один раз для всех видов поиска"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = self._session_returning([mock_machine_model])
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            assert await get_all_machine_models() == [mock_machine_model]
+            assert await get_machine_model_by_id(mock_machine_model.id) is mock_machine_model
+            assert await get_machine_model_by_name(mock_machine_model.name) is mock_machine_model
+            
+            mock_session.execute.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_add_and_delete_invalidate(self, mock_machine_model):
+        """Тест что добавление и удаление модели сбрасывают кэш"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = self._session_returning([mock_machine_model])
+            mock_session.add = MagicMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            await get_all_machine_models()
+            await add_machine_model("Jura E8", 60000.0, 350000.0)
+            await get_all_machine_models()
+            await delete_machine_model(1)
+            await get_all_machine_models()
+            
+            selects = [c for c in mock_session.execute.call_args_list if "SELECT" in str(c[0][0])]
+            assert len(selects) == 3
+    
+    @pytest.mark.asyncio
+    async def test_ttl_expiry(self, mock_machine_model):
+        """Тест перечитывания каталога по истечении TTL"""
+        cache = ModelCatalogCache(ttl=60)
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = self._session_returning([mock_machine_model])
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            with patch('db.time.monotonic', return_value=1000.0):
+                await cache.get_all()
+                await cache.get_all()
+            with patch('db.time.monotonic', return_value=1061.0):
+                await cache.get_all()
+            
+            assert cache.loads == 2
+    
+    @pytest.mark.asyncio
+    async def test_result_is_a_copy(self, mock_machine_model):
+        """Тест что вызывающий код не может испортить закэшированный список"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session_local.return_value.__aenter__.return_value = self._session_returning([mock_machine_model])
+            
+            models = await get_all_machine_models()
+            models.clear()
+            
+            assert await get_all_machine_models() == [mock_machine_model]
+    
+    @pytest.mark.asyncio
+    async def test_invalidate_during_load_still_returns_rows(self, mock_machine_model):
+        """Тест что сброс каталога во время чтения не даёт пустой результат, а кэш перечитывается"""
+        cache = ModelCatalogCache()
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = self._session_returning([mock_machine_model])
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            result = mock_session.execute.return_value
+            
+            async def execute_with_invalidate(stmt):
+                cache.invalidate()
+                return result
+            
+            mock_session.execute.side_effect = execute_with_invalidate
+            assert await cache.get_all() == [mock_machine_model]
+            assert cache.loads == 0
+            
+            mock_session.execute.side_effect = None
+            assert await cache.get_by_id(mock_machine_model.id) is mock_machine_model
+            assert cache.loads == 1
+
+
 class TestCoffeeMachines:
     """Тесты для работы с кофемашинами"""
     
@@ -136,6 +254,84 @@ class TestCoffeeMachines:
             assert result[0].model == "Saeco Lirika"
             mock_session.execute.assert_called_once()
     
+    @pytest.mark.asyncio
+    async def test_get_machines(self, mock_coffee_machine):
+        """Тест получения машин без платежей с фильтром по статусу"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            mock_result = MagicMock()
+            mock_result.scalars.return_value.all.return_value = [mock_coffee_machine]
+            mock_session.execute.return_value = mock_result
+            
+            result = await get_machines(status="active")
+            
+            assert result == [mock_coffee_machine]
+            sql = str(mock_session.execute.call_args[0][0])
+            assert "coffee_machines.status" in sql
+            assert "payments" not in sql.replace("coffee_machines.payments", "")
+    
+    @pytest.mark.asyncio
+    async def test_get_machine_by_id(self, mock_coffee_machine):
+        """Тест получения кофемашины по id"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            mock_result = MagicMock()
+            mock_result.scalar_one_or_none.return_value = mock_coffee_machine
+            mock_session.execute.return_value = mock_result
+            
+            result = await get_machine_by_id(1)
+            
+            assert result is mock_coffee_machine
+            mock_session.execute.assert_called_once()
+            stmt = mock_session.execute.call_args[0][0]
+            assert "WHERE coffee_machines.id" in str(stmt)
+            assert not stmt._with_options
+    
+    @pytest.mark.asyncio
+    async def test_get_machine_by_id_with_payments(self, mock_coffee_machine):
+        """Тест получения кофемашины по id вместе с платежами"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            mock_result = MagicMock()
+            mock_result.scalar_one_or_none.return_value = mock_coffee_machine
+            mock_session.execute.return_value = mock_result
+            
+            await get_machine_by_id(1, with_payments=True)
+            
+            stmt = mock_session.execute.call_args[0][0]
+            assert stmt._with_options
+    
+    @pytest.mark.asyncio
+    async def test_get_machines_by_ids(self, mock_coffee_machine):
+        """Тест получения нескольких кофемашин по списку id"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            mock_result = MagicMock()
+            mock_result.scalars.return_value.all.return_value = [mock_coffee_machine]
+            mock_session.execute.return_value = mock_result
+            
+            result = await get_machines_by_ids([1, 2])
+            
+            assert result == [mock_coffee_machine]
+            mock_session.execute.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_get_machines_by_ids_empty(self):
+        """Тест: пустой список id не обращается к БД"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            result = await get_machines_by_ids([])
+            
+            assert result == []
+            mock_session_local.assert_not_called()
+    
     @pytest.mark.asyncio
     async def test_update_machine_status(self):
         """Тест обновления статуса кофемашины"""
@@ -227,6 +423,406 @@ class TestCoffeeMachines:
             mock_session.commit.assert_called_once()
 
 
+class TestMachineCache:
+    """Тесты для LRU-кэша машин"""
+    
+    @staticmethod
+    def _machine(machine_id):
+        machine = MagicMock()
+        machine.id = machine_id
+        return machine
+    
+    def test_lru_eviction(self):
+        """Тест вытеснения давно не использованных машин"""
+        cache = MachineCache(max_size=2)
+        cache.put(self._machine(1), cache.generation)
+        cache.put(self._machine(2), cache.generation)
+        cache.get(1)
+        cache.put(self._machine(3), cache.generation)
+        
+        assert cache.get(2) is None
+        assert cache.get(1) is not None and cache.get(3) is not None
+        assert cache.stats()["size"] == 2
+    
+    def test_stale_read_not_stored(self):
+        """Тест что результат чтения, начатого до сброса, не попадает в кэш"""
+        cache = MachineCache()
+        generation = cache.generation
+        cache.invalidate([1])
+        cache.put(self._machine(1), generation)
+        
+        assert cache.get(1) is None
+    
+    @pytest.mark.asyncio
+    async def test_get_machine_by_id_served_from_cache(self, mock_coffee_machine):
+        """Тест повторного чтения машины из памяти"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            mock_result = MagicMock()
+            mock_result.scalar_one_or_none.return_value = mock_coffee_machine
+            mock_session.execute.return_value = mock_result
+            before = get_machine_cache_stats()
+            
+            assert await get_machine_by_id(1) is mock_coffee_machine
+            assert await get_machine_by_id(1) is mock_coffee_machine
+            
+            mock_session.execute.assert_called_once()
+            after = get_machine_cache_stats()
+            assert after["hits"] - before["hits"] == 1
+            assert after["misses"] - before["misses"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_with_payments_bypasses_cache(self, mock_coffee_machine):
+        """Тест что чтение вместе с платежами идёт мимо кэша"""
+        machine_cache.put(mock_coffee_machine, machine_cache.generation)
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            mock_session.execute.return_value = MagicMock()
+            
+            await get_machine_by_id(1, with_payments=True)
+            
+            mock_session.execute.assert_called_once()
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mutator, args", [
+        (update_machine_full_price, (1, 350000.0)),
+        (update_machine_deal_type, (1, "Аренда")),
+        (update_machine_1c, (1, True)),
+        (update_machine_rent_price, (1, 9000.0)),
+        (update_machine_status, (1, "returned")),
+    ])
+    async def test_update_mutators_invalidate(self, mock_coffee_machine, mutator, args):
+        """Тест что update_machine_* сбрасывают запись машины"""
+        machine_cache.put(mock_coffee_machine, machine_cache.generation)
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session_local.return_value.__aenter__.return_value = AsyncMock()
+            
+            await mutator(*args)
+        
+        assert machine_cache.get(1) is None
+    
+    @pytest.mark.asyncio
+    async def test_add_payment_invalidates(self, mock_coffee_machine, sample_payment_data):
+        """Тест что новый платёж сбрасывает машину с устаревшими итогами"""
+        machine_cache.put(mock_coffee_machine, machine_cache.generation)
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session.add = MagicMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            await add_payment(sample_payment_data)
+        
+        assert machine_cache.get(sample_payment_data["machine_id"]) is None
+    
+    @pytest.mark.asyncio
+    async def test_reconcile_clears_cache(self, mock_coffee_machine):
+        """Тест что пересборка итогов сбрасывает весь кэш"""
+        machine_cache.put(mock_coffee_machine, machine_cache.generation)
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session_local.return_value.__aenter__.return_value = AsyncMock()
+            
+            await reconcile_machine_totals()
+        
+        assert get_machine_cache_stats()["size"] == 0
+
+
+class TestFleetSummarySync:
+    """Тесты для поддержания показателей /summary при записи"""
+    
+    @staticmethod
+    def _row(machine_id, status="active", deposit=10000.0, rent_price=9000.0, in_1C=True,
+             start_date=date(2024, 1, 1), last_payment_date=None):
+        return MagicMock(id=machine_id, status=status, deposit=deposit, rent_price=rent_price,
+                         in_1C=in_1C, start_date=start_date, last_payment_date=last_payment_date)
+    
+    @staticmethod
+    def _session_returning(rows):
+        mock_session = AsyncMock()
+        mock_result = MagicMock()
+        mock_result.all.return_value = rows
+        mock_session.execute.return_value = mock_result
+        return mock_session
+    
+    @pytest.mark.asyncio
+    async def test_rebuild_loads_active_machines(self):
+        """Тест построения показателей по активным сделкам"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = self._session_returning([self._row(1), self._row(2, in_1C=False)])
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            await rebuild_fleet_summary()
+            
+            assert "coffee_machines.status = " in str(mock_session.execute.call_args[0][0])
+            snapshot = fleet_summary.snapshot(date(2024, 1, 15))
+            assert snapshot["active"] == 2
+            assert snapshot["deposit_sum"] == 20000.0
+            assert snapshot["not_in_1c"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_get_fleet_summary_builds_once(self):
+        """Тест что /summary после первой загрузки не обращается к БД"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = self._session_returning([self._row(1)])
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            await get_fleet_summary()
+            summary = await get_fleet_summary()
+            
+            assert summary["active"] == 1
+            mock_session.execute.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_status_change_removes_machine(self):
+        """Тест что закрытие сделки убирает её из показателей"""
+        fleet_summary.rebuild([])
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session_local.return_value.__aenter__.return_value = self._session_returning([self._row(1)])
+            await update_machine_rent_price(1, 9000.0)
+            assert fleet_summary.snapshot(date(2024, 1, 15))["active"] == 1
+            
+            mock_session_local.return_value.__aenter__.return_value = self._session_returning([self._row(1, status="buyout")])
+            await update_machine_status(1, "buyout", buyout=True)
+            
+            assert fleet_summary.snapshot(date(2024, 1, 15))["active"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_payment_moves_due_date(self):
+        """Тест что новый платёж снимает просрочку"""
+        fleet_summary.rebuild([])
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = self._session_returning([self._row(1, last_payment_date=date(2024, 3, 1))])
+            mock_session.add = MagicMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            await add_payment({"machine_id": 1, "tenant": "Иван", "amount": 9000.0, "payment_date": date(2024, 3, 1)})
+            
+            assert fleet_summary.snapshot(date(2024, 3, 15))["overdue"] == 0
+            assert fleet_summary.snapshot(date(2024, 4, 15))["overdue"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_deleted_machine_removed(self):
+        """Тест что удалённая машина пропадает из показателей"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session_local.return_value.__aenter__.return_value = self._session_returning([self._row(1)])
+            await rebuild_fleet_summary()
+            
+            mock_session_local.return_value.__aenter__.return_value = self._session_returning([])
+            await delete_coffee_machine(1)
+            
+            assert fleet_summary.snapshot(date(2024, 1, 15))["active"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_sync_failure_forces_rebuild(self):
+        """Тест что при ошибке обновления показатели пересоберутся с нуля"""
+        fleet_summary.rebuild([])
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session.execute.side_effect = [MagicMock(), RuntimeError("connection lost")]
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            await update_machine_rent_price(1, 9500.0)
+        
+        assert fleet_summary.loaded is False
+    
+    @pytest.mark.asyncio
+    async def test_not_loaded_skips_sync(self):
+        """Тест что до первой загрузки запись не делает лишних запросов"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            await update_machine_1c(1, True)
+            
+            mock_session.execute.assert_called_once()
+
+
+class TestDataVersion:
+    """Тесты для счётчика версий данных"""
+    
+    @pytest.mark.asyncio
+    async def test_writes_bump_version(self, sample_payment_data):
+        """Тест что записи через db.py увеличивают версию данных"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session.add = MagicMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            before = get_data_version()
+            await add_payment(sample_payment_data)
+            await update_machine_deal_type(1, "Аренда")
+            await delete_machine_model(1)
+            
+            assert get_data_version() == before + 3
+    
+    @pytest.mark.asyncio
+    async def test_reads_keep_version(self):
+        """Тест что чтение не меняет версию данных"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            mock_session.execute.return_value = MagicMock()
+            
+            before = get_data_version()
+            await get_machines()
+            
+            assert get_data_version() == before
+
+
+class TestIterMachines:
+    """Тесты для потокового чтения машин"""
+    
+    @staticmethod
+    def _session_with_partitions(*chunks):
+        mock_session = AsyncMock()
+        mock_session.expunge_all = MagicMock()
+        
+        async def partitions():
+            for chunk in chunks:
+                yield chunk
+        
+        mock_result = MagicMock()
+        mock_result.partitions = MagicMock(side_effect=partitions)
+        mock_session.stream_scalars.return_value = mock_result
+        mock_session.stream.return_value = mock_result
+        return mock_session
+    
+    @pytest.mark.asyncio
+    async def test_yields_chunks_with_payments(self):
+        """Тест выдачи машин пачками с подгрузкой платежей"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = self._session_with_partitions([1, 2], [3])
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            chunks = [chunk async for chunk in iter_machines(status="active", with_payments=True, chunk_size=2)]
+            
+            assert chunks == [[1, 2], [3]]
+            stmt = mock_session.stream_scalars.call_args[0][0]
+            assert stmt.get_execution_options()["yield_per"] == 2
+            assert "coffee_machines.status" in str(stmt)
+            assert mock_session.expunge_all.call_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_selects_only_requested_columns(self):
+        """Тест выборки только нужных колонок"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = self._session_with_partitions([("row",)])
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            chunks = [chunk async for chunk in iter_machines(columns=["id", "tenant"])]
+            
+            assert chunks == [[("row",)]]
+            sql = str(mock_session.stream.call_args[0][0])
+            assert sql.startswith("SELECT coffee_machines.id, coffee_machines.tenant \nFROM")
+    
+    @pytest.mark.asyncio
+    async def test_report_filters(self):
+        """Тест фильтров отчёта по статусам и дате начала сделки"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = self._session_with_partitions()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            chunks = [chunk async for chunk in iter_machines(
+                columns=["id"], statuses=("buyout", "returned"), started_from=date(2025, 1, 1),
+            )]
+            
+            assert chunks == []
+            sql = str(mock_session.stream.call_args[0][0].compile(
+                dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True},
+            ))
+            assert "coffee_machines.status IN ('buyout', 'returned')" in sql
+            assert "coffee_machines.start_date >= '2025-01-01'" in sql
+            assert "start_date <=" not in sql
+    
+    @pytest.mark.asyncio
+    async def test_columns_with_payments_rejected(self):
+        """Тест что платежи нельзя подгрузить к выборке отдельных колонок"""
+        with pytest.raises(ValueError):
+            async for _ in iter_machines(columns=["id"], with_payments=True):
+                pass
+
+
+
+class TestFetchReportColumns:
+    """Тесты для выборки данных Excel-отчёта по столбцам"""
+    
+    @staticmethod
+    def _result(*chunks):
+        async def partitions():
+            for chunk in chunks:
+                yield chunk
+        
+        result = MagicMock()
+        result.partitions = MagicMock(side_effect=partitions)
+        return result
+    
+    @pytest.mark.asyncio
+    async def test_rows_transposed_to_columns(self):
+        """Тест что пачки строк собираются в столбцы"""
+        machine_rows = [(i, date(2024, 1, i), f"T{i}", "Saeco", str(i), 5000.0, 0.0, None,
+                         "996555000000", None, "active", "Аренда", None, 0.0) for i in (1, 2, 3)]
+        payment_rows = [(10, 1, "T1", 100.0, date(2024, 2, 1), False, None)]
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session.stream.side_effect = [
+                self._result(machine_rows[:2], machine_rows[2:]),
+                self._result(payment_rows),
+            ]
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            machines, payments = await fetch_report_columns(chunk_size=2)
+            
+            assert machines["id"] == [1, 2, 3]
+            assert machines["tenant"] == ["T1", "T2", "T3"]
+            assert machines["full_price"] == [None, None, None]
+            assert payments == {
+                "id": [10], "machine_id": [1], "tenant": ["T1"], "amount": [100.0],
+                "payment_date": [date(2024, 2, 1)], "is_deposit": [False], "is_buyout": [None],
+            }
+            machines_stmt, payments_stmt = (call[0][0] for call in mock_session.stream.call_args_list)
+            assert machines_stmt.get_execution_options()["yield_per"] == 2
+            assert "ORDER BY coffee_machines.id" in str(machines_stmt)
+            assert "payments.machine_id IS NOT NULL" in str(payments_stmt)
+            assert "ORDER BY payments.machine_id, payments.payment_date, payments.id" in str(payments_stmt)
+    
+    @pytest.mark.asyncio
+    async def test_filters_pushed_into_sql(self):
+        """Тест что период и статусы становятся условиями WHERE, а у машин появляются listed и paid_before"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session.stream.side_effect = [self._result(), self._result()]
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            machines, _ = await fetch_report_columns(
+                date_from=date(2025, 1, 1), date_to=date(2025, 3, 31), statuses=("closed",),
+            )
+            
+            assert {"listed", "paid_before"} <= set(machines)
+            machines_sql, payments_sql = (
+                str(call[0][0].compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+                for call in mock_session.stream.call_args_list
+            )
+            assert "coffee_machines.status != 'active'" in machines_sql
+            assert "coffee_machines.start_date >= '2025-01-01' AND coffee_machines.start_date <= '2025-03-31'" in machines_sql
+            assert "payments.payment_date < '2025-01-01'" in machines_sql
+            assert "payments.payment_date >= '2025-01-01' AND payments.payment_date <= '2025-03-31'" in payments_sql
+            assert "coffee_machines.status != 'active'" in payments_sql
+    
+    @pytest.mark.asyncio
+    async def test_empty_tables(self):
+        """Тест пустых таблиц: все столбцы присутствуют и пусты"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session.stream.side_effect = [self._result(), self._result()]
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            machines, payments = await fetch_report_columns()
+            
+            assert set(machines) >= {"id", "status", "total_paid"} and not any(machines.values())
+            assert set(payments) >= {"machine_id", "amount"} and not any(payments.values())
+
+
 class TestPayments:
     """Тесты для работы с платежами"""
     
@@ -251,6 +847,250 @@ class TestPayments:
                 mock_session.commit.assert_called_once()
                 mock_session.refresh.assert_called_once()
     
+    @pytest.mark.asyncio
+    async def test_add_payment_updates_machine_totals(self, sample_payment_data):
+        """Тест что итоги машины обновляются в той же сессии, что и платёж"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session.add = MagicMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            await add_payment(sample_payment_data)
+            
+            assert mock_session.execute.call_count == 2
+            sql = str(mock_session.execute.call_args_list[0][0][0])
+            assert "UPDATE coffee_machines" in sql
+            assert "total_paid=(coffee_machines.total_paid +" in sql
+            assert "payments_count=(coffee_machines.payments_count +" in sql
+            mock_session.commit.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_add_payment_upserts_month_rollup(self, sample_payment_data):
+        """Тест что помесячная сумма обновляется upsert'ом в той же сессии"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session.add = MagicMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            await add_payment(sample_payment_data)
+            
+            stmt = mock_session.execute.call_args_list[1][0][0]
+            params = stmt.compile().params
+            sql = str(stmt.compile(dialect=postgresql.dialect()))
+            assert "INSERT INTO payment_month_rollup" in sql
+            assert "ON CONFLICT (machine_id, month) DO UPDATE" in sql
+            assert params["month"] == sample_payment_data["payment_date"].replace(day=1)
+            assert params["amount_sum"] == sample_payment_data["amount"]
+    
+    @pytest.mark.asyncio
+    async def test_add_payments_bulk(self):
+        """Тест пачечной вставки платежей одной транзакцией"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            machines_result = MagicMock()
+            machines_result.all.return_value = [(1, "Иван Иванов"), (2, "Петр Петров")]
+            insert_result = MagicMock()
+            insert_result.scalars.return_value.all.return_value = [10, 11]
+            mock_session.execute.side_effect = [machines_result, insert_result, MagicMock(), MagicMock(), MagicMock()]
+            
+            payments = [
+                {"machine_id": 1, "amount": 9000.0, "payment_date": date(2024, 1, 15)},
+                {"machine_id": 2, "tenant": "Петров", "amount": 12000.0, "payment_date": date(2024, 2, 1), "is_deposit": True},
+            ]
+            ids = await add_payments_bulk(payments)
+            
+            assert ids == [10, 11]
+            insert_call = mock_session.execute.call_args_list[1]
+            assert "INSERT INTO payments" in str(insert_call[0][0])
+            rows = insert_call[0][1]
+            assert rows[0]["tenant"] == "Иван Иванов"
+            assert rows[1]["tenant"] == "Петров"
+            assert rows[1]["is_deposit"] is True and rows[0]["is_buyout"] is False
+            assert "UPDATE coffee_machines" in str(mock_session.execute.call_args_list[2][0][0])
+            mock_session.commit.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_add_payments_bulk_buyout_closes_deal(self):
+        """Тест что выкуп из файла закрывает сделку в той же транзакции, как и ручной ввод"""
+        with patch('db.AsyncSessionLocal') as mock_session_local, \
+             patch('db._on_machines_changed', new_callable=AsyncMock) as mock_changed:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+
+            machines_result = MagicMock()
+            machines_result.all.return_value = [(1, "Иван Иванов"), (2, "Петр Петров")]
+            insert_result = MagicMock()
+            insert_result.scalars.return_value.all.return_value = [10, 11, 12]
+            mock_session.execute.side_effect = [machines_result, insert_result] + [MagicMock()] * 5
+
+            await add_payments_bulk([
+                {"machine_id": 1, "amount": 50000.0, "payment_date": date(2024, 3, 1), "is_buyout": True},
+                {"machine_id": 1, "amount": 10000.0, "payment_date": date(2024, 3, 20), "is_buyout": True},
+                {"machine_id": 2, "amount": 9000.0, "payment_date": date(2024, 3, 5)},
+            ])
+
+            # Итоги, помесячные суммы и одно закрытие сделки по последней дате выкупа
+            stmt = mock_session.execute.call_args_list[-1][0][0]
+            params = stmt.compile().params
+            assert "UPDATE coffee_machines" in str(stmt)
+            assert params["status"] == "buyout" and params["buyout"] is True
+            assert params["buyout_date"] == date(2024, 3, 20)
+            assert params["id_1"] == [1]
+            assert mock_session.execute.call_count == 6
+            mock_session.commit.assert_called_once()
+            mock_changed.assert_awaited_once_with({1, 2})
+
+    @pytest.mark.asyncio
+    async def test_add_payments_bulk_rejects_unknown_machines(self):
+        """Тест что неизвестные машины отклоняют всю пачку"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            machines_result = MagicMock()
+            machines_result.all.return_value = [(1, "Иван Иванов")]
+            mock_session.execute.return_value = machines_result
+            
+            with pytest.raises(ValueError, match="7, 9"):
+                await add_payments_bulk([
+                    {"machine_id": 1, "amount": 1.0, "payment_date": date(2024, 1, 1)},
+                    {"machine_id": 9, "amount": 1.0, "payment_date": date(2024, 1, 1)},
+                    {"machine_id": 7, "amount": 1.0, "payment_date": date(2024, 1, 1)},
+                ])
+            
+            mock_session.execute.assert_called_once()
+            mock_session.commit.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_add_payments_bulk_empty(self):
+        """Тест пустой пачки без обращения к БД"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            assert await add_payments_bulk([]) == []
+            mock_session_local.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_delete_payment_refreshes_machine_totals(self):
+        """Тест что удаление платежа пересчитывает итоги его машины"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            mock_result = MagicMock()
+            mock_result.all.return_value = [(1, date(2024, 3, 15))]
+            mock_session.execute.return_value = mock_result
+            
+            await delete_payment(5)
+            
+            calls = [str(c[0][0]) for c in mock_session.execute.call_args_list]
+            assert len(calls) == 4
+            assert "RETURNING payments.machine_id, payments.payment_date" in calls[0]
+            assert "UPDATE coffee_machines" in calls[1]
+            assert "DELETE FROM payment_month_rollup" in calls[2]
+            assert "INSERT INTO payment_month_rollup" in calls[3]
+            mock_session.commit.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_delete_missing_payment_skips_refresh(self):
+        """Тест что удаление несуществующего платежа не трогает машины"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            mock_result = MagicMock()
+            mock_result.all.return_value = []
+            mock_session.execute.return_value = mock_result
+            
+            await delete_payment(404)
+            
+            mock_session.execute.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_delete_payment_by_tenant_refreshes_machine_totals(self):
+        """Тест что удаление платежей по ФИО пересчитывает итоги затронутых машин"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            mock_result = MagicMock()
+            mock_result.all.return_value = [(10, 1, date(2024, 1, 5)), (11, 1, date(2024, 2, 5)), (12, 2, date(2024, 2, 9))]
+            mock_session.execute.return_value = mock_result
+            
+            deleted = await delete_payment_by_tenant("Иван")
+            
+            assert deleted == 3
+            assert mock_session.execute.call_count == 5
+            refresh_sql = str(mock_session.execute.call_args_list[2][0][0])
+            assert "UPDATE coffee_machines" in refresh_sql
+            mock_session.commit.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_reconcile_machine_totals(self):
+        """Тест пересборки итогов по платежам"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            mock_result = MagicMock()
+            mock_result.rowcount = 2
+            mock_session.execute.return_value = mock_result
+            
+            fixed = await reconcile_machine_totals()
+            
+            assert fixed == 2
+            sql = str(mock_session.execute.call_args[0][0])
+            assert "IS DISTINCT FROM" in sql
+            mock_session.commit.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_rebuild_payment_month_rollup(self):
+        """Тест полной пересборки помесячных сумм из платежей"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            await rebuild_payment_month_rollup()
+            
+            calls = [str(c[0][0]) for c in mock_session.execute.call_args_list]
+            assert calls[0].startswith("DELETE FROM payment_month_rollup")
+            assert "INSERT INTO payment_month_rollup" in calls[1]
+            assert "GROUP BY payments.machine_id" in calls[1]
+            mock_session.commit.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_get_payment_month_rollup_groups_by_machine(self):
+        """Тест группировки помесячных сумм по машинам"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            rows = [MagicMock(machine_id=1), MagicMock(machine_id=1), MagicMock(machine_id=2)]
+            mock_result = MagicMock()
+            mock_result.scalars.return_value.all.return_value = rows
+            mock_session.execute.return_value = mock_result
+            
+            result = await get_payment_month_rollup()
+            
+            assert result == {1: rows[:2], 2: rows[2:]}
+    
+    @pytest.mark.asyncio
+    async def test_get_monthly_payment_totals(self):
+        """Тест суммирования помесячных сумм по всему парку"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            mock_result = MagicMock()
+            mock_result.all.return_value = []
+            mock_session.execute.return_value = mock_result
+            
+            await get_monthly_payment_totals()
+            
+            sql = str(mock_session.execute.call_args[0][0])
+            assert "GROUP BY payment_month_rollup.month" in sql
+            assert "ORDER BY payment_month_rollup.month" in sql
+    
     @pytest.mark.asyncio
     async def test_get_payments_by_machine(self, mock_payment):
         """Тест получения платежей по кофемашине"""
@@ -300,6 +1140,85 @@ class TestPayments:
             
             assert result is None
             mock_session.execute.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_get_machines_with_totals(self, mock_coffee_machine):
+        """Тест получения машин с агрегатами по платежам одним запросом"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            
+            mock_row = MagicMock()
+            mock_row.machine = mock_coffee_machine
+            mock_row.total_paid = 50000.0
+            mock_result = MagicMock()
+            mock_result.all.return_value = [mock_row]
+            mock_session.execute.return_value = mock_result
+            
+            result = await get_machines_with_totals(status="active")
+            
+            assert result[0].total_paid == 50000.0
+            mock_session.execute.assert_called_once()
+            sql = str(mock_session.execute.call_args[0][0])
+            assert "LEFT OUTER JOIN payments" in sql
+            assert "GROUP BY" in sql
 
 
+class TestModelCounts:
+    """Тесты для подсчёта сделок по моделям"""
+    
+    @pytest.mark.asyncio
+    async def test_get_model_counts_groups_in_sql(self):
+        """Тест что модели считаются одним GROUP BY без загрузки машин и платежей"""
+        with patch('db.AsyncSessionLocal') as mock_session_local:
+            mock_session = AsyncMock()
+            mock_session_local.return_value.__aenter__.return_value = mock_session
+            rows = [MagicMock(model="Saeco", count=2)]
+            mock_session.execute.return_value.all = MagicMock(return_value=rows)
+            
+            assert await get_model_counts() == rows
+            
+            mock_session.execute.assert_called_once()
+            sql = str(mock_session.execute.call_args[0][0])
+            assert "GROUP BY coffee_machines.model" in sql
+            assert "payments" not in sql
 
+
+class TestConnectionPool:
+    """Тесты для пула соединений"""
+    
+    def test_engine_uses_instrumented_pool(self):
+        """Тест что движок создан с пулом, собирающим статистику"""
+        import db
+        assert isinstance(db.engine.pool, InstrumentedPool)
+    
+    def test_get_pool_stats(self):
+        """Тест снимка состояния пула"""
+        stats = get_pool_stats()
+        
+        for key in ("size", "checked_out", "checked_in", "overflow", "wait_count", "wait_avg_ms", "wait_max_ms"):
+            assert key in stats
+        assert stats["overflow"] >= 0
+    
+    def test_instrumented_pool_records_wait(self):
+        """Тест что пул запоминает время ожидания, только когда свободных соединений не было"""
+        pool = InstrumentedPool(MagicMock(), pool_size=1, max_overflow=1)
+        with patch('sqlalchemy.pool.AsyncAdaptedQueuePool._do_get', return_value="conn"), \
+             patch.object(pool, 'checkedout', side_effect=[0, 1, 2, 2]):
+            assert pool._do_get() == "conn"
+            pool._do_get()
+            assert pool.wait_count == 0
+            pool._do_get()
+            pool._do_get()
+        
+        assert pool.wait_count == 2
+        assert pool.wait_max >= 0.0
+    
+    def test_unlimited_overflow_never_waits(self):
+        """Тест что при max_overflow=-1 ожидание не считается"""
+        pool = InstrumentedPool(MagicMock(), pool_size=1, max_overflow=-1)
+        with patch('sqlalchemy.pool.AsyncAdaptedQueuePool._do_get', return_value="conn"), \
+             patch.object(pool, 'checkedout', return_value=10):
+            pool._do_get()
+        
+        assert pool.wait_count == 0
@@ -1,6 +1,8 @@
 import pytest
 from io import BytesIO
 from utils.excel import generate_excel_report, generate_profit_share_report
+from utils.report_frames import render_profit_share_report
+from openpyxl import load_workbook
 import pandas as pd
 from datetime import date
 
@@ -129,40 +131,51 @@ class TestGenerateExcelReport:
         df_active = pd.read_excel(result, sheet_name='Активные сделки')
         assert len(df_active) == 0
 
-
-
+    
+    def test_generate_excel_streams_generator_rows(self, monkeypatch):
+        """Тест потоковой записи строк из генератора, длиннее выборки для ширины колонок"""
+        monkeypatch.setattr('utils.excel.WIDTH_SAMPLE_ROWS', 2)
+        payments = ({"Арендатор": f"Арендатор {i}", "Сумма": i, "Дата платежа": date(2024, 1, 1)} for i in range(5))
+        
+        result = generate_excel_report([], payments, None)
+        
+        df = pd.read_excel(result, sheet_name='Платежи')
+        assert df['Сумма'].tolist() == [0, 1, 2, 3, 4]
+        assert df['Дата платежа'].iloc[0] == pd.Timestamp(2024, 1, 1)
+    
+    def test_generate_excel_header_and_widths(self):
+        """Тест оформления заголовка и ширины колонок по данным"""
+        active_data = [{"Арендатор": "Иван Иванович Длинноимённый", "Залог": 100}]
+        
+        result = generate_excel_report(active_data, [], None)
+        
+        ws = load_workbook(result)['Активные сделки']
+        assert ws['A1'].value == "Арендатор"
+        assert ws['A1'].font.bold
+        assert ws.column_dimensions['A'].width == len("Иван Иванович Длинноимённый") + 2
+        assert ws.column_dimensions['B'].width == len("Залог") + 2
+        assert ws['B2'].value == 100
 
 
 class TestGenerateProfitShareReport:
+    @staticmethod
+    def _machines(*machines):
+        names = ["id", "start_date", "tenant", "deal_type", "model", "rent_price", "status"]
+        return {name: [m[idx] for m in machines] for idx, name in enumerate(names)}
+
     def test_month_columns_are_dropped_per_sheet_when_empty(self):
-        rows = [
-            {
-                "Месяц старта": "2026-01",
-                "Дата первого платежа": date(2026, 1, 10),
-                "Дата оформления": date(2026, 1, 1),
-                "Арендатор": "A",
-                "Тип сделки": "Аренда",
-                "Модель": "M1",
-                "Аренда": 10000.0,
-                "Статус": "active",
-                "2026-01": 10000.0,
-                "2026-02": None,
-            },
-            {
-                "Месяц старта": "2026-02",
-                "Дата первого платежа": date(2026, 2, 10),
-                "Дата оформления": date(2026, 2, 1),
-                "Арендатор": "B",
-                "Тип сделки": "Рассрочка",
-                "Модель": "M2",
-                "Аренда": 9000.0,
-                "Статус": "active",
-                "2026-01": None,
-                "2026-02": 9000.0,
-            },
-        ]
+        machines = self._machines(
+            (1, date(2026, 1, 1), "A", "Аренда", "M1", 10000.0, "active"),
+            (2, date(2026, 2, 1), "B", "Рассрочка", "M2", 9000.0, "active"),
+        )
+        payouts = {
+            "machine_id": [1, 2],
+            "month": [date(2026, 1, 1), date(2026, 2, 1)],
+            "amount_sum": [10000.0, 9000.0],
+            "first_payment_date": [date(2026, 1, 10), date(2026, 2, 10)],
+        }
 
-        result = generate_profit_share_report(rows)
+        result = render_profit_share_report(machines, payouts)
         result.seek(0)
 
         df_2026_01 = pd.read_excel(result, sheet_name="2026-01")
@@ -172,4 +185,23 @@ class TestGenerateProfitShareReport:
         assert "2026-01" in df_2026_01.columns
         assert "2026-02" not in df_2026_01.columns
         assert "2026-02" in df_2026_02.columns
-        assert "2026-01" not in df_2026_02.columns
\ No newline at end of file
+        assert "2026-01" not in df_2026_02.columns
+        assert df_2026_01["Арендатор"].tolist() == ["A"]
+
+    def test_empty_report_has_visible_sheet(self):
+        """Тест что без данных в книге есть пустой видимый лист"""
+        wb = load_workbook(generate_profit_share_report([]))
+
+        assert wb.sheetnames == ["Нет данных"]
+        assert wb.active.sheet_state == "visible"
+
+    def test_sheets_written_in_order_with_header(self):
+        """Тест записи готовых листов: порядок, заголовок и значения"""
+        sheet = pd.DataFrame({"Арендатор": ["A"], "2026-01": [100.0], "2026-03": [None]})
+
+        wb = load_workbook(generate_profit_share_report([("2026-01", sheet), ("2026-02", sheet)]))
+
+        assert wb.sheetnames == ["2026-01", "2026-02"]
+        rows = list(wb["2026-01"].iter_rows(values_only=True))
+        assert rows == [("Арендатор", "2026-01", "2026-03"), ("A", 100, None)]
+        assert wb["2026-01"]["A1"].font.bold
@@ -0,0 +1,80 @@
+from datetime import date, timedelta
+from utils.fleet_summary import FleetSummary, SummaryEntry, due_date_for, OVERDUE_AFTER_DAYS
+
+
+def _entry(machine_id, due_date, deposit=0.0, rent_price=9000.0, in_1C=True):
+    return SummaryEntry(machine_id=machine_id, deposit=deposit, rent_price=rent_price, in_1C=in_1C, due_date=due_date)
+
+
+class TestDueDate:
+    """Тесты для расчёта срока платежа"""
+
+    def test_from_last_payment(self):
+        """Тест срока от последнего платежа"""
+        assert due_date_for(date(2024, 1, 1), date(2024, 3, 1)) == date(2024, 3, 1) + timedelta(days=OVERDUE_AFTER_DAYS)
+
+    def test_from_start_date_without_payments(self):
+        """Тест срока от начала сделки, если платежей нет"""
+        assert due_date_for(date(2024, 1, 1), None) == date(2024, 1, 31)
+
+
+class TestFleetSummary:
+    """Тесты для инкрементальных показателей /summary"""
+
+    def test_rebuild_and_snapshot(self):
+        """Тест подсчёта показателей после полной загрузки"""
+        summary = FleetSummary()
+        summary.rebuild([
+            _entry(1, date(2024, 1, 10), deposit=100000.0, in_1C=False),
+            _entry(2, date(2024, 2, 10), rent_price=12000.0),
+        ])
+
+        snapshot = summary.snapshot(date(2024, 2, 1))
+
+        assert summary.loaded is True
+        assert snapshot == {"active": 2, "overdue": 1, "deposit_sum": 100000.0, "monthly_income": 21000.0, "not_in_1c": 1}
+
+    def test_overdue_rolls_over_with_date(self):
+        """Тест что число просрочек зависит только от даты запроса"""
+        summary = FleetSummary()
+        summary.rebuild([_entry(1, date(2024, 1, 10)), _entry(2, date(2024, 1, 20))])
+
+        assert summary.overdue_count(date(2024, 1, 10)) == 0
+        assert summary.overdue_count(date(2024, 1, 11)) == 1
+        assert summary.overdue_count(date(2024, 1, 21)) == 2
+
+    def test_upsert_replaces_entry(self):
+        """Тест что повторная запись машины заменяет прежнюю, а не дублирует"""
+        summary = FleetSummary()
+        summary.rebuild([_entry(1, date(2024, 1, 10), deposit=5000.0, in_1C=False)])
+
+        summary.upsert(_entry(1, date(2024, 3, 10), deposit=7000.0, in_1C=True))
+
+        snapshot = summary.snapshot(date(2024, 2, 1))
+        assert snapshot["active"] == 1
+        assert snapshot["overdue"] == 0
+        assert snapshot["deposit_sum"] == 7000.0
+        assert snapshot["not_in_1c"] == 0
+
+    def test_remove(self):
+        """Тест удаления машины (закрытие или удаление сделки)"""
+        summary = FleetSummary()
+        summary.rebuild([_entry(1, date(2024, 1, 10)), _entry(2, date(2024, 1, 10))])
+
+        summary.remove(1)
+        summary.remove(404)
+
+        snapshot = summary.snapshot(date(2024, 2, 1))
+        assert snapshot["active"] == 1
+        assert snapshot["overdue"] == 1
+        assert snapshot["monthly_income"] == 9000.0
+
+    def test_clear_marks_not_loaded(self):
+        """Тест сброса показателей"""
+        summary = FleetSummary()
+        summary.rebuild([_entry(1, date(2024, 1, 10))])
+
+        summary.clear()
+
+        assert summary.loaded is False
+        assert summary.snapshot(date(2024, 2, 1))["active"] == 0
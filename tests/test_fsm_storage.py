@@ -0,0 +1,304 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy.dialects import postgresql
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+from fsm_storage import PostgresStorage
+
+KEY = StorageKey(bot_id=1, chat_id=42, user_id=42)
+OTHER_KEY = StorageKey(bot_id=1, chat_id=43, user_id=43)
+BUSINESS_KEY = StorageKey(bot_id=1, chat_id=42, user_id=42, business_connection_id="bc-1")
+
+
+class Flow(StatesGroup):
+    first = State()
+    second = State()
+
+
+def _session_factory(row=None):
+    """Фабрика сессий-моков: все сессии общие, execute возвращает row"""
+    session = AsyncMock()
+    result = MagicMock()
+    result.first.return_value = row
+    result.rowcount = 0
+    session.execute = AsyncMock(return_value=result)
+    factory = MagicMock()
+    factory.return_value.__aenter__.return_value = session
+    return factory, session
+
+
+def _sql(session, index=0):
+    stmt = session.execute.call_args_list[index][0][0]
+    return str(stmt.compile(dialect=postgresql.dialect()))
+
+
+def _params(session, index=0):
+    stmt = session.execute.call_args_list[index][0][0]
+    return stmt.compile(dialect=postgresql.dialect()).params
+
+
+class _SharedTable:
+    """Общая таблица fsm_state для двух экземпляров хранилища (двух реплик): видно только закоммиченное"""
+
+    def __init__(self):
+        self.row = None
+
+    def factory(self):
+        table = self
+        session = AsyncMock()
+        staged = []
+
+        async def execute(stmt):
+            sql = str(stmt.compile(dialect=postgresql.dialect()))
+            result = MagicMock()
+            if sql.startswith("INSERT INTO fsm_state"):
+                params = stmt.compile(dialect=postgresql.dialect()).params
+                staged.append(MagicMock(state=params.get("state_m0"), data=params.get("data_m0") or {}))
+            result.first.return_value = table.row
+            return result
+
+        async def commit():
+            if staged:
+                table.row = staged[-1]
+
+        session.execute = AsyncMock(side_effect=execute)
+        session.commit = AsyncMock(side_effect=commit)
+        factory = MagicMock()
+        factory.return_value.__aenter__.return_value = session
+        return factory
+
+
+class TestBufferedWrites:
+    """Тесты для буфера записи"""
+
+    @pytest.mark.asyncio
+    async def test_writes_coalesced_into_one_upsert(self):
+        """Тест что состояние и данные одного ключа уходят одним UPSERT"""
+        factory, session = _session_factory()
+        storage = PostgresStorage(factory, write_delay=60)
+
+        await storage.set_data(KEY, {"machine_id": 5})
+        await storage.set_state(KEY, Flow.first)
+        await storage.set_state(KEY, Flow.second)
+        session.execute.assert_not_called()
+
+        await storage.flush()
+
+        assert session.execute.call_count == 1
+        sql = _sql(session)
+        assert "INSERT INTO fsm_state" in sql
+        assert "ON CONFLICT (bot_id, chat_id, user_id, thread_id, business_connection_id, destiny) DO UPDATE" in sql
+        params = _params(session)
+        assert params["state_m0"] == "Flow:second"
+        assert params["data_m0"] == {"machine_id": 5}
+        session.commit.assert_called_once()
+        await storage.close()
+
+    @pytest.mark.asyncio
+    async def test_reads_own_writes_from_buffer(self):
+        """Тест что незаписанные изменения читаются из буфера без запроса в БД"""
+        factory, session = _session_factory()
+        storage = PostgresStorage(factory, write_delay=60)
+
+        await storage.set_state(KEY, Flow.first)
+        await storage.set_data(KEY, {"amount": 100})
+
+        assert await storage.get_state(KEY) == "Flow:first"
+        assert await storage.get_data(KEY) == {"amount": 100}
+        session.execute.assert_not_called()
+        await storage.close()
+
+    @pytest.mark.asyncio
+    async def test_buffer_returns_copy(self):
+        """Тест что изменение полученного словаря не меняет буфер"""
+        factory, _ = _session_factory()
+        storage = PostgresStorage(factory, write_delay=60)
+        await storage.set_data(KEY, {"amount": 100})
+
+        data = await storage.get_data(KEY)
+        data["amount"] = 1
+
+        assert await storage.get_data(KEY) == {"amount": 100}
+        await storage.close()
+
+    @pytest.mark.asyncio
+    async def test_write_through_without_delay(self):
+        """Тест что при write_delay=0 запись уходит сразу"""
+        factory, session = _session_factory()
+        storage = PostgresStorage(factory, write_delay=0)
+
+        await storage.set_state(KEY, Flow.first)
+
+        assert session.execute.call_count == 1
+        assert _params(session)["state_m0"] == "Flow:first"
+
+    @pytest.mark.asyncio
+    async def test_full_buffer_flushes_immediately(self):
+        """Тест сброса буфера при достижении max_pending"""
+        factory, session = _session_factory()
+        storage = PostgresStorage(factory, write_delay=60, max_pending=2)
+
+        await storage.set_state(KEY, Flow.first)
+        session.execute.assert_not_called()
+        await storage.set_state(OTHER_KEY, Flow.first)
+
+        assert session.execute.call_count == 1
+        await storage.close()
+
+    @pytest.mark.asyncio
+    async def test_clear_deletes_row(self):
+        """Тест что state.clear() удаляет строку вместо записи пустого состояния"""
+        factory, session = _session_factory()
+        storage = PostgresStorage(factory, write_delay=60)
+        context = FSMContext(storage, KEY)
+
+        await context.set_state(Flow.first)
+        await context.clear()
+        await storage.flush()
+
+        assert session.execute.call_count == 1
+        assert _sql(session).startswith("DELETE FROM fsm_state")
+        assert await storage.get_state(KEY) is None
+        await storage.close()
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_is_retried_and_newer_write_wins(self):
+        """Тест что при ошибке записи изменения остаются в буфере, а более новые не затираются"""
+        factory, session = _session_factory()
+        storage = PostgresStorage(factory, write_delay=60)
+        await storage.set_state(KEY, Flow.first)
+        await storage.set_data(KEY, {"amount": 100})
+        session.execute.side_effect = [OSError("connection lost")]
+
+        await storage.flush()
+        await storage.set_state(KEY, Flow.second)
+
+        assert await storage.get_state(KEY) == "Flow:second"
+        assert await storage.get_data(KEY) == {"amount": 100}
+
+        session.execute.side_effect = None
+        await storage.flush()
+        params = _params(session, 1)
+        assert params["state_m0"] == "Flow:second"
+        await storage.close()
+
+    @pytest.mark.asyncio
+    async def test_business_connection_is_part_of_key(self):
+        """Тест что диалоги одного чата через бизнес-подключение и напрямую не смешиваются"""
+        factory, session = _session_factory()
+        storage = PostgresStorage(factory, write_delay=60)
+
+        await storage.set_state(KEY, Flow.first)
+        await storage.set_state(BUSINESS_KEY, Flow.second)
+
+        assert await storage.get_state(KEY) == "Flow:first"
+        assert await storage.get_state(BUSINESS_KEY) == "Flow:second"
+        await storage.flush()
+        params = _params(session)
+        assert {params["business_connection_id_m0"], params["business_connection_id_m1"]} == {"", "bc-1"}
+        await storage.close()
+
+    @pytest.mark.asyncio
+    async def test_background_flush_sleeps_when_idle(self):
+        """Тест что фоновая запись срабатывает по изменениям, а без них не просыпается"""
+        factory, session = _session_factory()
+        storage = PostgresStorage(factory, write_delay=0.01)
+
+        await storage.set_state(KEY, Flow.first)
+        await asyncio.sleep(0.1)
+        assert session.execute.call_count == 1
+
+        storage.flush = AsyncMock(wraps=storage.flush)
+        await asyncio.sleep(0.1)
+        storage.flush.assert_not_called()
+
+        await storage.set_state(KEY, Flow.second)
+        await asyncio.sleep(0.1)
+        assert session.execute.call_count == 2
+        await storage.close()
+
+    @pytest.mark.asyncio
+    async def test_other_instance_reads_state_without_buffer(self):
+        """Тест что без буфера (webhook) следующее обновление в другой реплике видит новое состояние"""
+        table = _SharedTable()
+        writer = PostgresStorage(table.factory(), write_delay=0)
+        reader = PostgresStorage(table.factory(), write_delay=0)
+
+        await writer.set_state(KEY, Flow.first)
+
+        assert await reader.get_state(KEY) == "Flow:first"
+
+    @pytest.mark.asyncio
+    async def test_buffered_state_is_not_visible_to_other_instance(self):
+        """Тест что буферизованное состояние другая реплика не видит до сброса — буфер только при липкой маршрутизации"""
+        table = _SharedTable()
+        writer = PostgresStorage(table.factory(), write_delay=60)
+        reader = PostgresStorage(table.factory(), write_delay=0)
+
+        await writer.set_state(KEY, Flow.first)
+        assert await reader.get_state(KEY) is None
+
+        await writer.close()
+        assert await reader.get_state(KEY) == "Flow:first"
+
+    @pytest.mark.asyncio
+    async def test_close_flushes(self):
+        """Тест что при остановке бота буфер записывается"""
+        factory, session = _session_factory()
+        storage = PostgresStorage(factory, write_delay=60)
+        await storage.set_state(KEY, Flow.first)
+
+        await storage.close()
+
+        assert session.execute.call_count == 1
+
+
+class TestReads:
+    """Тесты для чтения из БД"""
+
+    @pytest.mark.asyncio
+    async def test_reads_row_skipping_expired(self):
+        """Тест чтения состояния из БД с учётом TTL"""
+        factory, session = _session_factory(row=MagicMock(state="Flow:first", data={"amount": 100}))
+        storage = PostgresStorage(factory, write_delay=60)
+
+        assert await storage.get_state(KEY) == "Flow:first"
+        assert await storage.get_data(KEY) == {"amount": 100}
+        assert "fsm_state.updated_at >" in _sql(session)
+
+    @pytest.mark.asyncio
+    async def test_missing_row(self):
+        """Тест что отсутствующий диалог — пустое состояние и данные"""
+        factory, _ = _session_factory(row=None)
+        storage = PostgresStorage(factory, write_delay=60)
+
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_data(KEY) == {}
+
+    @pytest.mark.asyncio
+    async def test_update_data_merges_with_stored(self):
+        """Тест что update_data дополняет данные из БД"""
+        factory, session = _session_factory(row=MagicMock(state="Flow:first", data={"machine_id": 5}))
+        storage = PostgresStorage(factory, write_delay=60)
+        context = FSMContext(storage, KEY)
+
+        assert await context.update_data(amount=100) == {"machine_id": 5, "amount": 100}
+        assert session.execute.call_count == 1
+        await storage.close()
+
+
+class TestCleanup:
+    """Тесты для удаления брошенных диалогов"""
+
+    @pytest.mark.asyncio
+    async def test_cleanup_expired(self):
+        """Тест удаления диалогов старше TTL"""
+        factory, session = _session_factory()
+        session.execute.return_value.rowcount = 3
+        storage = PostgresStorage(factory, ttl=3600)
+
+        assert await storage.cleanup_expired() == 3
+        assert "DELETE FROM fsm_state WHERE fsm_state.updated_at <" in _sql(session)
+        session.commit.assert_called_once()
@@ -61,8 +61,9 @@ class TestSelectModel:
         mock_callback.answer = AsyncMock()
         mock_state = AsyncMock(spec=FSMContext)
         
-        with patch('handlers.add_machine.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
+        with patch('handlers.add_machine.get_machine_model_by_id', new_callable=AsyncMock, return_value=mock_machine_model) as mock_get:
             await select_model(mock_callback, mock_state)
+            mock_get.assert_called_once_with(mock_machine_model.id)
             
             mock_state.update_data.assert_called()
             mock_callback.message.answer.assert_called_once()
@@ -79,7 +80,7 @@ class TestSelectModel:
         mock_callback.answer = AsyncMock()
         mock_state = AsyncMock(spec=FSMContext)
         
-        with patch('handlers.add_machine.get_all_machine_models', new_callable=AsyncMock, return_value=[]):
+        with patch('handlers.add_machine.get_machine_model_by_id', new_callable=AsyncMock, return_value=None):
             await select_model(mock_callback, mock_state)
             
             mock_callback.message.answer.assert_called_once()
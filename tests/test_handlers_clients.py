@@ -26,44 +26,58 @@ class TestGetClientInfo:
     async def test_get_client_info(self, mock_coffee_machine, mock_machine_model):
         """Тест получения информации о клиенте"""
         with patch('handlers.clients.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
-            with patch('handlers.clients.get_payments_by_machine', new_callable=AsyncMock, return_value=[]):
-                with patch('handlers.clients.get_last_payment_date', new_callable=AsyncMock, return_value=None):
-                    info = await get_client_info(mock_coffee_machine)
-                    
-                    assert "Иван Иванов" in info
-                    assert "996555123456" in info
-                    assert "Saeco Lirika" in info
-                    assert "50000" in info or "50000.0" in info
+            info = await get_client_info(mock_coffee_machine)
+                
+            assert "Иван Иванов" in info
+            assert "996555123456" in info
+            assert "Saeco Lirika" in info
+            assert "50000" in info or "50000.0" in info
     
     @pytest.mark.asyncio
     async def test_get_client_info_with_payments(self, mock_coffee_machine, mock_machine_model, mock_payment):
         """Тест получения информации о клиенте с платежами"""
+        mock_coffee_machine.total_paid = mock_payment.amount
+        mock_coffee_machine.last_payment_date = mock_payment.payment_date
+        mock_coffee_machine.payments_count = 1
         with patch('handlers.clients.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
-            with patch('handlers.clients.get_payments_by_machine', new_callable=AsyncMock, return_value=[mock_payment]):
-                with patch('handlers.clients.get_last_payment_date', new_callable=AsyncMock, return_value=date(2024, 1, 15)):
-                    info = await get_client_info(mock_coffee_machine)
-                    
-                    assert "Иван Иванов" in info
-                    assert "50000" in info or "50000.0" in info
+            info = await get_client_info(mock_coffee_machine)
+                
+            assert "Иван Иванов" in info
+            assert "Уже оплачено с депозитом: 150000.0" in info
+            assert "Остаток: 150000.0" in info
+            assert "Последний платеж: 2024-01-15" in info
 
 
 class TestShowClients:
     """Тесты для показа клиентов"""
     
     @pytest.mark.asyncio
-    async def test_show_clients_with_active(self, mock_coffee_machine):
+    async def test_show_clients_with_active(self, mock_coffee_machine, make_ledger_row):
         """Тест показа клиентов когда есть активные"""
         mock_msg = AsyncMock(spec=Message)
         mock_msg.answer = AsyncMock()
         mock_state = AsyncMock(spec=FSMContext)
         
-        with patch('handlers.clients.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
-            with patch('handlers.clients.get_payments_by_machine', new_callable=AsyncMock, return_value=[]):
-                with patch('handlers.clients.get_last_payment_date', new_callable=AsyncMock, return_value=None):
-                    await show_clients(mock_msg, mock_state)
-                    
-                    mock_msg.answer.assert_called_once()
-                    mock_state.set_state.assert_called_once_with(EditFSM.select_machine)
+        with patch('handlers.clients.get_machines_with_totals', new_callable=AsyncMock, return_value=[make_ledger_row(mock_coffee_machine)]) as mock_totals:
+            await show_clients(mock_msg, mock_state)
+            
+            mock_totals.assert_called_once_with(status="active")
+            mock_msg.answer.assert_called_once()
+            mock_state.set_state.assert_called_once_with(EditFSM.select_machine)
+    
+    @pytest.mark.asyncio
+    async def test_show_clients_uses_last_payment_from_totals(self, mock_coffee_machine, make_ledger_row):
+        """Тест: статус платежа считается по дате из агрегирующего запроса"""
+        mock_msg = AsyncMock(spec=Message)
+        mock_msg.answer = AsyncMock()
+        mock_state = AsyncMock(spec=FSMContext)
+        row = make_ledger_row(mock_coffee_machine, last_payment_date=date.today(), payment_count=1)
+        
+        with patch('handlers.clients.get_machines_with_totals', new_callable=AsyncMock, return_value=[row]):
+            await show_clients(mock_msg, mock_state)
+            
+            kb = mock_msg.answer.call_args[1]["reply_markup"]
+            assert "🟢 32д" in kb.inline_keyboard[0][0].text
     
     @pytest.mark.asyncio
     async def test_show_clients_empty(self):
@@ -72,7 +86,7 @@ class TestShowClients:
         mock_msg.answer = AsyncMock()
         mock_state = AsyncMock(spec=FSMContext)
         
-        with patch('handlers.clients.get_all_machines', new_callable=AsyncMock, return_value=[]):
+        with patch('handlers.clients.get_machines_with_totals', new_callable=AsyncMock, return_value=[]):
             await show_clients(mock_msg, mock_state)
             
             mock_msg.answer.assert_called_once()
@@ -92,16 +106,15 @@ class TestSelectClient:
         mock_callback.answer = AsyncMock()
         mock_state = AsyncMock(spec=FSMContext)
         
-        with patch('handlers.clients.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.clients.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine) as mock_get:
             with patch('handlers.clients.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
-                with patch('handlers.clients.get_payments_by_machine', new_callable=AsyncMock, return_value=[]):
-                    with patch('handlers.clients.get_last_payment_date', new_callable=AsyncMock, return_value=None):
-                        await select_client(mock_callback, mock_state)
-                        
-                        mock_callback.message.answer.assert_called()
-                        mock_state.update_data.assert_called_once()
-                        mock_state.set_state.assert_called_once_with(EditFSM.action)
-                        mock_callback.answer.assert_called_once()
+                await select_client(mock_callback, mock_state)
+                    
+                mock_get.assert_called_once_with(1)
+                mock_callback.message.answer.assert_called()
+                mock_state.update_data.assert_called_once()
+                mock_state.set_state.assert_called_once_with(EditFSM.action)
+                mock_callback.answer.assert_called_once()
     
     @pytest.mark.asyncio
     async def test_select_client_not_found(self):
@@ -113,7 +126,7 @@ class TestSelectClient:
         mock_callback.answer = AsyncMock()
         mock_state = AsyncMock(spec=FSMContext)
         
-        with patch('handlers.clients.get_all_machines', new_callable=AsyncMock, return_value=[]):
+        with patch('handlers.clients.get_machine_by_id', new_callable=AsyncMock, return_value=None):
             await select_client(mock_callback, mock_state)
             
             mock_callback.message.answer.assert_called_once()
@@ -134,7 +147,7 @@ class TestEditPrice:
         mock_state = AsyncMock(spec=FSMContext)
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1})
         
-        with patch('handlers.clients.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.clients.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
             await edit_price_start(mock_callback, mock_state)
             
             mock_callback.message.answer.assert_called_once()
@@ -151,15 +164,13 @@ class TestEditPrice:
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1})
         
         with patch('handlers.clients.update_machine_full_price', new_callable=AsyncMock):
-            with patch('handlers.clients.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+            with patch('handlers.clients.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
                 with patch('handlers.clients.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
-                    with patch('handlers.clients.get_payments_by_machine', new_callable=AsyncMock, return_value=[]):
-                        with patch('handlers.clients.get_last_payment_date', new_callable=AsyncMock, return_value=None):
-                            with patch('handlers.clients.get_client_info', new_callable=AsyncMock, return_value="Test info"):
-                                await edit_price_save(mock_msg, mock_state)
-                                
-                                mock_msg.answer.assert_called()
-                                mock_state.clear.assert_called_once()
+                    with patch('handlers.clients.get_client_info', new_callable=AsyncMock, return_value="Test info"):
+                        await edit_price_save(mock_msg, mock_state)
+                        
+                        mock_msg.answer.assert_called()
+                        mock_state.clear.assert_called_once()
     
     @pytest.mark.asyncio
     async def test_edit_price_save_invalid(self):
@@ -188,7 +199,7 @@ class TestEditDealType:
         mock_state = AsyncMock(spec=FSMContext)
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1})
         
-        with patch('handlers.clients.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.clients.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
             await edit_dealtype_start(mock_callback, mock_state)
             
             mock_callback.message.answer.assert_called()
@@ -207,16 +218,14 @@ class TestEditDealType:
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1})
         
         with patch('handlers.clients.update_machine_deal_type', new_callable=AsyncMock):
-            with patch('handlers.clients.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+            with patch('handlers.clients.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
                 with patch('handlers.clients.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
-                    with patch('handlers.clients.get_payments_by_machine', new_callable=AsyncMock, return_value=[]):
-                        with patch('handlers.clients.get_last_payment_date', new_callable=AsyncMock, return_value=None):
-                            with patch('handlers.clients.get_client_info', new_callable=AsyncMock, return_value="Test info"):
-                                await edit_dealtype_save(mock_callback, mock_state)
-                                
-                                mock_callback.message.answer.assert_called()
-                                mock_state.clear.assert_called_once()
-                                mock_callback.answer.assert_called_once()
+                    with patch('handlers.clients.get_client_info', new_callable=AsyncMock, return_value="Test info"):
+                        await edit_dealtype_save(mock_callback, mock_state)
+                        
+                        mock_callback.message.answer.assert_called()
+                        mock_state.clear.assert_called_once()
+                        mock_callback.answer.assert_called_once()
 
 
 class TestEdit1C:
@@ -232,7 +241,7 @@ class TestEdit1C:
         mock_state = AsyncMock(spec=FSMContext)
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1})
         
-        with patch('handlers.clients.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.clients.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
             await edit_1c_start(mock_callback, mock_state)
             
             mock_callback.message.answer.assert_called()
@@ -251,16 +260,14 @@ class TestEdit1C:
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1})
         
         with patch('handlers.clients.update_machine_1c', new_callable=AsyncMock):
-            with patch('handlers.clients.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+            with patch('handlers.clients.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
                 with patch('handlers.clients.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
-                    with patch('handlers.clients.get_payments_by_machine', new_callable=AsyncMock, return_value=[]):
-                        with patch('handlers.clients.get_last_payment_date', new_callable=AsyncMock, return_value=None):
-                            with patch('handlers.clients.get_client_info', new_callable=AsyncMock, return_value="Test info"):
-                                await edit_1c_save(mock_callback, mock_state)
-                                
-                                mock_callback.message.answer.assert_called()
-                                mock_state.clear.assert_called_once()
-                                mock_callback.answer.assert_called_once()
+                    with patch('handlers.clients.get_client_info', new_callable=AsyncMock, return_value="Test info"):
+                        await edit_1c_save(mock_callback, mock_state)
+                        
+                        mock_callback.message.answer.assert_called()
+                        mock_state.clear.assert_called_once()
+                        mock_callback.answer.assert_called_once()
 
 
 class TestEditRent:
@@ -276,7 +283,7 @@ class TestEditRent:
         mock_state = AsyncMock(spec=FSMContext)
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1})
         
-        with patch('handlers.clients.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.clients.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
             await edit_rent_start(mock_callback, mock_state)
             
             mock_callback.message.answer.assert_called_once()
@@ -293,15 +300,13 @@ class TestEditRent:
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1})
         
         with patch('handlers.clients.update_machine_rent_price', new_callable=AsyncMock):
-            with patch('handlers.clients.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+            with patch('handlers.clients.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
                 with patch('handlers.clients.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
-                    with patch('handlers.clients.get_payments_by_machine', new_callable=AsyncMock, return_value=[]):
-                        with patch('handlers.clients.get_last_payment_date', new_callable=AsyncMock, return_value=None):
-                            with patch('handlers.clients.get_client_info', new_callable=AsyncMock, return_value="Test info"):
-                                await edit_rent_save(mock_msg, mock_state)
-                                
-                                mock_msg.answer.assert_called()
-                                mock_state.clear.assert_called_once()
+                    with patch('handlers.clients.get_client_info', new_callable=AsyncMock, return_value="Test info"):
+                        await edit_rent_save(mock_msg, mock_state)
+                        
+                        mock_msg.answer.assert_called()
+                        mock_state.clear.assert_called_once()
     
     @pytest.mark.asyncio
     async def test_edit_rent_save_invalid(self):
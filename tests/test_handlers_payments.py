@@ -9,8 +9,12 @@ from handlers.payments import (
     select_payment_type,
     input_payment_amount,
     input_payment_date,
-    AddPayment
+    start_import_payments,
+    import_payments_file,
+    AddPayment,
+    ImportPayments,
 )
+from io import BytesIO
 
 
 class TestStartPayments:
@@ -22,14 +26,18 @@ class TestStartPayments:
         mock_msg = AsyncMock(spec=Message)
         mock_msg.answer = AsyncMock()
         mock_state = AsyncMock(spec=FSMContext)
+        mock_coffee_machine.total_paid = 50000.0
+        mock_coffee_machine.payments_count = 1
         
-        with patch('handlers.payments.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.payments.get_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
             with patch('handlers.payments.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
-                with patch('handlers.payments.get_payments_by_machine', new_callable=AsyncMock, return_value=[]):
-                    await start_payments(mock_msg, mock_state)
-                    
-                    mock_msg.answer.assert_called_once()
-                    mock_state.set_state.assert_called_once_with(AddPayment.select_machine)
+                await start_payments(mock_msg, mock_state)
+                
+                mock_msg.answer.assert_called_once()
+                kb = mock_msg.answer.call_args[1]["reply_markup"]
+                # 300000 - (50000 платежей + 100000 залог)
+                assert "Остаток: 150000.00" in kb.inline_keyboard[0][0].text
+                mock_state.set_state.assert_called_once_with(AddPayment.select_machine)
     
     @pytest.mark.asyncio
     async def test_start_payments_no_active_machines(self):
@@ -37,10 +45,8 @@ class TestStartPayments:
         mock_msg = AsyncMock(spec=Message)
         mock_msg.answer = AsyncMock()
         mock_state = AsyncMock(spec=FSMContext)
-        mock_machine = MagicMock()
-        mock_machine.status = "buyout"
         
-        with patch('handlers.payments.get_all_machines', new_callable=AsyncMock, return_value=[mock_machine]):
+        with patch('handlers.payments.get_machines', new_callable=AsyncMock, return_value=[]):
             await start_payments(mock_msg, mock_state)
             
             mock_msg.answer.assert_called_once()
@@ -82,7 +88,7 @@ class TestSelectPaymentType:
         mock_state = AsyncMock(spec=FSMContext)
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1})
         
-        with patch('handlers.payments.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.payments.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
             await select_payment_type(mock_callback, mock_state)
             
             mock_state.update_data.assert_called_once()
@@ -101,7 +107,7 @@ class TestSelectPaymentType:
         mock_state = AsyncMock(spec=FSMContext)
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1})
         
-        with patch('handlers.payments.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.payments.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
             await select_payment_type(mock_callback, mock_state)
             
             mock_state.update_data.assert_called_once()
@@ -112,6 +118,7 @@ class TestSelectPaymentType:
     @pytest.mark.asyncio
     async def test_select_payment_type_buyout(self, mock_coffee_machine, mock_machine_model):
         """Тест выбора типа платежа - выкуп"""
+        mock_coffee_machine.total_paid = 120000.0
         mock_callback = AsyncMock(spec=CallbackQuery)
         mock_callback.data = "type_buyout"
         mock_callback.message = AsyncMock(spec=Message)
@@ -120,15 +127,15 @@ class TestSelectPaymentType:
         mock_state = AsyncMock(spec=FSMContext)
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1})
         
-        with patch('handlers.payments.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.payments.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
             with patch('handlers.payments.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
-                with patch('handlers.payments.get_payments_by_machine', new_callable=AsyncMock, return_value=[]):
-                    await select_payment_type(mock_callback, mock_state)
+                await select_payment_type(mock_callback, mock_state)
                     
-                    mock_state.update_data.assert_called_once()
-                    mock_callback.message.answer.assert_called_once()
-                    mock_state.set_state.assert_called_once_with(AddPayment.amount)
-                    mock_callback.answer.assert_called_once()
+                mock_state.update_data.assert_called_once()
+                mock_callback.message.answer.assert_called_once()
+                assert "Остаток к доплате: 180000.0" in mock_callback.message.answer.call_args[0][0]
+                mock_state.set_state.assert_called_once_with(AddPayment.amount)
+                mock_callback.answer.assert_called_once()
 
 
 class TestInputPaymentAmount:
@@ -143,7 +150,7 @@ class TestInputPaymentAmount:
         mock_state = AsyncMock(spec=FSMContext)
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1, "payment_type": "rent"})
         
-        with patch('handlers.payments.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.payments.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
             await input_payment_amount(mock_msg, mock_state)
             
             mock_state.update_data.assert_called_once()
@@ -159,7 +166,7 @@ class TestInputPaymentAmount:
         mock_state = AsyncMock(spec=FSMContext)
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1, "payment_type": "rent"})
         
-        with patch('handlers.payments.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.payments.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
             await input_payment_amount(mock_msg, mock_state)
             
             mock_state.update_data.assert_called_once()
@@ -190,7 +197,7 @@ class TestInputPaymentAmount:
         mock_state = AsyncMock(spec=FSMContext)
         mock_state.get_data = AsyncMock(return_value={"machine_id": 1, "payment_type": "buyout"})
         
-        with patch('handlers.payments.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.payments.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
             await input_payment_amount(mock_msg, mock_state)
             
             mock_state.update_data.assert_not_called()
@@ -214,18 +221,14 @@ class TestInputPaymentDate:
             "amount": 50000.0
         })
         
-        with patch('handlers.payments.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.payments.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
             with patch('handlers.payments.add_payment', new_callable=AsyncMock):
-                with patch('handlers.payments.AsyncSessionLocal') as mock_session_local:
-                    mock_session = AsyncMock()
-                    mock_session_local.return_value.__aenter__.return_value = mock_session
-                    mock_session.execute = AsyncMock()
-                    mock_session.commit = AsyncMock()
-                    
+                with patch('handlers.payments.update_machine_status', new_callable=AsyncMock) as mock_update_status:
                     await input_payment_date(mock_msg, mock_state)
                     
                     mock_msg.answer.assert_called_once()
                     mock_state.clear.assert_called_once()
+                    mock_update_status.assert_not_called()
     
     @pytest.mark.asyncio
     async def test_input_payment_date_custom(self, mock_coffee_machine):
@@ -240,18 +243,14 @@ class TestInputPaymentDate:
             "amount": 50000.0
         })
         
-        with patch('handlers.payments.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.payments.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
             with patch('handlers.payments.add_payment', new_callable=AsyncMock):
-                with patch('handlers.payments.AsyncSessionLocal') as mock_session_local:
-                    mock_session = AsyncMock()
-                    mock_session_local.return_value.__aenter__.return_value = mock_session
-                    mock_session.execute = AsyncMock()
-                    mock_session.commit = AsyncMock()
-                    
+                with patch('handlers.payments.update_machine_status', new_callable=AsyncMock) as mock_update_status:
                     await input_payment_date(mock_msg, mock_state)
                     
                     mock_msg.answer.assert_called_once()
                     mock_state.clear.assert_called_once()
+                    mock_update_status.assert_not_called()
     
     @pytest.mark.asyncio
     async def test_input_payment_date_invalid(self):
@@ -280,18 +279,81 @@ class TestInputPaymentDate:
             "amount": 200000.0
         })
         
-        with patch('handlers.payments.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.payments.get_machine_by_id', new_callable=AsyncMock, return_value=mock_coffee_machine):
             with patch('handlers.payments.add_payment', new_callable=AsyncMock):
-                with patch('handlers.payments.AsyncSessionLocal') as mock_session_local:
-                    mock_session = AsyncMock()
-                    mock_session_local.return_value.__aenter__.return_value = mock_session
-                    mock_session.execute = AsyncMock()
-                    mock_session.commit = AsyncMock()
-                    
+                with patch('handlers.payments.update_machine_status', new_callable=AsyncMock) as mock_update_status:
                     await input_payment_date(mock_msg, mock_state)
                     
-                    mock_session.execute.assert_called()
-                    mock_session.commit.assert_called()
+                    mock_update_status.assert_called_once_with(1, "buyout", buyout=True, buyout_date=date(2024, 6, 1))
                     mock_msg.answer.assert_called_once()
                     mock_state.clear.assert_called_once()
 
+
+class TestImportPayments:
+    """Тесты для массовой загрузки платежей из файла"""
+    
+    @pytest.mark.asyncio
+    async def test_start_import_rejects_non_admin(self):
+        """Тест что импорт недоступен не администратору"""
+        mock_msg = AsyncMock(spec=Message)
+        mock_msg.answer = AsyncMock()
+        mock_msg.from_user = MagicMock(id=1)
+        mock_state = AsyncMock(spec=FSMContext)
+        
+        with patch('handlers.payments.ADMIN_ID', 2):
+            await start_import_payments(mock_msg, mock_state)
+        
+        assert "администратору" in mock_msg.answer.call_args[0][0]
+        mock_state.set_state.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_start_import_waits_for_file(self):
+        """Тест перехода в ожидание файла для администратора"""
+        mock_msg = AsyncMock(spec=Message)
+        mock_msg.answer = AsyncMock()
+        mock_msg.from_user = MagicMock(id=2)
+        mock_state = AsyncMock(spec=FSMContext)
+        
+        with patch('handlers.payments.ADMIN_ID', 2):
+            await start_import_payments(mock_msg, mock_state)
+        
+        mock_state.set_state.assert_called_once_with(ImportPayments.waiting_file)
+    
+    @staticmethod
+    def _file_message(content: bytes, file_name: str):
+        mock_msg = AsyncMock(spec=Message)
+        mock_msg.answer = AsyncMock()
+        mock_msg.document = MagicMock(file_name=file_name)
+        mock_msg.bot = MagicMock()
+        mock_msg.bot.download = AsyncMock(return_value=BytesIO(content))
+        return mock_msg
+    
+    @pytest.mark.asyncio
+    async def test_import_file_inserts_payments(self):
+        """Тест загрузки CSV одной пачкой"""
+        content = "ID сделки;Сумма;Дата платежа\n1;9000;15.01.2024\n2;12000;16.01.2024\n".encode()
+        mock_msg = self._file_message(content, "payments.csv")
+        mock_state = AsyncMock(spec=FSMContext)
+        
+        with patch('handlers.payments.add_payments_bulk', new_callable=AsyncMock, return_value=[10, 11]) as mock_bulk:
+            await import_payments_file(mock_msg, mock_state)
+        
+        payments = mock_bulk.call_args[0][0]
+        assert [p["machine_id"] for p in payments] == [1, 2]
+        assert payments[0]["payment_date"] == date(2024, 1, 15)
+        assert "Импортировано платежей: 2" in mock_msg.answer.call_args[0][0]
+        mock_state.clear.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_import_file_reports_unknown_machines(self):
+        """Тест что ошибка проверки id сделок показывается пользователю"""
+        content = "machine_id,amount,payment_date\n99,9000,2024-01-15\n".encode()
+        mock_msg = self._file_message(content, "payments.csv")
+        mock_state = AsyncMock(spec=FSMContext)
+        
+        with patch('handlers.payments.add_payments_bulk', new_callable=AsyncMock,
+                   side_effect=ValueError("Не найдены сделки с id: 99")):
+            await import_payments_file(mock_msg, mock_state)
+        
+        assert "Не найдены сделки с id: 99" in mock_msg.answer.call_args[0][0]
+        mock_state.clear.assert_called_once()
@@ -1,38 +1,50 @@
 import pytest
+import io
+import zipfile
 from unittest.mock import AsyncMock, MagicMock, patch
 from datetime import date, timedelta
 from aiogram.types import Message
-from handlers.reports import send_excel_report, choose_plot, send_summary, send_profit_share
+from handlers.reports import send_excel_report, choose_plot, send_summary, send_profit_share, plot_payments
+from handlers.reports import send_cached_report, send_plot, send_export
+from utils.plots import PlotImage
+from aiogram.exceptions import TelegramBadRequest
 
 
 class TestSendExcelReport:
     """Тесты для отправки Excel отчета"""
     
     @pytest.mark.asyncio
-    async def test_send_excel_report_with_active_machines(self, mock_coffee_machine, mock_machine_model):
+    async def test_send_excel_report_with_active_machines(self, mock_coffee_machine, mock_machine_model, mock_payment, make_report_columns):
         """Тест отправки Excel отчета с активными машинами"""
         mock_msg = AsyncMock(spec=Message)
         mock_msg.answer_document = AsyncMock()
+        mock_coffee_machine.total_paid = 50000.0
+        mock_coffee_machine.payments_count = 1
+        columns = make_report_columns([mock_coffee_machine], [mock_payment])
         
-        with patch('handlers.reports.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.reports.fetch_report_columns', new_callable=AsyncMock, return_value=columns) as mock_fetch:
             with patch('handlers.reports.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
-                with patch('handlers.reports.get_payments_by_machine', new_callable=AsyncMock, return_value=[]):
-                    with patch('handlers.reports.generate_excel_report') as mock_generate:
+                    with patch('utils.report_frames.generate_excel_report') as mock_generate:
                         mock_file = MagicMock()
                         mock_file.read.return_value = b"test content"
                         mock_generate.return_value = mock_file
                         
                         await send_excel_report(mock_msg)
                         
+                        mock_fetch.assert_called_once()
+                        active_data, payments_data, _ = mock_generate.call_args[0]
+                        assert active_data["Остаток к выплате"][0] == 150000.0
+                        assert payments_data["Остаток к доплате"][0] == 250000.0
                         mock_msg.answer_document.assert_called_once()
                         mock_generate.assert_called_once()
     
     @pytest.mark.asyncio
-    async def test_send_excel_report_with_closed_machines(self, mock_coffee_machine, mock_machine_model):
+    async def test_send_excel_report_with_closed_machines(self, mock_coffee_machine, mock_machine_model, make_report_columns):
         """Тест отправки Excel отчета с закрытыми машинами"""
         mock_msg = AsyncMock(spec=Message)
         mock_msg.answer_document = AsyncMock()
         mock_closed_machine = MagicMock()
+        mock_closed_machine.id = 2
         mock_closed_machine.status = "buyout"
         mock_closed_machine.model = "Jura E8"
         mock_closed_machine.barcode = "987654321"
@@ -45,31 +57,116 @@ class TestSendExcelReport:
         mock_closed_machine.deal_type = "Рассрочка"
         mock_closed_machine.comment = None
         mock_closed_machine.full_price = 400000.0
+        mock_closed_machine.total_paid = 0.0
+        columns = make_report_columns([mock_closed_machine])
         
-        with patch('handlers.reports.get_all_machines', new_callable=AsyncMock, return_value=[mock_closed_machine]):
+        with patch('handlers.reports.fetch_report_columns', new_callable=AsyncMock, return_value=columns):
             with patch('handlers.reports.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
-                with patch('handlers.reports.get_payments_by_machine', new_callable=AsyncMock, return_value=[]):
-                    with patch('handlers.reports.generate_excel_report') as mock_generate:
+                    with patch('utils.report_frames.generate_excel_report') as mock_generate:
                         mock_file = MagicMock()
                         mock_file.read.return_value = b"test content"
                         mock_generate.return_value = mock_file
                         
                         await send_excel_report(mock_msg)
                         
+                        _, _, closed_data = mock_generate.call_args[0]
+                        assert closed_data["Статус"][0] == "Закрыта (выкуп)"
+                        assert closed_data["Остаток к выплате"][0] == 400000.0
                         mock_msg.answer_document.assert_called_once()
                         mock_generate.assert_called_once()
 
+    
+    @pytest.mark.asyncio
+    async def test_filters_passed_to_sql_and_cache_key(self, mock_coffee_machine, mock_machine_model, make_report_columns):
+        """Тест что аргументы /report уходят в выборку, а отчёт кэшируется отдельно от полного"""
+        mock_msg = AsyncMock(spec=Message)
+        mock_msg.answer_document = AsyncMock()
+        columns = make_report_columns([mock_coffee_machine])
+        
+        with patch('handlers.reports.fetch_report_columns', new_callable=AsyncMock, return_value=columns) as mock_fetch:
+            with patch('handlers.reports.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
+                await send_excel_report(mock_msg, MagicMock(args="2025-01..2025-06 active"))
+                await send_excel_report(mock_msg)
+        
+        assert mock_fetch.call_args_list[0].kwargs == {
+            "date_from": date(2025, 1, 1), "date_to": date(2025, 6, 30), "statuses": ("active",),
+        }
+        assert mock_fetch.call_args_list[1].kwargs == {"date_from": None, "date_to": None, "statuses": ()}
+        filenames = [call[0][0].filename for call in mock_msg.answer_document.call_args_list]
+        assert filenames == ["coffee_report_2025-01-01..2025-06-30_active.xlsx", "coffee_report.xlsx"]
+    
+    @pytest.mark.asyncio
+    async def test_invalid_filters(self):
+        """Тест подсказки при неверных аргументах"""
+        mock_msg = AsyncMock(spec=Message)
+        mock_msg.answer = AsyncMock()
+        
+        with patch('handlers.reports.fetch_report_columns', new_callable=AsyncMock) as mock_fetch:
+            await send_excel_report(mock_msg, MagicMock(args="2025-13"))
+        
+        assert "Пример: /report" in mock_msg.answer.call_args[0][0]
+        mock_fetch.assert_not_called()
+
+
+class TestSendExport:
+    """Тесты для выгрузки /export в CSV и Parquet"""
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("args", [None, "xlsx"])
+    async def test_usage_hint(self, args):
+        """Тест подсказки при неизвестном формате"""
+        mock_msg = AsyncMock(spec=Message)
+        mock_msg.answer = AsyncMock()
+        mock_msg.answer_document = AsyncMock()
+        
+        with patch('handlers.reports.fetch_report_columns', new_callable=AsyncMock) as mock_fetch:
+            await send_export(mock_msg, MagicMock(args=args))
+        
+        assert mock_msg.answer.call_args[0][0].startswith("Использование: /export csv или /export parquet")
+        mock_fetch.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_parquet_without_pyarrow(self):
+        """Тест сообщения, если pyarrow не установлен"""
+        mock_msg = AsyncMock(spec=Message)
+        mock_msg.answer = AsyncMock()
+        mock_msg.answer_document = AsyncMock()
+        
+        with patch('handlers.reports.PARQUET_AVAILABLE', False):
+            await send_export(mock_msg, MagicMock(args="parquet"))
+        
+        assert "pyarrow" in mock_msg.answer.call_args[0][0]
+        mock_msg.answer_document.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_csv_zip_sent(self, mock_coffee_machine, mock_machine_model, mock_payment, make_report_columns):
+        """Тест отправки zip с CSV по листам отчёта"""
+        mock_msg = AsyncMock(spec=Message)
+        mock_msg.answer = AsyncMock()
+        mock_msg.answer_document = AsyncMock()
+        columns = make_report_columns([mock_coffee_machine], [mock_payment])
+        
+        with patch('handlers.reports.fetch_report_columns', new_callable=AsyncMock, return_value=columns):
+            with patch('handlers.reports.get_all_machine_models', new_callable=AsyncMock, return_value=[mock_machine_model]):
+                await send_export(mock_msg, MagicMock(args=" CSV "))
+        
+        document = mock_msg.answer_document.call_args[0][0]
+        assert document.filename == "coffee_report_csv.zip"
+        with zipfile.ZipFile(io.BytesIO(document.data)) as archive:
+            assert archive.namelist() == ["active.csv", "payments.csv", "closed.csv"]
+
 
 class TestChoosePlot:
     """Тесты для выбора графика"""
     
     @pytest.mark.asyncio
-    async def test_choose_plot_with_data(self, mock_coffee_machine):
+    async def test_choose_plot_with_data(self):
         """Тест выбора графика с данными"""
         mock_msg = AsyncMock(spec=Message)
         mock_msg.answer_photo = AsyncMock()
+        counts = [MagicMock(model="Saeco Lirika", count=3)]
         
-        with patch('handlers.reports.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
+        with patch('handlers.reports.get_model_counts', new_callable=AsyncMock, return_value=counts):
             with patch('handlers.reports.plot_top_models', new_callable=AsyncMock) as mock_plot:
                 mock_file = MagicMock()
                 mock_file.read.return_value = b"test image"
@@ -78,7 +175,7 @@ class TestChoosePlot:
                 await choose_plot(mock_msg)
                 
                 mock_msg.answer_photo.assert_called_once()
-                mock_plot.assert_called_once()
+                mock_plot.assert_called_once_with([{"model": "Saeco Lirika", "count": 3}])
     
     @pytest.mark.asyncio
     async def test_choose_plot_no_data(self):
@@ -86,7 +183,7 @@ class TestChoosePlot:
         mock_msg = AsyncMock(spec=Message)
         mock_msg.answer = AsyncMock()
         
-        with patch('handlers.reports.get_all_machines', new_callable=AsyncMock, return_value=[]):
+        with patch('handlers.reports.get_model_counts', new_callable=AsyncMock, return_value=[]):
             with patch('handlers.reports.plot_top_models', new_callable=AsyncMock, return_value=None):
                 await choose_plot(mock_msg)
                 
@@ -98,79 +195,96 @@ class TestSendSummary:
     """Тесты для отправки сводки"""
     
     @pytest.mark.asyncio
-    async def test_send_summary_with_active_machines(self, mock_coffee_machine):
-        """Тест отправки сводки с активными машинами"""
-        mock_msg = AsyncMock(spec=Message)
-        mock_msg.answer = AsyncMock()
-        
-        with patch('handlers.reports.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
-            with patch('handlers.reports.get_last_payment_date', new_callable=AsyncMock, return_value=None):
-                await send_summary(mock_msg)
-                
-                mock_msg.answer.assert_called_once()
-                call_text = mock_msg.answer.call_args[0][0]
-                assert "кофемашин" in call_text.lower() or "аренде" in call_text.lower()
-    
-    @pytest.mark.asyncio
-    async def test_send_summary_with_overdue(self, mock_coffee_machine):
-        """Тест отправки сводки с просроченными платежами"""
+    async def test_send_summary_formats_snapshot(self):
+        """Тест что сводка выводит показатели из снимка"""
         mock_msg = AsyncMock(spec=Message)
         mock_msg.answer = AsyncMock()
-        # Устанавливаем дату последнего платежа так, чтобы был просрочен
-        old_date = date.today() - timedelta(days=35)
+        summary = {"active": 3, "overdue": 1, "deposit_sum": 150000.0, "monthly_income": 27000.0, "not_in_1c": 2}
         
-        with patch('handlers.reports.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
-            with patch('handlers.reports.get_last_payment_date', new_callable=AsyncMock, return_value=old_date):
-                await send_summary(mock_msg)
-                
-                mock_msg.answer.assert_called_once()
-                call_text = mock_msg.answer.call_args[0][0]
-                assert "просрочено" in call_text.lower() or "кофемашин" in call_text.lower()
+        with patch('handlers.reports.get_fleet_summary', new_callable=AsyncMock, return_value=summary):
+            await send_summary(mock_msg)
+            
+            mock_msg.answer.assert_called_once()
+            call_text = mock_msg.answer.call_args[0][0]
+            assert "Всего кофемашин в аренде: 3" in call_text
+            assert "Просрочено платежей: 1" in call_text
+            assert "Сумма денег в депозитах: 150000.0" in call_text
+            assert "Планируемая прибыль за месяц: 27000.0" in call_text
+            assert "нет в 1С: 2" in call_text
     
     @pytest.mark.asyncio
     async def test_send_summary_no_active_machines(self):
         """Тест отправки сводки без активных машин"""
         mock_msg = AsyncMock(spec=Message)
         mock_msg.answer = AsyncMock()
-        mock_machine = MagicMock()
-        mock_machine.status = "buyout"
+        summary = {"active": 0, "overdue": 0, "deposit_sum": 0.0, "monthly_income": 0.0, "not_in_1c": 0}
         
-        with patch('handlers.reports.get_all_machines', new_callable=AsyncMock, return_value=[mock_machine]):
+        with patch('handlers.reports.get_fleet_summary', new_callable=AsyncMock, return_value=summary):
             await send_summary(mock_msg)
             
-            mock_msg.answer.assert_called_once()
             call_text = mock_msg.answer.call_args[0][0]
-            assert "0" in call_text or "кофемашин" in call_text.lower()
+            assert "Всего кофемашин в аренде: 0" in call_text
+
+
+def _rollup_row(payment_date, amount):
+    """Строка помесячной суммы для одного платежа"""
+    row = MagicMock()
+    row.month = payment_date.replace(day=1)
+    row.amount_sum = amount
+    row.count = 1
+    row.first_payment_date = payment_date
+    return row
+
+
+def _profit_sheets(mock_generate):
+    """Листы, переданные на запись: {месяц старта: DataFrame}"""
+    return dict(mock_generate.call_args[0][0])
 
 
 class TestSendProfitShare:
     @pytest.mark.asyncio
-    async def test_profit_share_uses_actual_rent_payment_amount(self, mock_coffee_machine):
+    async def test_profit_share_uses_actual_rent_payment_amount(self, mock_coffee_machine, make_machine_stream):
         mock_msg = AsyncMock(spec=Message)
         mock_msg.answer_document = AsyncMock()
 
-        payment = MagicMock()
-        payment.payment_date = date(2026, 2, 10)
-        payment.amount = 8000.0
-        payment.is_deposit = False
-        payment.is_buyout = False
+        payment = _rollup_row(date(2026, 2, 10), 8000.0)
 
-        with patch('handlers.reports.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
-            with patch('handlers.reports.get_payments_by_machine', new_callable=AsyncMock, return_value=[payment]):
-                with patch('handlers.reports.generate_profit_share_report') as mock_generate:
+        with patch('handlers.reports.iter_machines', make_machine_stream([mock_coffee_machine])):
+            with patch('handlers.reports.get_payment_month_rollup', new_callable=AsyncMock, return_value={1: [payment]}) as mock_rollup:
+                with patch('utils.report_frames.generate_profit_share_report') as mock_generate:
                     mock_file = MagicMock()
                     mock_file.read.return_value = b"profit"
                     mock_generate.return_value = mock_file
 
                     await send_profit_share(mock_msg)
 
-                    rows = mock_generate.call_args[0][0]
-                    assert len(rows) == 1
-                    assert rows[0]["2026-02"] == 8000.0
+                    sheets = _profit_sheets(mock_generate)
+                    assert list(sheets) == ["2026-02"]
+                    assert sheets["2026-02"]["2026-02"].tolist() == [8000.0]
+                    mock_rollup.assert_called_once_with([1])
                     mock_msg.answer_document.assert_called_once()
 
     @pytest.mark.asyncio
-    async def test_profit_share_does_not_fill_months_without_payments(self):
+    async def test_profit_share_filters(self, mock_coffee_machine, make_machine_stream):
+        """Тест что /profit 2025 closed выбирает сделки, оформленные в 2025 году, в SQL"""
+        mock_msg = AsyncMock(spec=Message)
+        mock_msg.answer_document = AsyncMock()
+        stream = make_machine_stream([mock_coffee_machine])
+
+        with patch('handlers.reports.iter_machines', stream):
+            with patch('handlers.reports.get_payment_month_rollup', new_callable=AsyncMock, return_value={}):
+                with patch('utils.report_frames.generate_profit_share_report') as mock_generate:
+                    mock_generate.return_value.read.return_value = b"profit"
+
+                    await send_profit_share(mock_msg, MagicMock(args="2025 closed"))
+
+        kwargs = stream.call_args.kwargs
+        assert kwargs["statuses"] == ("closed",)
+        assert (kwargs["started_from"], kwargs["started_to"]) == (date(2025, 1, 1), date(2025, 12, 31))
+        assert mock_msg.answer_document.call_args[0][0].filename == "profit_share_2025-01-01..2025-12-31_closed.xlsx"
+
+    @pytest.mark.asyncio
+    async def test_profit_share_does_not_fill_months_without_payments(self, make_machine_stream):
         mock_msg = AsyncMock(spec=Message)
         mock_msg.answer_document = AsyncMock()
 
@@ -190,79 +304,200 @@ class TestSendProfitShare:
         machine_2.rent_price = 9000.0
         machine_2.status = "active"
 
-        p_jan = MagicMock()
-        p_jan.payment_date = date(2026, 1, 15)
-        p_jan.amount = 9000.0
-        p_jan.is_deposit = False
-        p_jan.is_buyout = False
-
-        p_feb = MagicMock()
-        p_feb.payment_date = date(2026, 2, 15)
-        p_feb.amount = 12000.0
-        p_feb.is_deposit = False
-        p_feb.is_buyout = False
+        p_jan = _rollup_row(date(2026, 1, 15), 9000.0)
 
-        async def get_payments_side_effect(machine_id: int):
-            return [p_jan] if machine_id == 1 else [p_feb]
+        p_feb = _rollup_row(date(2026, 2, 15), 12000.0)
 
-        with patch('handlers.reports.get_all_machines', new_callable=AsyncMock, return_value=[machine_1, machine_2]):
-            with patch('handlers.reports.get_payments_by_machine', new_callable=AsyncMock, side_effect=get_payments_side_effect):
-                with patch('handlers.reports.generate_profit_share_report') as mock_generate:
+        with patch('handlers.reports.iter_machines', make_machine_stream([machine_1, machine_2])):
+            with patch('handlers.reports.get_payment_month_rollup', new_callable=AsyncMock, return_value={1: [p_jan], 2: [p_feb]}):
+                with patch('utils.report_frames.generate_profit_share_report') as mock_generate:
                     mock_file = MagicMock()
                     mock_file.read.return_value = b"profit"
                     mock_generate.return_value = mock_file
 
                     await send_profit_share(mock_msg)
 
-                    rows = mock_generate.call_args[0][0]
-                    assert "2026-02" not in rows[0]
-                    assert "2026-01" not in rows[1]
+                    sheets = _profit_sheets(mock_generate)
+                    assert "2026-02" not in sheets["2026-01"].columns
+                    assert "2026-01" not in sheets["2026-02"].columns
+                    assert sheets["2026-01"]["Арендатор"].tolist() == ["Tenant 1"]
 
     @pytest.mark.asyncio
-    async def test_profit_share_includes_deposit_payments(self, mock_coffee_machine):
+    async def test_profit_share_includes_deposit_payments(self, mock_coffee_machine, make_machine_stream):
         mock_msg = AsyncMock(spec=Message)
         mock_msg.answer_document = AsyncMock()
 
-        deposit_payment = MagicMock()
-        deposit_payment.payment_date = date(2026, 3, 5)
-        deposit_payment.amount = 15000.0
-        deposit_payment.is_deposit = True
-        deposit_payment.is_buyout = False
+        deposit_payment = _rollup_row(date(2026, 3, 5), 15000.0)
 
-        with patch('handlers.reports.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
-            with patch('handlers.reports.get_payments_by_machine', new_callable=AsyncMock, return_value=[deposit_payment]):
-                with patch('handlers.reports.generate_profit_share_report') as mock_generate:
+        with patch('handlers.reports.iter_machines', make_machine_stream([mock_coffee_machine])):
+            with patch('handlers.reports.get_payment_month_rollup', new_callable=AsyncMock, return_value={1: [deposit_payment]}):
+                with patch('utils.report_frames.generate_profit_share_report') as mock_generate:
                     mock_file = MagicMock()
                     mock_file.read.return_value = b"profit"
                     mock_generate.return_value = mock_file
 
                     await send_profit_share(mock_msg)
 
-                    rows = mock_generate.call_args[0][0]
-                    assert rows[0]["2026-03"] == 15000.0
+                    sheets = _profit_sheets(mock_generate)
+                    assert sheets["2026-03"]["2026-03"][0] == 15000.0
 
     @pytest.mark.asyncio
-    async def test_profit_share_includes_deal_type_in_separate_column(self, mock_coffee_machine):
+    async def test_profit_share_includes_deal_type_in_separate_column(self, mock_coffee_machine, make_machine_stream):
         mock_msg = AsyncMock(spec=Message)
         mock_msg.answer_document = AsyncMock()
         mock_coffee_machine.tenant = "Иван Иванов"
         mock_coffee_machine.deal_type = "Рассрочка"
 
-        payment = MagicMock()
-        payment.payment_date = date(2026, 4, 1)
-        payment.amount = 10000.0
-        payment.is_deposit = False
-        payment.is_buyout = False
+        payment = _rollup_row(date(2026, 4, 1), 10000.0)
+
+        with patch('handlers.reports.iter_machines', make_machine_stream([mock_coffee_machine])):
+            with patch('handlers.reports.get_payment_month_rollup', new_callable=AsyncMock, return_value={1: [payment]}):
+                with patch('utils.report_frames.generate_profit_share_report') as mock_generate:
+                    mock_file = MagicMock()
+                    mock_file.read.return_value = b"profit"
+                    mock_generate.return_value = mock_file
+
+                    await send_profit_share(mock_msg)
+
+                    row = _profit_sheets(mock_generate)["2026-04"].iloc[0]
+                    assert row["Арендатор"] == "Иван Иванов"
+                    assert row["Тип сделки"] == "Рассрочка"
+
+    @pytest.mark.asyncio
+    async def test_profit_share_without_payments_uses_start_date(self, mock_coffee_machine, make_machine_stream):
+        mock_msg = AsyncMock(spec=Message)
+        mock_msg.answer_document = AsyncMock()
 
-        with patch('handlers.reports.get_all_machines', new_callable=AsyncMock, return_value=[mock_coffee_machine]):
-            with patch('handlers.reports.get_payments_by_machine', new_callable=AsyncMock, return_value=[payment]):
-                with patch('handlers.reports.generate_profit_share_report') as mock_generate:
+        with patch('handlers.reports.iter_machines', make_machine_stream([mock_coffee_machine])):
+            with patch('handlers.reports.get_payment_month_rollup', new_callable=AsyncMock, return_value={}):
+                with patch('utils.report_frames.generate_profit_share_report') as mock_generate:
                     mock_file = MagicMock()
                     mock_file.read.return_value = b"profit"
                     mock_generate.return_value = mock_file
 
                     await send_profit_share(mock_msg)
 
-                    rows = mock_generate.call_args[0][0]
-                    assert rows[0]["Арендатор"] == "Иван Иванов"
-                    assert rows[0]["Тип сделки"] == "Рассрочка"
+                    (sheet,) = _profit_sheets(mock_generate).values()
+                    assert sheet["Дата первого платежа"][0] == mock_coffee_machine.start_date
+
+
+class TestPlotPayments:
+    """Тесты для графика платежей по месяцам"""
+
+    @pytest.mark.asyncio
+    async def test_plot_payments_uses_monthly_totals(self):
+        mock_msg = AsyncMock(spec=Message)
+        mock_msg.answer_photo = AsyncMock()
+        totals = [MagicMock(month=date(2026, 1, 1), amount_sum=9000.0), MagicMock(month=date(2026, 2, 1), amount_sum=12000.0)]
+
+        with patch('handlers.reports.get_monthly_payment_totals', new_callable=AsyncMock, return_value=totals):
+            with patch('handlers.reports.plot_payments_dynamic', new_callable=AsyncMock) as mock_plot:
+                mock_plot.return_value = MagicMock(read=MagicMock(return_value=b"png"))
+
+                await plot_payments(mock_msg)
+
+                mock_plot.assert_called_once_with([{"month": "2026-01", "sum": 9000.0}, {"month": "2026-02", "sum": 12000.0}])
+                mock_msg.answer_photo.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_plot_payments_without_data(self):
+        mock_msg = AsyncMock(spec=Message)
+        mock_msg.answer = AsyncMock()
+
+        with patch('handlers.reports.get_monthly_payment_totals', new_callable=AsyncMock, return_value=[]):
+            await plot_payments(mock_msg)
+
+            mock_msg.answer.assert_called_once_with("Нет платежей для построения графика")
+
+
+class TestSendCachedReport:
+    """Тесты для повторной отправки отчётов без пересборки"""
+    
+    @staticmethod
+    def _message(file_id="file-1"):
+        mock_msg = AsyncMock(spec=Message)
+        sent = MagicMock()
+        sent.document.file_id = file_id
+        mock_msg.answer_document = AsyncMock(return_value=sent)
+        return mock_msg
+    
+    @pytest.mark.asyncio
+    async def test_repeat_request_resends_by_file_id(self):
+        """Тест что повторный запрос без изменений данных уходит по file_id"""
+        mock_msg = self._message()
+        build = AsyncMock(return_value=b"xlsx")
+        
+        with patch('handlers.reports.get_data_version', return_value=5):
+            await send_cached_report(mock_msg, "report", "coffee_report.xlsx", build)
+            await send_cached_report(mock_msg, "report", "coffee_report.xlsx", build)
+        
+        build.assert_called_once()
+        assert mock_msg.answer_document.call_args_list[1][0][0] == "file-1"
+    
+    @pytest.mark.asyncio
+    async def test_data_change_rebuilds(self):
+        """Тест что после записи в БД отчёт собирается заново"""
+        mock_msg = self._message()
+        build = AsyncMock(return_value=b"xlsx")
+        
+        with patch('handlers.reports.get_data_version', side_effect=[5, 6]):
+            await send_cached_report(mock_msg, "report", "coffee_report.xlsx", build)
+            await send_cached_report(mock_msg, "report", "coffee_report.xlsx", build)
+        
+        assert build.call_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_rejected_file_id_falls_back_to_upload(self):
+        """Тест повторной загрузки байтов, если Telegram отверг file_id"""
+        mock_msg = self._message()
+        build = AsyncMock(return_value=b"xlsx")
+        
+        with patch('handlers.reports.get_data_version', return_value=5):
+            await send_cached_report(mock_msg, "report", "coffee_report.xlsx", build)
+            mock_msg.answer_document.side_effect = [TelegramBadRequest(MagicMock(), "wrong file identifier"), MagicMock()]
+            await send_cached_report(mock_msg, "report", "coffee_report.xlsx", build)
+        
+        build.assert_called_once()
+        assert mock_msg.answer_document.call_args_list[-1][0][0].filename == "coffee_report.xlsx"
+
+
+class TestSendPlot:
+    """Тесты для отправки графиков с повторным использованием file_id"""
+    
+    @staticmethod
+    def _message(file_id="photo-1"):
+        mock_msg = AsyncMock(spec=Message)
+        sent = MagicMock()
+        sent.photo = [MagicMock(file_id="thumb"), MagicMock(file_id=file_id)]
+        mock_msg.answer_photo = AsyncMock(return_value=sent)
+        return mock_msg
+    
+    @staticmethod
+    def _image(plot_cache):
+        plot_cache.put("k1", b"png")
+        img = PlotImage(b"png")
+        img.cache_key = "k1"
+        return img
+    
+    @pytest.mark.asyncio
+    async def test_repeat_plot_sent_by_file_id(self, isolated_plot_cache):
+        """Тест что тот же график второй раз уходит по file_id без загрузки"""
+        mock_msg = self._message()
+        
+        await send_plot(mock_msg, self._image(isolated_plot_cache), "plot.png", "Подпись")
+        await send_plot(mock_msg, self._image(isolated_plot_cache), "plot.png", "Подпись")
+        
+        assert mock_msg.answer_photo.call_args_list[1][0][0] == "photo-1"
+    
+    @pytest.mark.asyncio
+    async def test_rejected_file_id_falls_back_to_upload(self, isolated_plot_cache):
+        """Тест повторной загрузки графика, если Telegram отверг file_id"""
+        mock_msg = self._message()
+        isolated_plot_cache.put("k1", b"png")
+        isolated_plot_cache.set_file_id("k1", "stale")
+        mock_msg.answer_photo.side_effect = [TelegramBadRequest(MagicMock(), "wrong file identifier"), MagicMock(photo=[MagicMock(file_id="fresh")])]
+        
+        await send_plot(mock_msg, self._image(isolated_plot_cache), "plot.png", "Подпись")
+        
+        assert mock_msg.answer_photo.call_args_list[-1][0][0].filename == "plot.png"
+        assert isolated_plot_cache.get_file_id("k1") == "fresh"
@@ -0,0 +1,121 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from migrations import Migration, discover_migrations, apply_migrations, create_index_concurrently
+
+
+def _make_conn(applied_versions=()):
+    """Мок соединения asyncpg с поддержкой conn.transaction()"""
+    conn = AsyncMock()
+    conn.fetch = AsyncMock(return_value=[{"version": v} for v in applied_versions])
+    transaction = MagicMock()
+    transaction.__aenter__ = AsyncMock()
+    transaction.__aexit__ = AsyncMock(return_value=False)
+    conn.transaction = MagicMock(return_value=transaction)
+    return conn
+
+
+def _make_migration(version, transactional=True):
+    return Migration(
+        version=version,
+        name=f"{version:04d}_test",
+        description="test",
+        transactional=transactional,
+        upgrade=AsyncMock(),
+    )
+
+
+class TestDiscoverMigrations:
+    """Тесты для поиска модулей миграций"""
+
+    def test_versions_are_sorted_and_unique(self):
+        """Тест что миграции идут по возрастанию номера без повторов"""
+        migrations = discover_migrations()
+        versions = [m.version for m in migrations]
+
+        assert versions == sorted(set(versions))
+        assert versions[0] == 1
+
+    def test_index_migration_is_not_transactional(self):
+        """Тест что миграция с CREATE INDEX CONCURRENTLY выполняется вне транзакции"""
+        migrations = {m.name: m for m in discover_migrations()}
+
+        assert migrations["0001_initial_schema"].transactional is True
+        assert migrations["0003_access_path_indexes"].transactional is False
+        assert migrations["0007_report_filter_indexes"].transactional is False
+
+
+class TestApplyMigrations:
+    """Тесты для применения миграций"""
+
+    @pytest.mark.asyncio
+    async def test_applies_pending_in_order(self):
+        """Тест применения только новых миграций по порядку"""
+        conn = _make_conn(applied_versions=[1])
+        m1, m2, m3 = _make_migration(1), _make_migration(2), _make_migration(3)
+
+        applied = await apply_migrations(conn, [m1, m2, m3], log=lambda _: None)
+
+        assert applied == [2, 3]
+        m1.upgrade.assert_not_called()
+        m2.upgrade.assert_called_once_with(conn)
+        m3.upgrade.assert_called_once_with(conn)
+
+    @pytest.mark.asyncio
+    async def test_transactional_migration_runs_in_transaction(self):
+        """Тест что транзакционная миграция и запись версии идут в одной транзакции"""
+        conn = _make_conn()
+        migration = _make_migration(1)
+
+        await apply_migrations(conn, [migration], log=lambda _: None)
+
+        conn.transaction.assert_called_once()
+        inserts = [c for c in conn.execute.call_args_list if "INSERT INTO schema_version" in c.args[0]]
+        assert len(inserts) == 1
+
+    @pytest.mark.asyncio
+    async def test_non_transactional_migration_runs_outside_transaction(self):
+        """Тест что нетранзакционная миграция не открывает транзакцию"""
+        conn = _make_conn()
+        migration = _make_migration(1, transactional=False)
+
+        await apply_migrations(conn, [migration], log=lambda _: None)
+
+        conn.transaction.assert_not_called()
+        migration.upgrade.assert_called_once_with(conn)
+
+    @pytest.mark.asyncio
+    async def test_lock_released_on_failure(self):
+        """Тест что advisory lock снимается даже при ошибке миграции"""
+        conn = _make_conn()
+        migration = _make_migration(1)
+        migration.upgrade.side_effect = RuntimeError("boom")
+
+        with pytest.raises(RuntimeError):
+            await apply_migrations(conn, [migration], log=lambda _: None)
+
+        assert "pg_advisory_unlock" in conn.execute.call_args_list[-1].args[0]
+
+
+class TestCreateIndexConcurrently:
+    """Тесты для неблокирующего создания индексов"""
+
+    @pytest.mark.asyncio
+    async def test_creates_missing_index(self):
+        """Тест создания отсутствующего индекса"""
+        conn = _make_conn()
+        conn.fetchval = AsyncMock(return_value=None)
+
+        await create_index_concurrently(conn, "ix_test", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_test ON t (a)")
+
+        conn.execute.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_rebuilds_invalid_index(self):
+        """Тест пересоздания невалидного индекса после оборванной попытки"""
+        conn = _make_conn()
+        conn.fetchval = AsyncMock(return_value=False)
+
+        await create_index_concurrently(conn, "ix_test", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_test ON t (a)")
+
+        assert "DROP INDEX CONCURRENTLY" in conn.execute.call_args_list[0].args[0]
+        assert conn.execute.call_count == 2
@@ -1,6 +1,8 @@
 import pytest
 from datetime import date
-from models import CoffeeMachine, Payment
+from models import CoffeeMachine, Payment, CoffeeMachineORM, PaymentORM
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.dialects import postgresql
 
 
 class TestCoffeeMachineModel:
@@ -163,4 +165,43 @@ class TestPaymentModel:
         assert payment.is_buyout is False
 
 
+class TestIndexes:
+    """Тесты для индексов таблиц"""
+    
+    @staticmethod
+    def _ddl(table):
+        return {i.name: str(CreateIndex(i).compile(dialect=postgresql.dialect())) for i in table.indexes}
+    
+    def test_payments_machine_date_index(self):
+        """Тест составного индекса (machine_id, payment_date DESC)"""
+        ddl = self._ddl(PaymentORM.__table__)
+        assert "(machine_id, payment_date DESC)" in ddl["ix_payments_machine_id_payment_date"]
+    
+    def test_active_machines_partial_index(self):
+        """Тест частичного индекса по активным сделкам"""
+        ddl = self._ddl(CoffeeMachineORM.__table__)
+        assert "WHERE status = 'active'" in ddl["ix_coffee_machines_active"]
+    
+    def test_tenant_trigram_indexes(self):
+        """Тест триграммных индексов по ФИО арендатора"""
+        machines_ddl = self._ddl(CoffeeMachineORM.__table__)
+        payments_ddl = self._ddl(PaymentORM.__table__)
+        assert "USING gin (tenant gin_trgm_ops)" in machines_ddl["ix_coffee_machines_tenant_trgm"]
+        assert "USING gin (tenant gin_trgm_ops)" in payments_ddl["ix_payments_tenant_trgm"]
+    
+    def test_migration_creates_all_model_indexes(self):
+        """Тест что миграции создают все индексы, объявленные в моделях"""
+        import importlib
+        declared = {i.name for t in (CoffeeMachineORM.__table__, PaymentORM.__table__) for i in t.indexes}
+        migrated = {
+            name
+            for module in ("migrations.0003_access_path_indexes", "migrations.0007_report_filter_indexes")
+            for name, _ in importlib.import_module(module).INDEXES
+        }
+        assert declared == migrated
+    
+    def test_report_period_indexes(self):
+        """Тест индексов под отчёты за период"""
+        assert "(payment_date)" in self._ddl(PaymentORM.__table__)["ix_payments_payment_date"]
+        assert "(start_date)" in self._ddl(CoffeeMachineORM.__table__)["ix_coffee_machines_start_date"]
 
@@ -0,0 +1,61 @@
+import pytest
+from datetime import date
+from io import BytesIO
+import pandas as pd
+from utils.payments_import import parse_payments_file
+
+
+class TestParsePaymentsFile:
+    """Тесты для разбора файла с платежами"""
+
+    def test_parse_csv_with_semicolon(self):
+        """Тест разбора CSV с русскими заголовками и разделителем ;"""
+        content = "ID сделки;Сумма;Дата платежа;Арендатор;Тип\n1;9 000,50;15.01.2024;Иван;Аренда\n2;15000;16-01-2024;;Депозит\n".encode()
+
+        payments = parse_payments_file(content, "payments.csv")
+
+        assert payments == [
+            {"machine_id": 1, "tenant": "Иван", "amount": 9000.5, "payment_date": date(2024, 1, 15),
+             "is_deposit": False, "is_buyout": False},
+            {"machine_id": 2, "tenant": "", "amount": 15000.0, "payment_date": date(2024, 1, 16),
+             "is_deposit": True, "is_buyout": False},
+        ]
+
+    def test_parse_excel(self):
+        """Тест разбора Excel с датами в ячейках"""
+        output = BytesIO()
+        pd.DataFrame([
+            {"machine_id": 3, "amount": 50000, "payment_date": pd.Timestamp("2024-02-01"), "type": "Выкуп"},
+        ]).to_excel(output, index=False)
+
+        payments = parse_payments_file(output.getvalue(), "payments.xlsx")
+
+        assert payments[0]["machine_id"] == 3
+        assert payments[0]["payment_date"] == date(2024, 2, 1)
+        assert payments[0]["is_buyout"] is True
+
+    def test_skips_empty_rows(self):
+        """Тест пропуска пустых строк"""
+        content = "machine_id,amount,payment_date\n1,100,2024-01-01\n,,\n".encode()
+
+        assert len(parse_payments_file(content, "p.csv")) == 1
+
+    def test_missing_columns(self):
+        """Тест ошибки при отсутствии обязательных колонок"""
+        with pytest.raises(ValueError, match="payment_date"):
+            parse_payments_file("machine_id,amount\n1,100\n".encode(), "p.csv")
+
+    def test_errors_reference_file_lines(self):
+        """Тест что ошибки указывают номер строки в файле"""
+        content = "machine_id,amount,payment_date\n1,100,2024-01-01\nabc,100,2024-01-01\n1,сто,32.01.2024\n".encode()
+
+        with pytest.raises(ValueError) as exc_info:
+            parse_payments_file(content, "p.csv")
+
+        assert "строка 3" in str(exc_info.value)
+        assert "строка 4" in str(exc_info.value)
+
+    def test_unsupported_extension(self):
+        """Тест отказа для неподдерживаемого формата"""
+        with pytest.raises(ValueError):
+            parse_payments_file(b"data", "payments.txt")
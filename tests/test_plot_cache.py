@@ -0,0 +1,90 @@
+import os
+import pytest
+from unittest.mock import patch
+import plotly.graph_objects as go
+from utils.plot_cache import PlotCache
+from utils.plots import fig_to_bytesio, PlotImage
+
+
+def _fig(values, title="Тест"):
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=["a", "b"], y=values))
+    fig.update_layout(title=title)
+    return fig
+
+
+class TestPlotCacheKey:
+    """Тесты для ключа кэша графиков"""
+
+    def test_same_figure_same_key(self):
+        """Тест что одинаковые данные и оформление дают один ключ"""
+        assert PlotCache.key_for(_fig([1, 2])) == PlotCache.key_for(_fig([1, 2]))
+
+    def test_data_and_layout_change_key(self):
+        """Тест что изменение данных или оформления меняет ключ"""
+        base = PlotCache.key_for(_fig([1, 2]))
+        assert PlotCache.key_for(_fig([1, 3])) != base
+        assert PlotCache.key_for(_fig([1, 2], title="Другой")) != base
+
+
+class TestPlotCache:
+    """Тесты для дискового кэша графиков"""
+
+    def test_put_get_and_file_id(self, tmp_path):
+        """Тест сохранения PNG и file_id"""
+        cache = PlotCache(tmp_path, 1024)
+        cache.put("k1", b"png")
+
+        assert cache.get("k1") == b"png"
+        assert cache.get_file_id("k1") is None
+        cache.set_file_id("k1", "file-1")
+        assert cache.get_file_id("k1") == "file-1"
+
+    def test_file_id_not_stored_without_image(self, tmp_path):
+        """Тест что file_id не сохраняется для отсутствующего графика"""
+        cache = PlotCache(tmp_path, 1024)
+        cache.set_file_id("missing", "file-1")
+
+        assert cache.get_file_id("missing") is None
+
+    def test_lru_eviction_by_size(self, tmp_path):
+        """Тест вытеснения давно не читанных графиков при превышении размера"""
+        cache = PlotCache(tmp_path, 250)
+        cache.put("old", b"x" * 100)
+        cache.set_file_id("old", "file-old")
+        cache.put("used", b"x" * 100)
+        os.utime(tmp_path / "old.png", (1, 1))
+        os.utime(tmp_path / "used.png", (2, 2))
+        cache.get("used")
+
+        cache.put("new", b"x" * 100)
+
+        assert cache.get("old") is None
+        assert cache.get_file_id("old") is None
+        assert cache.get("used") is not None
+        assert cache.get("new") is not None
+
+    def test_disabled(self, tmp_path):
+        """Тест что при нулевом размере кэш ничего не пишет"""
+        cache = PlotCache(tmp_path / "off", 0)
+        cache.put("k1", b"png")
+
+        assert cache.get("k1") is None
+        assert not (tmp_path / "off").exists()
+
+
+class TestFigToBytesioCache:
+    """Тесты для отрисовки графиков через кэш"""
+
+    @pytest.mark.asyncio
+    async def test_render_once(self, isolated_plot_cache):
+        """Тест что повторная отрисовка того же графика берётся с диска"""
+        fig = _fig([1, 2])
+        with patch.object(go.Figure, "to_image", return_value=b"png-bytes") as mock_render:
+            first = await fig_to_bytesio(fig)
+            second = await fig_to_bytesio(_fig([1, 2]))
+
+        mock_render.assert_called_once()
+        assert isinstance(second, PlotImage)
+        assert second.read() == b"png-bytes"
+        assert second.cache_key == first.cache_key
@@ -0,0 +1,106 @@
+import logging
+import pytest
+from datetime import date
+from sqlalchemy import create_engine, text
+from utils.query_log import QueryStats, install_query_logging, normalize_statement, redact_parameters
+
+
+class TestNormalizeStatement:
+    """Тесты для нормализации SQL"""
+
+    def test_collapses_whitespace(self):
+        """Тест схлопывания пробелов и переносов строк"""
+        assert normalize_statement("SELECT  *\n  FROM payments") == "SELECT * FROM payments"
+
+    def test_collapses_in_lists(self):
+        """Тест: IN-списки разной длины дают один ключ"""
+        short = normalize_statement("SELECT * FROM payments WHERE machine_id IN ($1::INTEGER)")
+        long = normalize_statement("SELECT * FROM payments WHERE machine_id IN ($1::INTEGER, $2::INTEGER, $3::INTEGER)")
+        assert short == long
+
+
+class TestRedactParameters:
+    """Тесты для скрытия значений параметров"""
+
+    def test_redacts_values(self):
+        """Тест что значения не попадают в описание"""
+        result = redact_parameters(("Иван Иванов", 50000.0, date(2024, 1, 15)))
+        assert "Иван" not in result
+        assert "<str>" in result and "<float>" in result and "<date>" in result
+
+    def test_redacts_dict_values(self):
+        """Тест скрытия значений именованных параметров"""
+        result = redact_parameters({"tenant": "Иван Иванов"})
+        assert result == "{tenant: <str>}"
+
+    def test_executemany(self):
+        """Тест описания набора параметров executemany"""
+        assert redact_parameters([(1,), (2,)]) == "<2 наборов параметров>"
+
+
+class TestQueryStats:
+    """Тесты для гистограмм задержек"""
+
+    def test_record_and_snapshot(self):
+        """Тест накопления статистики по выражению"""
+        stats = QueryStats()
+        stats.record("SELECT 1", 3.0)
+        stats.record("SELECT  1", 30.0)
+
+        snapshot = stats.snapshot()
+
+        assert len(snapshot) == 1
+        assert snapshot[0]["count"] == 2
+        assert snapshot[0]["max_ms"] == 30.0
+        assert snapshot[0]["buckets"]["5"] == 1
+        assert snapshot[0]["buckets"]["50"] == 1
+
+    def test_bounded_number_of_statements(self):
+        """Тест что число отслеживаемых выражений ограничено"""
+        stats = QueryStats(max_statements=2)
+        for i in range(5):
+            stats.record(f"SELECT {i}", 1.0)
+
+        snapshot = stats.snapshot()
+
+        assert len(snapshot) == 3
+        assert sum(r["count"] for r in snapshot) == 5
+
+
+class TestInstallQueryLogging:
+    """Тесты для обработчиков событий движка"""
+
+    def test_records_executed_statements(self):
+        """Тест что выполненные запросы попадают в статистику"""
+        engine = create_engine("sqlite://")
+        stats = QueryStats()
+        install_query_logging(engine, stats, slow_threshold_ms=-1)
+
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+        assert any(r["statement"] == "SELECT 1" for r in stats.snapshot())
+
+    def test_logs_slow_statements_without_values(self, caplog):
+        """Тест что медленные запросы логируются без значений параметров"""
+        engine = create_engine("sqlite://")
+        stats = QueryStats()
+        install_query_logging(engine, stats, slow_threshold_ms=0)
+
+        with caplog.at_level(logging.WARNING, logger="db.queries"):
+            with engine.connect() as conn:
+                conn.execute(text("SELECT :tenant"), {"tenant": "Иван Иванов"})
+
+        assert "Медленный запрос" in caplog.text
+        assert "Иван" not in caplog.text
+
+    def test_failed_statement_does_not_leak_timer(self):
+        """Тест что упавший запрос не оставляет отметку времени"""
+        engine = create_engine("sqlite://")
+        stats = QueryStats()
+        install_query_logging(engine, stats, slow_threshold_ms=-1)
+
+        with engine.connect() as conn:
+            with pytest.raises(Exception):
+                conn.execute(text("SELECT * FROM missing_table"))
+            assert conn.info.get("query_start_time") == []
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import time
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from openpyxl import load_workbook
+from utils.excel import generate_excel_report
+from utils import render_pool as render_pool_module
+from utils.render_pool import RenderPool, RenderError, RenderTimeout
+from handlers.reports import render_failed
+
+
+class TestRenderPoolThreadFallback:
+    """Тесты для отрисовки без запущенного пула процессов"""
+
+    @pytest.mark.asyncio
+    async def test_runs_in_thread_until_started(self):
+        """Тест что до запуска пула задача выполняется в потоке и возвращает результат"""
+        pool = RenderPool(workers=2, timeout=5)
+
+        assert await pool.run(sum, [1, 2, 3]) == 6
+        assert not pool.started
+
+    @pytest.mark.asyncio
+    async def test_timeout(self):
+        """Тест таймаута отрисовки"""
+        pool = RenderPool(workers=0, timeout=0.05)
+
+        with pytest.raises(RenderTimeout):
+            await pool.run(time.sleep, 0.5)
+
+
+class TestRenderPoolProcesses:
+    """Тесты для пула процессов"""
+
+    @pytest.mark.asyncio
+    async def test_renders_excel_in_worker_process(self):
+        """Тест отрисовки Excel в отдельном процессе"""
+        pool = RenderPool(workers=1, timeout=60)
+        await pool.start()
+        try:
+            worker_pid = await pool.run(os.getpid)
+            excel = await pool.run(generate_excel_report, [{"ID": 1, "Модель": "Saeco"}], [], [])
+        finally:
+            await pool.shutdown()
+
+        assert worker_pid != os.getpid()
+        assert load_workbook(excel).sheetnames == ["Активные сделки", "Платежи"]
+
+    @pytest.mark.asyncio
+    async def test_timeout_restarts_pool(self):
+        """Тест что зависшая отрисовка прерывается, а пул пересоздаётся и работает дальше"""
+        pool = RenderPool(workers=1, timeout=0.5)
+        await pool.start()
+        try:
+            with pytest.raises(RenderTimeout):
+                await pool.run(time.sleep, 30)
+            pool.timeout = 60
+            assert await pool.run(sum, [1, 2]) == 3
+        finally:
+            await pool.shutdown()
+
+        assert not pool.started
+
+    @pytest.mark.asyncio
+    async def test_timeout_does_not_kill_other_renders(self):
+        """Тест что таймаут одной отрисовки убивает только её процесс, а чужая доходит до конца"""
+        pool = RenderPool(workers=2, timeout=1)
+        await pool.start()
+        try:
+            async def other_render():
+                # Начинается раньше таймаута зависшей задачи и заканчивается после него
+                await asyncio.sleep(0.5)
+                return await pool.run(time.sleep, 0.8)
+
+            hung, other = await asyncio.gather(pool.run(time.sleep, 30), other_render(), return_exceptions=True)
+            assert isinstance(hung, RenderTimeout)
+            assert other is None
+            assert await pool.run(sum, [1, 2]) == 3
+        finally:
+            await pool.shutdown()
+
+
+    @pytest.mark.asyncio
+    async def test_cancelled_render_frees_worker(self):
+        """Тест что отменённая отрисовка не оставляет занятый процесс следующей задаче"""
+        pool = RenderPool(workers=1, timeout=60)
+        await pool.start()
+        try:
+            task = asyncio.create_task(pool.run(time.sleep, 30))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            pool.timeout = 5
+            assert await asyncio.wait_for(pool.run(sum, [1, 2]), 30) == 3
+        finally:
+            await pool.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_failed_respawn_is_retried(self):
+        """Тест что ошибка запуска замены не уменьшает пул: процесс поднимается повторно"""
+        pool = RenderPool(workers=1, timeout=0.5)
+        await pool.start()
+        spawn = render_pool_module._spawn_executor
+        try:
+            with patch.object(render_pool_module, "RESPAWN_DELAY", 0), \
+                 patch.object(render_pool_module, "_spawn_executor", side_effect=[OSError("fork failed"), spawn()]), \
+                 patch.object(render_pool_module, "logger"):
+                with pytest.raises(RenderTimeout):
+                    await pool.run(time.sleep, 30)
+                pool.timeout = 60
+                assert await asyncio.wait_for(pool.run(sum, [1, 2]), 30) == 3
+            assert len(pool._executors) == 1
+        finally:
+            await pool.shutdown()
+
+
+class TestRenderFailedHandler:
+    """Тесты для сообщения об ошибке отрисовки"""
+
+    @pytest.mark.asyncio
+    async def test_timeout_message(self):
+        """Тест ответа пользователю при таймауте"""
+        message = MagicMock()
+        message.answer = AsyncMock()
+        event = MagicMock(exception=RenderTimeout())
+        event.update.message = message
+
+        await render_failed(event)
+
+        message.answer.assert_called_once_with("Отчёт формируется слишком долго, попробуйте позже.")
+
+    @pytest.mark.asyncio
+    async def test_callback_error_message(self):
+        """Тест ответа при ошибке отрисовки из инлайн-кнопки"""
+        message = MagicMock()
+        message.answer = AsyncMock()
+        event = MagicMock(exception=RenderError())
+        event.update.message = None
+        event.update.callback_query.message = message
+
+        await render_failed(event)
+
+        message.answer.assert_called_once_with("Не удалось сформировать отчёт, попробуйте ещё раз.")
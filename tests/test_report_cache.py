@@ -0,0 +1,46 @@
+from utils.report_cache import ReportCache
+
+
+class TestReportCache:
+    """Тесты для кэша готовых отчётов"""
+
+    def test_hit_for_same_version(self):
+        """Тест попадания при неизменной версии данных"""
+        cache = ReportCache()
+        cache.put("report", 1, b"xlsx", "coffee_report.xlsx")
+
+        report = cache.get("report", 1)
+
+        assert report.content == b"xlsx"
+        assert cache.hits == 1
+
+    def test_miss_after_version_change(self):
+        """Тест что новая версия данных делает отчёт устаревшим"""
+        cache = ReportCache()
+        cache.put("report", 1, b"xlsx", "coffee_report.xlsx")
+
+        assert cache.get("report", 2) is None
+        assert cache.misses == 1
+
+    def test_file_id_bound_to_version(self):
+        """Тест что file_id от старой версии не записывается в новый отчёт"""
+        cache = ReportCache()
+        cache.put("report", 2, b"new", "coffee_report.xlsx")
+
+        cache.set_file_id("report", 1, "old-file-id")
+        assert cache.get("report", 2).file_id is None
+
+        cache.set_file_id("report", 2, "file-id")
+        assert cache.get("report", 2).file_id == "file-id"
+
+    def test_put_drops_reports_of_old_versions(self):
+        """Тест что отчёты по другим фильтрам от прошлой версии данных не копятся"""
+        cache = ReportCache()
+        cache.put("report", 1, b"all", "coffee_report.xlsx")
+        cache.put("report:2025-01-01..2025-12-31", 1, b"2025", "coffee_report_2025.xlsx")
+
+        cache.put("report", 2, b"new", "coffee_report.xlsx")
+
+        assert cache.get("report:2025-01-01..2025-12-31", 1) is None
+        assert cache.get("report", 2).content == b"new"
+        assert len(cache._reports) == 1
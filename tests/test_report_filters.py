@@ -0,0 +1,75 @@
+import pytest
+from datetime import date
+from utils.report_filters import ReportFilters, NO_FILTERS, parse_report_filters
+
+
+class TestParseReportFilters:
+    """Тесты для разбора аргументов /report и /profit"""
+
+    def test_no_args(self):
+        """Тест что без аргументов фильтров нет"""
+        assert parse_report_filters(None) == NO_FILTERS
+        assert parse_report_filters("  ") == NO_FILTERS
+
+    @pytest.mark.parametrize("args, date_from, date_to", [
+        ("2025", date(2025, 1, 1), date(2025, 12, 31)),
+        ("2024-02", date(2024, 2, 1), date(2024, 2, 29)),
+        ("2025-3-15", date(2025, 3, 15), date(2025, 3, 15)),
+        ("2025-Q2", date(2025, 4, 1), date(2025, 6, 30)),
+        ("2025q4", date(2025, 10, 1), date(2025, 12, 31)),
+        ("2025-01..2025-06", date(2025, 1, 1), date(2025, 6, 30)),
+        ("2024..2025-02-10", date(2024, 1, 1), date(2025, 2, 10)),
+        ("2025-05..", date(2025, 5, 1), None),
+        ("..2024", None, date(2024, 12, 31)),
+    ])
+    def test_periods(self, args, date_from, date_to):
+        """Тест границ периода (включительно)"""
+        filters = parse_report_filters(args)
+
+        assert (filters.date_from, filters.date_to) == (date_from, date_to)
+        assert filters.statuses == ()
+
+    @pytest.mark.parametrize("args, date_from, date_to", [
+        ("month", date(2025, 8, 1), date(2025, 8, 31)),
+        ("квартал", date(2025, 7, 1), date(2025, 9, 30)),
+        ("year", date(2025, 1, 1), date(2025, 12, 31)),
+    ])
+    def test_current_periods(self, args, date_from, date_to):
+        """Тест текущего месяца, квартала и года"""
+        filters = parse_report_filters(args, today=date(2025, 8, 20))
+
+        assert (filters.date_from, filters.date_to) == (date_from, date_to)
+
+    def test_statuses_in_any_order(self):
+        """Тест статусов вместе с периодом, русских синонимов и порядка"""
+        filters = parse_report_filters("returned 2025 ACTIVE выкуп")
+
+        assert filters.statuses == ("active", "buyout", "returned")
+        assert filters.date_from == date(2025, 1, 1)
+
+    def test_closed_covers_closed_statuses(self):
+        """Тест что closed поглощает отдельные закрытые статусы"""
+        assert parse_report_filters("buyout closed").statuses == ("closed",)
+
+    @pytest.mark.parametrize("args", ["2025 2024", "vip", "2025-13", "2025-02-30", "..", "2025-06..2025-01"])
+    def test_invalid(self, args):
+        """Тест ошибок разбора"""
+        with pytest.raises(ValueError):
+            parse_report_filters(args)
+
+
+class TestReportFilters:
+    """Тесты для ключа кэша и имени файла отчёта с фильтрами"""
+
+    def test_without_filters_unchanged(self):
+        """Тест что без фильтров ключ и имя файла прежние"""
+        assert NO_FILTERS.cache_key("report") == "report"
+        assert NO_FILTERS.filename("coffee_report.xlsx") == "coffee_report.xlsx"
+
+    def test_filters_in_key_and_filename(self):
+        """Тест что фильтры входят в ключ кэша и имя файла"""
+        filters = ReportFilters(date(2025, 1, 1), date(2025, 6, 30), ("active",))
+
+        assert filters.cache_key("report") == "report:2025-01-01..2025-06-30_active"
+        assert filters.filename("coffee_report.xlsx") == "coffee_report_2025-01-01..2025-06-30_active.xlsx"
+        assert filters.cache_key("report") != ReportFilters(date(2025, 1, 1), date(2025, 6, 30)).cache_key("report")
@@ -0,0 +1,342 @@
+import io
+import random
+import zipfile
+import pandas as pd
+import pytest
+from datetime import date, timedelta
+from types import SimpleNamespace
+from openpyxl import load_workbook
+from utils.excel import generate_excel_report
+from utils.report_frames import build_report_frames, render_excel_report, render_csv_export, render_parquet_export
+from utils.report_frames import build_profit_share_sheets
+
+
+def _legacy_report_rows(machines, payments, model_prices):
+    """Прежняя сборка листов отчёта: словарь на строку и if/else по каждой машине и платежу"""
+    active_machines_data, active_payments_data = [], []
+    closed_machines_data, closed_payments_data = [], []
+    payments_by_machine = {}
+    for p in payments:
+        payments_by_machine.setdefault(p.machine_id, []).append(p)
+    for m in sorted(machines, key=lambda m: m.id):
+        full_price = m.full_price if m.full_price else (model_prices[m.model] if m.model in model_prices else 0)
+        all_payments = sorted(payments_by_machine.get(m.id, []), key=lambda p: (p.payment_date, p.id))
+        if m.status == "active":
+            total_paid = m.total_paid + (m.deposit if m.deposit else 0)
+            remain = full_price - total_paid
+            status = "Открыта"
+            machines_data, machine_payments_data = active_machines_data, active_payments_data
+        else:
+            if m.status == "buyout":
+                status = "Закрыта (выкуп)"
+            elif m.status == "returned":
+                status = "Закрыта (возврат)"
+            elif m.status == "damaged":
+                status = "Закрыта (повреждена)"
+            else:
+                status = "Закрыта"
+            remain = max(full_price - m.total_paid, 0)
+            machines_data, machine_payments_data = closed_machines_data, closed_payments_data
+        machines_data.append({
+            "Дата начала": m.start_date,
+            "Арендатор": m.tenant,
+            "Модель": m.model,
+            "Штрих-код": m.barcode,
+            "Оплата": m.rent_price,
+            "Залог": m.deposit,
+            "Полная стоимость": full_price,
+            "Телефон": m.phone,
+            "1С_статус": m.in_1C,
+            "Статус": status,
+            "Тип сделки": m.deal_type,
+            "Комментарий": m.comment or "",
+            "Остаток к выплате": remain,
+        })
+        for p in all_payments:
+            remain_p = max(full_price - sum(x.amount for x in all_payments if x.payment_date <= p.payment_date), 0)
+            machine_payments_data.append({
+                "Модель кофемашины": m.model,
+                "Арендатор": p.tenant,
+                "Сумма": p.amount,
+                "Дата платежа": p.payment_date,
+                "Тип": "Депозит" if p.is_deposit else ("Выкуп" if p.is_buyout else "Аренда"),
+                "Остаток к доплате": remain_p,
+            })
+    return active_machines_data, active_payments_data + closed_payments_data, closed_machines_data
+
+
+def _fleet(seed=7, count=40):
+    rng = random.Random(seed)
+    machines, payments = [], []
+    payment_id = 1
+    for machine_id in range(1, count + 1):
+        status = rng.choice(["active", "active", "buyout", "returned", "damaged", "lost"])
+        machines.append(SimpleNamespace(
+            id=machine_id,
+            start_date=date(2023, 1, 1) + timedelta(days=rng.randint(0, 400)),
+            tenant=f"Арендатор {machine_id}",
+            model=rng.choice(["Saeco", "Jura", "Неизвестная"]),
+            barcode=f"BC{machine_id:05d}",
+            rent_price=float(rng.choice([3000, 4500.5, 5000])),
+            deposit=float(rng.choice([0, 10000, 15000.25])),
+            full_price=rng.choice([None, 0.0, 250000.0, 99999.99]),
+            phone="996555000000",
+            in_1C=rng.choice([True, False, None]),
+            status=status,
+            deal_type=rng.choice(["Аренда", "Рассрочка"]),
+            comment=rng.choice([None, "", "комментарий"]),
+            total_paid=0.0,
+        ))
+        for _ in range(rng.randint(0, 15)):
+            # Несколько платежей в один день — проверка порядка при совпадении дат
+            payments.append(SimpleNamespace(
+                id=payment_id,
+                machine_id=machine_id,
+                tenant=f"Арендатор {machine_id}",
+                amount=round(rng.uniform(100, 30000), 2),
+                payment_date=date(2024, 1, 1) + timedelta(days=rng.randint(0, 20) * 15),
+                is_deposit=rng.random() < 0.15,
+                is_buyout=rng.choice([False, False, None, True]),
+            ))
+            payment_id += 1
+        machines[-1].total_paid = sum(p.amount for p in payments if p.machine_id == machine_id)
+    rng.shuffle(payments)
+    return machines, payments
+
+
+def _sheets(excel):
+    wb = load_workbook(excel)
+    return {ws.title: [list(row) for row in ws.iter_rows(values_only=True)] for ws in wb.worksheets}
+
+
+class TestBuildReportFrames:
+    """Тесты для сборки листов отчёта по столбцам"""
+
+    def test_parity_with_row_by_row_report(self, make_report_columns):
+        """Тест что Excel совпадает по ячейкам с прежней построчной сборкой"""
+        machines, payments = _fleet()
+        model_prices = {"Saeco": 300000.0, "Jura": 0.0}
+        ordered = sorted(payments, key=lambda p: (p.machine_id, p.payment_date, p.id))
+        machine_columns, payment_columns = make_report_columns(machines, ordered)
+
+        expected = _sheets(generate_excel_report(*_legacy_report_rows(machines, payments, model_prices)))
+        actual = _sheets(render_excel_report(machine_columns, payment_columns, model_prices))
+
+        assert list(actual) == list(expected)
+        for title in expected:
+            # Накопленная сумма и прежнее суммирование на каждую дату расходятся лишь в последнем знаке float
+            assert actual[title] == [
+                [pytest.approx(v) if isinstance(v, float) else v for v in row] for row in expected[title]
+            ], title
+
+    def test_labels_mapped_by_column(self, make_report_columns):
+        """Тест подписей статусов и типов платежей"""
+        machines, payments = _fleet(seed=1, count=12)
+        machine_columns, payment_columns = make_report_columns(
+            machines, sorted(payments, key=lambda p: (p.machine_id, p.payment_date, p.id))
+        )
+
+        active, payments_sheet, closed = build_report_frames(machine_columns, payment_columns, {})
+
+        assert set(active["Статус"]) <= {"Открыта"}
+        assert set(closed["Статус"]) <= {"Закрыта (выкуп)", "Закрыта (возврат)", "Закрыта (повреждена)", "Закрыта"}
+        assert set(payments_sheet["Тип"]) <= {"Депозит", "Выкуп", "Аренда"}
+
+    def test_same_date_payments_share_end_of_day_balance(self, make_report_columns):
+        """Тест что у платежей одной даты остаток считается на конец дня"""
+        machine = SimpleNamespace(
+            id=1, start_date=date(2024, 1, 1), tenant="Иван", model="Saeco", barcode="1", rent_price=5000.0,
+            deposit=0.0, full_price=1000.0, phone="996555000000", in_1C=False, status="active",
+            deal_type="Аренда", comment=None, total_paid=400.0,
+        )
+        payments = [
+            SimpleNamespace(id=1, machine_id=1, tenant="Иван", amount=100.0, payment_date=date(2024, 1, 5),
+                            is_deposit=False, is_buyout=False),
+            SimpleNamespace(id=2, machine_id=1, tenant="Иван", amount=50.0, payment_date=date(2024, 1, 5),
+                            is_deposit=True, is_buyout=False),
+            SimpleNamespace(id=3, machine_id=1, tenant="Иван", amount=250.0, payment_date=date(2024, 2, 5),
+                            is_deposit=False, is_buyout=True),
+        ]
+
+        _, payments_sheet, _ = build_report_frames(*make_report_columns([machine], payments), {})
+
+        assert payments_sheet["Остаток к доплате"].tolist() == [850.0, 850.0, 600.0]
+        assert payments_sheet["Тип"].tolist() == ["Аренда", "Депозит", "Выкуп"]
+
+    def test_empty_fleet(self, make_report_columns):
+        """Тест пустой базы: листы без строк, без листа закрытых сделок"""
+        sheets = _sheets(render_excel_report(*make_report_columns([], []), {}))
+
+        assert sheets == {"Активные сделки": [], "Платежи": []}
+
+
+class TestExport:
+    """Тесты для выгрузки листов отчёта в CSV и Parquet"""
+
+    @staticmethod
+    def _columns(make_report_columns):
+        machines, payments = _fleet(seed=3, count=10)
+        return make_report_columns(machines, sorted(payments, key=lambda p: (p.machine_id, p.payment_date, p.id)))
+
+    def test_csv_matches_report_frames(self, make_report_columns):
+        """Тест что CSV в архиве совпадают с листами отчёта"""
+        machines, payments = self._columns(make_report_columns)
+        frames = build_report_frames(machines, payments, {"Saeco": 300000.0})
+
+        with zipfile.ZipFile(render_csv_export(machines, payments, {"Saeco": 300000.0})) as archive:
+            assert archive.namelist() == ["active.csv", "payments.csv", "closed.csv"]
+            for name, frame in zip(archive.namelist(), frames):
+                raw = archive.read(name)
+                assert raw.startswith(b"\xef\xbb\xbf")
+                loaded = pd.read_csv(io.BytesIO(raw), encoding="utf-8-sig")
+                assert list(loaded.columns) == list(frame.columns)
+                assert len(loaded) == len(frame)
+                assert loaded["Арендатор"].tolist() == frame["Арендатор"].tolist()
+
+    def test_csv_empty_sheets_keep_header(self, make_report_columns):
+        """Тест что пустые листы выгружаются одним заголовком"""
+        with zipfile.ZipFile(render_csv_export(*make_report_columns([], []), {})) as archive:
+            header = archive.read("payments.csv").decode("utf-8-sig")
+
+        assert header == "Модель кофемашины,Арендатор,Сумма,Дата платежа,Тип,Остаток к доплате\n"
+
+    def test_parquet_matches_report_frames(self, make_report_columns):
+        """Тест что Parquet в архиве совпадают с листами отчёта"""
+        pytest.importorskip("pyarrow")
+        machines, payments = self._columns(make_report_columns)
+        frames = build_report_frames(machines, payments, {})
+
+        with zipfile.ZipFile(render_parquet_export(machines, payments, {})) as archive:
+            assert archive.namelist() == ["active.parquet", "payments.parquet", "closed.parquet"]
+            for name, frame in zip(archive.namelist(), frames):
+                loaded = pd.read_parquet(io.BytesIO(archive.read(name)))
+                assert loaded["Арендатор"].tolist() == frame["Арендатор"].tolist()
+
+
+class TestPeriodFrames:
+    """Тесты для листов отчёта за период"""
+
+    def test_period_rows_match_full_report(self, make_report_columns):
+        """Тест что отчёт за период — срез полного: остатки учитывают оплаченное до периода"""
+        machines, payments = _fleet(seed=11, count=30)
+        ordered = sorted(payments, key=lambda p: (p.machine_id, p.payment_date, p.id))
+        date_from, date_to = date(2023, 12, 1), date(2024, 3, 31)
+        full = build_report_frames(*make_report_columns(machines, ordered), {"Saeco": 300000.0})
+
+        # То, что вернёт fetch_report_columns с периодом: WHERE по датам и вычисляемые колонки
+        in_period = [p for p in ordered if date_from <= p.payment_date <= date_to]
+        paid_ids = {p.machine_id for p in in_period}
+        selected = [m for m in machines if date_from <= m.start_date <= date_to or m.id in paid_ids]
+        machine_columns, payment_columns = make_report_columns(selected, in_period)
+        machine_columns["listed"] = [date_from <= m.start_date <= date_to for m in selected]
+        machine_columns["paid_before"] = [
+            sum(p.amount for p in ordered if p.machine_id == m.id and p.payment_date < date_from) for m in selected
+        ]
+
+        active, payments_sheet, closed = build_report_frames(machine_columns, payment_columns, {"Saeco": 300000.0})
+
+        full_active, full_payments, full_closed = full
+        in_range = full_payments["Дата платежа"].map(lambda d: date_from <= d <= date_to)
+        expected_payments = full_payments[in_range].reset_index(drop=True)
+        assert payments_sheet.drop(columns="Остаток к доплате").equals(expected_payments.drop(columns="Остаток к доплате"))
+        assert payments_sheet["Остаток к доплате"].tolist() == pytest.approx(expected_payments["Остаток к доплате"].tolist())
+        started = lambda sheet: sheet[sheet["Дата начала"].map(lambda d: date_from <= d <= date_to)].reset_index(drop=True)
+        assert active.equals(started(full_active))
+        assert closed.equals(started(full_closed))
+        assert len(payments_sheet) and 0 < len(active) + len(closed) < len(full_active) + len(full_closed)
+
+
+def _legacy_profit_share_sheets(machines, rollup):
+    """Прежняя сборка: словарь на машину с ключом на месяц, объединение колонок pandas и чистка по листам"""
+    rows = []
+    for m in machines:
+        months = rollup.get(m.id, [])
+        first_payment_dt = min((r.first_payment_date for r in months), default=m.start_date)
+        row = {
+            "Месяц старта": first_payment_dt.strftime("%Y-%m"),
+            "Дата первого платежа": first_payment_dt,
+            "Дата оформления": m.start_date,
+            "Арендатор": m.tenant,
+            "Тип сделки": m.deal_type,
+            "Модель": m.model,
+            "Аренда": m.rent_price,
+            "Статус": m.status,
+        }
+        row.update({r.month.strftime("%Y-%m"): r.amount_sum for r in months})
+        rows.append(row)
+    sheets = {}
+    for month, df_month in pd.DataFrame(rows).groupby("Месяц старта"):
+        empty = [c for c in df_month.columns[8:] if df_month[c].fillna(0).eq(0).all()]
+        sheets[month] = df_month.drop(columns=empty).reset_index(drop=True)
+    return sheets
+
+
+class TestProfitShareSheets:
+    """Тесты для листов распределения прибыли из длинной таблицы выплат"""
+
+    @staticmethod
+    def _data(seed=5, count=40):
+        rng = random.Random(seed)
+        machines, rollup = [], {}
+        for machine_id in range(1, count + 1):
+            machines.append(SimpleNamespace(
+                id=machine_id, start_date=date(2025, rng.randint(1, 12), rng.randint(1, 28)),
+                tenant=f"Арендатор {machine_id}", deal_type=rng.choice(["Аренда", "Рассрочка"]),
+                model=rng.choice(["Saeco", "Jura"]), rent_price=float(rng.choice([5000, 7000])),
+                status=rng.choice(["active", "buyout"]),
+            ))
+            months = sorted(rng.sample(range(1, 13), rng.randint(0, 6)))
+            rollup[machine_id] = [
+                SimpleNamespace(
+                    month=date(2025, month, 1),
+                    # Нулевые суммы встречаются после удаления платежей — такие месяцы на листе не нужны
+                    amount_sum=rng.choice([0.0, 1500.0, 7000.0]),
+                    first_payment_date=date(2025, month, rng.randint(1, 28)),
+                )
+                for month in months
+            ]
+        return machines, rollup
+
+    @staticmethod
+    def _columns(machines, rollup):
+        machine_columns = {
+            name: [getattr(m, name) for m in machines]
+            for name in ["id", "start_date", "tenant", "deal_type", "model", "rent_price", "status"]
+        }
+        rows = [(machine_id, r) for machine_id, months in rollup.items() for r in months]
+        payouts = {
+            "machine_id": [machine_id for machine_id, _ in rows],
+            "month": [r.month for _, r in rows],
+            "amount_sum": [r.amount_sum for _, r in rows],
+            "first_payment_date": [r.first_payment_date for _, r in rows],
+        }
+        return machine_columns, payouts
+
+    def test_parity_with_row_dicts(self):
+        """Тест что листы совпадают с прежней сборкой, а месяцы идут по возрастанию"""
+        machines, rollup = self._data()
+        expected = _legacy_profit_share_sheets(machines, rollup)
+
+        sheets = dict(build_profit_share_sheets(*self._columns(machines, rollup)))
+
+        assert list(sheets) == sorted(expected)
+        for label, sheet in sheets.items():
+            months = list(sheet.columns[8:])
+            assert months == sorted(months)
+            assert sorted(sheet.columns) == sorted(expected[label].columns), label
+            pd.testing.assert_frame_equal(sheet, expected[label][list(sheet.columns)], check_dtype=False)
+
+    def test_machines_without_payouts(self):
+        """Тест машин без выплат: лист по месяцу оформления и без колонок месяцев"""
+        machines, _ = self._data(count=3)
+
+        sheets = build_profit_share_sheets(*self._columns(machines, {}))
+
+        assert sum(len(sheet) for _, sheet in sheets) == 3
+        for label, sheet in sheets:
+            assert len(sheet.columns) == 8
+            assert sheet["Дата первого платежа"].tolist() == sheet["Дата оформления"].tolist()
+
+    def test_no_machines(self):
+        """Тест пустой выборки"""
+        assert build_profit_share_sheets(*self._columns([], {})) == []
@@ -0,0 +1,211 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from aiohttp import ClientSession, web
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.filters import Command
+from aiogram.types import Message
+from webhook import create_webhook_app, set_bot_webhook, validate_webhook_config, webhook_url
+
+TOKEN = "123456:TEST-token"
+SECRET = "test_secret-1"
+
+
+class FakeTelegram:
+    """Локальная заглушка Bot API: запоминает вызванные методы и отвечает успехом"""
+
+    def __init__(self):
+        self.calls = []
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        self.calls.append((method, data))
+        if method == "sendMessage":
+            result = {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": int(data["chat_id"]), "type": "private"},
+                "text": data["text"],
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+async def _serve(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def _update(text="/ping"):
+    return {
+        "update_id": 1,
+        "message": {
+            "message_id": 10,
+            "date": 0,
+            "chat": {"id": 42, "type": "private"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Тест"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+@pytest.fixture
+async def telegram():
+    fake = FakeTelegram()
+    await fake.start()
+    yield fake
+    await fake.stop()
+
+
+@pytest.fixture
+def bot(telegram):
+    return Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(telegram.url)))
+
+
+@pytest.fixture
+def dp():
+    dispatcher = Dispatcher()
+
+    @dispatcher.message(Command("ping"))
+    async def ping(msg: Message):
+        await msg.answer("pong")
+
+    return dispatcher
+
+
+async def _wait_for(predicate, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        if loop.time() > deadline:
+            raise AssertionError("не дождались вызова Bot API")
+        await asyncio.sleep(0.01)
+
+
+class TestWebhookApp:
+    """Тесты для aiohttp-сервера webhook"""
+
+    @pytest.mark.asyncio
+    async def test_update_with_secret_is_processed(self, telegram, bot, dp):
+        """Тест что обновление с верным секретом обрабатывается и ответ уходит в Bot API"""
+        runner, url = await _serve(create_webhook_app(bot, dp, "/webhook", SECRET, "/health"))
+        try:
+            async with ClientSession() as http:
+                resp = await http.post(
+                    f"{url}/webhook", json=_update(),
+                    headers={"X-Telegram-Bot-Api-Secret-Token": SECRET},
+                )
+                assert resp.status == 200
+            await _wait_for(lambda: telegram.calls)
+        finally:
+            await runner.cleanup()
+
+        method, data = telegram.calls[0]
+        assert method == "sendMessage"
+        assert data["chat_id"] == "42"
+        assert data["text"] == "pong"
+
+    @pytest.mark.asyncio
+    async def test_wrong_secret_rejected(self, telegram, bot, dp):
+        """Тест что запрос без верного секрета отклоняется"""
+        runner, url = await _serve(create_webhook_app(bot, dp, "/webhook", SECRET, "/health"))
+        try:
+            async with ClientSession() as http:
+                resp = await http.post(
+                    f"{url}/webhook", json=_update(),
+                    headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"},
+                )
+                assert resp.status == 401
+                resp = await http.post(f"{url}/webhook", json=_update())
+                assert resp.status == 401
+            await asyncio.sleep(0.05)
+        finally:
+            await runner.cleanup()
+
+        assert telegram.calls == []
+
+    @pytest.mark.asyncio
+    async def test_health(self, bot, dp):
+        """Тест маршрута проверки живости"""
+        runner, url = await _serve(create_webhook_app(bot, dp, "/webhook", SECRET, "/health"))
+        try:
+            async with ClientSession() as http:
+                resp = await http.get(f"{url}/health")
+                assert resp.status == 200
+                assert await resp.json() == {"status": "ok"}
+        finally:
+            await runner.cleanup()
+
+
+class TestSetBotWebhook:
+    """Тесты для регистрации webhook в Telegram"""
+
+    @pytest.mark.asyncio
+    async def test_sets_url_secret_and_updates(self, telegram, bot):
+        """Тест что setWebhook получает адрес, секрет и используемые типы обновлений"""
+        await set_bot_webhook(bot, "https://bot.example.com/webhook", SECRET, ["message", "callback_query"])
+        await bot.session.close()
+
+        method, data = telegram.calls[0]
+        assert method == "setWebhook"
+        assert data["url"] == "https://bot.example.com/webhook"
+        assert data["secret_token"] == SECRET
+        assert "callback_query" in data["allowed_updates"]
+        assert "drop_pending_updates" not in data
+
+    @pytest.mark.asyncio
+    async def test_retries_after_rate_limit(self):
+        """Тест повтора setWebhook после ограничения частоты"""
+        mock_bot = MagicMock()
+        mock_bot.set_webhook = AsyncMock(side_effect=[
+            TelegramRetryAfter(MagicMock(), "Too Many Requests", retry_after=1),
+            True,
+        ])
+
+        with patch('webhook.asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+            await set_bot_webhook(mock_bot, "https://bot.example.com/webhook", SECRET, ["message"])
+
+        mock_sleep.assert_called_once_with(1)
+        assert mock_bot.set_webhook.call_count == 2
+
+
+class TestWebhookConfig:
+    """Тесты для проверки настроек webhook"""
+
+    def test_url_joins_base_and_path(self):
+        """Тест сборки публичного адреса"""
+        assert webhook_url("https://bot.example.com/", "/webhook") == "https://bot.example.com/webhook"
+
+    def test_requires_https_and_secret(self):
+        """Тест что без https-адреса или секрета webhook не запускается"""
+        with pytest.raises(RuntimeError):
+            validate_webhook_config("http://bot.example.com", SECRET)
+        with pytest.raises(RuntimeError):
+            validate_webhook_config("https://bot.example.com", "")
+        with pytest.raises(RuntimeError):
+            validate_webhook_config("https://bot.example.com", "bad secret!")
+        validate_webhook_config("https://bot.example.com", SECRET)
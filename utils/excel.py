@@ -1,101 +1,109 @@
 import pandas as pd
-import re
 from io import BytesIO
+from itertools import chain, islice
+from typing import Iterable
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
 from openpyxl.utils import get_column_letter
-import pandas as pd
 
-def generate_excel_report(active_machines_data: list[dict], payments_data: list[dict], closed_machines_data: list[dict] = None) -> BytesIO:
-    output = BytesIO()
-    
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        # Первый лист - активные кофемашины
-        df_active = pd.DataFrame(active_machines_data)
-        df_active.to_excel(writer, sheet_name='Активные сделки', index=False)
-        
-        # Второй лист - платежи
-        df_payments = pd.DataFrame(payments_data)
-        df_payments.to_excel(writer, sheet_name='Платежи', index=False)
-        
-        # Третий лист - закрытые сделки (если есть данные)
-        if closed_machines_data:
-            df_closed = pd.DataFrame(closed_machines_data)
-            df_closed.to_excel(writer, sheet_name='Закрытые сделки', index=False)
+# По скольким первым строкам листа подбирается ширина колонок при потоковой записи
+WIDTH_SAMPLE_ROWS = 1000
 
-        _autosize_all_sheets(writer)
-    
-    output.seek(0)
-    return output 
+# Оформление заголовка как у pandas.to_excel, чтобы листы выглядели как раньше
+_HEADER_FONT = Font(bold=True)
+_HEADER_BORDER = Border(*(Side(style="thin"),) * 4)
+_HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="top")
 
 
-def generate_profit_share_report(rows: list[dict]) -> BytesIO:
+def generate_excel_report(
+    active_machines_data: Iterable[dict] | pd.DataFrame,
+    payments_data: Iterable[dict] | pd.DataFrame,
+    closed_machines_data: Iterable[dict] | pd.DataFrame = None,
+) -> BytesIO:
     """
-    Формирует Excel с распределением прибыли.
-    Один лист = месяц старта арендатора, строки — все выплаты по арендатору.
+    Формирует отчёт в режиме openpyxl write-only: строки сразу уходят во временный файл листа,
+    без объектов ячеек в памяти. Листы — готовые DataFrame или списки/генераторы словарей.
     """
     output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df = pd.DataFrame(rows) if rows else pd.DataFrame([])
-        wrote_any = False
-        if df.empty:
-            df.to_excel(writer, sheet_name="Нет данных", index=False)
-            wrote_any = True
-        else:
-            if "Дата платежа" in df.columns:
-                df.sort_values(by="Дата платежа", inplace=True, ignore_index=True)
-
-            # Drop month columns without payments for the full dataset.
-            df = _drop_empty_month_columns(df)
-
-            if "Месяц старта" in df.columns:
-                for month, df_month in df.groupby("Месяц старта"):
-                    # Also drop empty month columns per each sheet.
-                    df_month = _drop_empty_month_columns(df_month)
-                    df_month.to_excel(writer, sheet_name=month, index=False)
-                    wrote_any = True
-            else:
-                df.to_excel(writer, sheet_name="Выплаты", index=False)
-                wrote_any = True
-        # Гарантируем наличие видимого листа
-        if not wrote_any or not writer.book.worksheets:
-            ws = writer.book.create_sheet("Нет данных")
-            ws.sheet_state = "visible"
-        else:
-            first = True
-            for ws in writer.book.worksheets:
-                ws.sheet_state = "visible"
-                if first:
-                    writer.book.active = writer.book.sheetnames.index(ws.title)
-                    first = False
-        _autosize_all_sheets(writer)
+    wb = Workbook(write_only=True)
+    # Первый лист - активные кофемашины
+    _write_sheet(wb, 'Активные сделки', active_machines_data)
+    # Второй лист - платежи
+    _write_sheet(wb, 'Платежи', payments_data)
+    # Третий лист - закрытые сделки (если есть данные)
+    if _has_rows(closed_machines_data):
+        _write_sheet(wb, 'Закрытые сделки', closed_machines_data)
+    wb.save(output)
     output.seek(0)
     return output
 
 
-def _autosize_all_sheets(writer: pd.ExcelWriter) -> None:
-    """Устанавливает ширину столбцов по максимальной длине текста в каждом столбце."""
-    wb = writer.book
-    if not wb.worksheets:
+def _has_rows(data) -> bool:
+    if isinstance(data, pd.DataFrame):
+        return not data.empty
+    return bool(data)
+
+
+def _frame_rows(df: pd.DataFrame):
+    # Пропуски (NaN) пишем пустыми ячейками, как pandas.to_excel
+    for row in df.itertuples(index=False, name=None):
+        yield [None if isinstance(value, float) and value != value else value for value in row]
+
+
+def _write_sheet(wb: Workbook, title: str, data) -> None:
+    """
+    Пишет лист построчно. Колонки — колонки DataFrame или ключи первого словаря. Ширина колонок
+    считается на лету по заголовку и первым WIDTH_SAMPLE_ROWS строкам: в write-only режиме её
+    нужно задать до записи строк.
+    """
+    ws = wb.create_sheet(title)
+    if isinstance(data, pd.DataFrame):
+        columns = list(data.columns)
+        rows = _frame_rows(data)
+    else:
+        rows = iter(data)
+        first = next(rows, None)
+        if first is None:
+            return
+        columns = list(first.keys())
+        rows = ([row.get(column) for column in columns] for row in chain([first], rows))
+    sample = list(islice(rows, WIDTH_SAMPLE_ROWS))
+    if not sample:
         return
-    for ws in wb.worksheets:
-        for idx, column_cells in enumerate(ws.columns, start=1):
-            max_length = 0
-            for cell in column_cells:
-                try:
-                    cell_value = "" if cell.value is None else str(cell.value)
-                    max_length = max(max_length, len(cell_value))
-                except Exception:
-                    continue
-            adjusted_width = max_length + 2 if max_length else 10
-            ws.column_dimensions[get_column_letter(idx)].width = adjusted_width
+    widths = [len(str(column)) for column in columns]
+    for row in sample:
+        for idx, value in enumerate(row):
+            if value is not None:
+                widths[idx] = max(widths[idx], len(str(value)))
+    for idx, width in enumerate(widths, start=1):
+        ws.column_dimensions[get_column_letter(idx)].width = width + 2 if width else 10
+
+    header = []
+    for column in columns:
+        cell = WriteOnlyCell(ws, value=column)
+        cell.font = _HEADER_FONT
+        cell.border = _HEADER_BORDER
+        cell.alignment = _HEADER_ALIGNMENT
+        header.append(cell)
+    ws.append(header)
+    for row in chain(sample, rows):
+        ws.append(row)
 
 
-def _drop_empty_month_columns(df: pd.DataFrame) -> pd.DataFrame:
-    month_cols = [c for c in df.columns if re.fullmatch(r"\d{4}-\d{2}", str(c))]
-    drop_cols = []
-    for c in month_cols:
-        col = df[c]
-        if col.isna().all() or col.fillna(0).eq(0).all():
-            drop_cols.append(c)
-    if drop_cols:
-        return df.drop(columns=drop_cols)
-    return df
+def generate_profit_share_report(sheets: list[tuple[str, pd.DataFrame]]) -> BytesIO:
+    """
+    Формирует Excel с распределением прибыли.
+    Один лист = месяц старта арендатора; листы готовит build_profit_share_sheets,
+    здесь они только пишутся в режиме write-only. Без данных — пустой лист «Нет данных».
+    """
+    output = BytesIO()
+    wb = Workbook(write_only=True)
+    for title, frame in sheets:
+        _write_sheet(wb, title, frame)
+    # Гарантируем наличие видимого листа
+    if not sheets:
+        wb.create_sheet("Нет данных")
+    wb.save(output)
+    output.seek(0)
+    return output
@@ -0,0 +1,86 @@
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+# Через сколько дней после последнего платежа (или начала сделки) платёж считается просроченным
+OVERDUE_AFTER_DAYS = 30
+
+
+@dataclass(frozen=True)
+class SummaryEntry:
+    """Поля активной сделки, из которых складываются показатели /summary."""
+    machine_id: int
+    deposit: float
+    rent_price: float
+    in_1C: bool
+    due_date: date
+
+
+def due_date_for(start_date: date, last_payment_date: date | None) -> date:
+    """Дата следующего платежа: через OVERDUE_AFTER_DAYS от последнего платежа или начала сделки."""
+    return (last_payment_date or start_date) + timedelta(days=OVERDUE_AFTER_DAYS)
+
+
+class FleetSummary:
+    """
+    Показатели /summary по активным сделкам, обновляемые точечно при изменениях.
+    Суммы ведутся нарастающим итогом, а сроки платежей — в отсортированном списке,
+    поэтому число просрочек на любую дату считается бинарным поиском без пересчёта по парку.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._entries: dict[int, SummaryEntry] = {}
+        self._due: list[tuple[date, int]] = []
+        self._deposit_sum = 0.0
+        self._rent_sum = 0.0
+        self._not_in_1c = 0
+
+    def rebuild(self, entries) -> None:
+        """Полностью заменить содержимое (при старте бота и после пересборки итогов)."""
+        self.clear()
+        for entry in entries:
+            self._add(entry)
+        self.loaded = True
+
+    def clear(self) -> None:
+        self.loaded = False
+        self._entries.clear()
+        self._due.clear()
+        self._deposit_sum = 0.0
+        self._rent_sum = 0.0
+        self._not_in_1c = 0
+
+    def upsert(self, entry: SummaryEntry) -> None:
+        self.remove(entry.machine_id)
+        self._add(entry)
+
+    def remove(self, machine_id: int) -> None:
+        entry = self._entries.pop(machine_id, None)
+        if entry is None:
+            return
+        index = bisect_left(self._due, (entry.due_date, machine_id))
+        del self._due[index]
+        self._deposit_sum -= entry.deposit
+        self._rent_sum -= entry.rent_price
+        self._not_in_1c -= 0 if entry.in_1C else 1
+
+    def _add(self, entry: SummaryEntry) -> None:
+        self._entries[entry.machine_id] = entry
+        insort(self._due, (entry.due_date, entry.machine_id))
+        self._deposit_sum += entry.deposit
+        self._rent_sum += entry.rent_price
+        self._not_in_1c += 0 if entry.in_1C else 1
+
+    def overdue_count(self, today: date) -> int:
+        # Все сроки раньше today идут в начале списка
+        return bisect_left(self._due, (today,))
+
+    def snapshot(self, today: date) -> dict:
+        return {
+            "active": len(self._entries),
+            "overdue": self.overdue_count(today),
+            "deposit_sum": round(self._deposit_sum, 2),
+            "monthly_income": round(self._rent_sum, 2),
+            "not_in_1c": self._not_in_1c,
+        }
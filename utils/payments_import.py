@@ -0,0 +1,111 @@
+from datetime import date, datetime
+from io import BytesIO
+
+import pandas as pd
+
+# Заголовки колонок файла (в нижнем регистре) -> поле платежа
+COLUMN_ALIASES = {
+    "machine_id": "machine_id",
+    "id сделки": "machine_id",
+    "id машины": "machine_id",
+    "amount": "amount",
+    "сумма": "amount",
+    "payment_date": "payment_date",
+    "дата платежа": "payment_date",
+    "дата": "payment_date",
+    "tenant": "tenant",
+    "арендатор": "tenant",
+    "type": "type",
+    "тип": "type",
+}
+REQUIRED_FIELDS = ("machine_id", "amount", "payment_date")
+
+# Значения колонки «Тип»; всё остальное (и пустое) — арендная плата
+DEPOSIT_TYPES = {"депозит", "платеж", "платёж", "deposit"}
+BUYOUT_TYPES = {"выкуп", "buyout"}
+
+DATE_FORMATS = ("%d.%m.%Y", "%d-%m-%Y", "%Y-%m-%d")
+
+
+def _parse_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"неверная дата '{text}'")
+
+
+def _parse_amount(value) -> float:
+    text = str(value).strip().replace(" ", "").replace(",", ".")
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"неверная сумма '{value}'")
+
+
+def _parse_machine_id(value) -> int:
+    text = str(value).strip()
+    try:
+        number = float(text)
+    except ValueError:
+        raise ValueError(f"неверный ID сделки '{value}'")
+    if not number.is_integer():
+        raise ValueError(f"неверный ID сделки '{value}'")
+    return int(number)
+
+
+def read_payments_table(content: bytes, filename: str) -> pd.DataFrame:
+    """Читает Excel (.xlsx/.xls) или CSV (разделитель , или ;) в DataFrame."""
+    name = filename.lower()
+    if name.endswith((".xlsx", ".xls")):
+        return pd.read_excel(BytesIO(content), dtype=object)
+    if name.endswith(".csv"):
+        return pd.read_csv(BytesIO(content), dtype=str, sep=None, engine="python", encoding="utf-8-sig")
+    raise ValueError("Поддерживаются только файлы .xlsx, .xls и .csv")
+
+
+def parse_payments_file(content: bytes, filename: str) -> list[dict]:
+    """
+    Разбирает файл с платежами в список словарей для add_payments_bulk.
+    Обязательные колонки: ID сделки, Сумма, Дата платежа; необязательные: Арендатор, Тип.
+    При ошибках бросает ValueError с номерами строк файла.
+    """
+    df = read_payments_table(content, filename)
+    df = df.rename(columns=lambda c: COLUMN_ALIASES.get(str(c).strip().lower(), c))
+    missing = [field for field in REQUIRED_FIELDS if field not in df.columns]
+    if missing:
+        raise ValueError(f"В файле нет колонок: {', '.join(missing)}")
+
+    payments = []
+    errors = []
+    # Номер строки в файле: +2 за заголовок и нумерацию с единицы
+    for line, record in enumerate(df.to_dict("records"), start=2):
+        if all(pd.isna(record.get(field)) for field in REQUIRED_FIELDS):
+            continue
+        try:
+            for field in REQUIRED_FIELDS:
+                if pd.isna(record.get(field)):
+                    raise ValueError(f"пустое поле {field}")
+            payment_type = record.get("type")
+            payment_type = "" if pd.isna(payment_type) else str(payment_type).strip().lower()
+            tenant = record.get("tenant")
+            payments.append({
+                "machine_id": _parse_machine_id(record["machine_id"]),
+                "tenant": "" if pd.isna(tenant) else str(tenant).strip(),
+                "amount": _parse_amount(record["amount"]),
+                "payment_date": _parse_date(record["payment_date"]),
+                "is_deposit": payment_type in DEPOSIT_TYPES,
+                "is_buyout": payment_type in BUYOUT_TYPES,
+            })
+        except ValueError as e:
+            errors.append(f"строка {line}: {e}")
+
+    if errors:
+        raise ValueError("Ошибки в файле:\n" + "\n".join(errors[:20]))
+    return payments
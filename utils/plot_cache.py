@@ -0,0 +1,109 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+import plotly
+
+logger = logging.getLogger("plots.cache")
+
+# Меняется при смене способа отрисовки — старые файлы перестают совпадать по ключу
+RENDER_VERSION = f"png-v1-plotly{plotly.__version__}"
+
+
+class PlotCache:
+    """
+    Дисковый кэш отрисованных графиков с адресацией по содержимому.
+    Ключ — sha256 от полного описания фигуры (тип графика, ряды данных, оформление),
+    поэтому одинаковые данные дают тот же файл. Файлы <ключ>.png, рядом <ключ>.file_id
+    с file_id Telegram. Общий размер ограничен max_bytes, вытесняются давно не читанные
+    (по времени изменения файла, которое обновляется при каждом попадании).
+    """
+
+    def __init__(self, directory, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key_for(fig) -> str:
+        return PlotCache.key_for_json(fig.to_json())
+
+    @staticmethod
+    def key_for_json(fig_json: str) -> str:
+        digest = hashlib.sha256(RENDER_VERSION.encode())
+        digest.update(fig_json.encode())
+        return digest.hexdigest()
+
+    def _png(self, key: str) -> Path:
+        return self.directory / f"{key}.png"
+
+    def _file_id_path(self, key: str) -> Path:
+        return self.directory / f"{key}.file_id"
+
+    def get(self, key: str) -> bytes | None:
+        if not self.enabled:
+            return None
+        path = self._png(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except OSError:
+            logger.warning("Не удалось прочитать график из кэша %s", path, exc_info=True)
+            return None
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if not self.enabled:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = self.directory / f".{key}.{os.getpid()}.tmp"
+            tmp.write_bytes(data)
+            os.replace(tmp, self._png(key))
+            self._evict()
+        except OSError:
+            logger.warning("Не удалось сохранить график в кэш %s", self.directory, exc_info=True)
+
+    def get_file_id(self, key: str) -> str | None:
+        if not self.enabled:
+            return None
+        try:
+            return self._file_id_path(key).read_text().strip() or None
+        except OSError:
+            return None
+
+    def set_file_id(self, key: str, file_id: str | None) -> None:
+        if not self.enabled or not self._png(key).exists():
+            return
+        path = self._file_id_path(key)
+        try:
+            if file_id:
+                path.write_text(file_id)
+            else:
+                path.unlink(missing_ok=True)
+        except OSError:
+            logger.warning("Не удалось сохранить file_id графика %s", path, exc_info=True)
+
+    def _evict(self) -> None:
+        entries = []
+        total = 0
+        for path in self.directory.glob("*.png"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            self._file_id_path(path.stem).unlink(missing_ok=True)
+            total -= size
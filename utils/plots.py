@@ -1,5 +1,8 @@
 import plotly.graph_objects as go
 from io import BytesIO
+from config import PLOT_CACHE_DIR, PLOT_CACHE_MAX_MB
+from utils.plot_cache import PlotCache
+from utils.render_pool import render_pool, render_figure_png
 
 # 5. Старт сделок по дням месяца
 async def plot_starts_per_day(data, month_label: str):
@@ -56,6 +59,27 @@ async def plot_overdue(data):
     fig.update_layout(title='Просрочки')
     return await fig_to_bytesio(fig)
 
+class PlotImage(BytesIO):
+    """PNG графика вместе с ключом дискового кэша (по нему же хранится file_id Telegram)."""
+
+    def __init__(self, data: bytes, cache_key: str | None = None):
+        super().__init__(data)
+        self.cache_key = cache_key
+
+
+plot_cache = PlotCache(PLOT_CACHE_DIR, int(PLOT_CACHE_MAX_MB * 1024 * 1024))
+
+
 async def fig_to_bytesio(fig):
-    img_bytes = fig.to_image(format='png')
-    return BytesIO(img_bytes) 
\ No newline at end of file
+    # Отрисовка через Kaleido — самая медленная операция бота, поэтому сначала смотрим в кэш,
+    # а рисуем в пуле процессов, не занимая цикл событий
+    fig_json = fig.to_json()
+    key = plot_cache.key_for_json(fig_json) if plot_cache.enabled else None
+    if key is not None:
+        cached = plot_cache.get(key)
+        if cached is not None:
+            return PlotImage(cached, key)
+    img_bytes = await render_pool.run(render_figure_png, fig_json)
+    if key is not None:
+        plot_cache.put(key, img_bytes)
+    return PlotImage(img_bytes, key)
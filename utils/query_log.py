@@ -0,0 +1,108 @@
+import logging
+import re
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+
+logger = logging.getLogger("db.queries")
+
+# Верхние границы корзин гистограммы, мс (последняя корзина — всё, что дольше)
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+MAX_TRACKED_STATEMENTS = 500
+
+_IN_LIST_RE = re.compile(r"\(\s*(?:\$\d+|%\(\w+\)s|\?)(?:::\w+)?(?:\s*,\s*(?:\$\d+|%\(\w+\)s|\?)(?:::\w+)?)*\s*\)")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_statement(statement: str) -> str:
+    """Приводит SQL к ключу гистограммы: схлопывает пробелы и списки параметров IN (...)."""
+    statement = _IN_LIST_RE.sub("(...)", statement)
+    return _SPACES_RE.sub(" ", statement).strip()[:300]
+
+
+def redact_parameters(parameters) -> str:
+    """Описание параметров без значений: только количество и типы."""
+    if parameters is None:
+        return "[]"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}: <{type(v).__name__}>" for k, v in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            return f"<{len(parameters)} наборов параметров>"
+        return "[" + ", ".join(f"<{type(v).__name__}>" for v in parameters) + "]"
+    return f"<{type(parameters).__name__}>"
+
+
+class QueryStats:
+    """Гистограммы задержек по каждому SQL-выражению."""
+
+    def __init__(self, max_statements: int = MAX_TRACKED_STATEMENTS):
+        self.max_statements = max_statements
+        self._stats: dict[str, dict] = {}
+
+    def record(self, statement: str, duration_ms: float) -> None:
+        key = normalize_statement(statement)
+        entry = self._stats.get(key)
+        if entry is None:
+            if len(self._stats) >= self.max_statements:
+                key = "<прочие>"
+                entry = self._stats.get(key)
+            if entry is None:
+                entry = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+                self._stats[key] = entry
+        entry["count"] += 1
+        entry["total_ms"] += duration_ms
+        entry["max_ms"] = max(entry["max_ms"], duration_ms)
+        entry["buckets"][bisect_left(LATENCY_BUCKETS_MS, duration_ms)] += 1
+
+    def snapshot(self, top: int | None = None) -> list[dict]:
+        """Статистика по выражениям, отсортированная по суммарному времени."""
+        rows = [
+            {
+                "statement": key,
+                "count": entry["count"],
+                "total_ms": entry["total_ms"],
+                "avg_ms": entry["total_ms"] / entry["count"],
+                "max_ms": entry["max_ms"],
+                "buckets": dict(zip([*map(str, LATENCY_BUCKETS_MS), "inf"], entry["buckets"])),
+            }
+            for key, entry in self._stats.items()
+        ]
+        rows.sort(key=lambda r: r["total_ms"], reverse=True)
+        return rows[:top] if top else rows
+
+    def reset(self) -> None:
+        self._stats.clear()
+
+
+def install_query_logging(engine, stats: QueryStats, slow_threshold_ms: float) -> None:
+    """
+    Вешает на движок обработчики before/after_cursor_execute:
+    каждое выражение попадает в гистограмму, медленные — в лог без значений параметров.
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start_time"].pop()
+        duration_ms = (time.perf_counter() - started) * 1000
+        stats.record(statement, duration_ms)
+        if slow_threshold_ms >= 0 and duration_ms >= slow_threshold_ms:
+            logger.warning(
+                "Медленный запрос %.1f мс: %s; параметры: %s",
+                duration_ms,
+                normalize_statement(statement),
+                redact_parameters(parameters),
+            )
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _handle_error(exception_context):
+        # Упавший запрос не доходит до after_cursor_execute — убираем его отметку времени
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start_time"):
+            conn.info["query_start_time"].pop()
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from config import RENDER_WORKERS, RENDER_TIMEOUT
+
+logger = logging.getLogger("render")
+
+# Пауза перед повторной попыткой поднять процесс взамен убитого, секунды
+RESPAWN_DELAY = 1
+
+
+class RenderError(Exception):
+    """Отчёт или график не удалось отрисовать в пуле (процесс упал или пул перезапущен)."""
+
+
+class RenderTimeout(RenderError):
+    """Отрисовка отчёта или графика не уложилась в RENDER_TIMEOUT."""
+
+
+def render_figure_png(fig_json: str) -> bytes:
+    """PNG графика по его JSON-описанию (выполняется в процессе пула)."""
+    import plotly.io as pio
+    return pio.from_json(fig_json).to_image(format="png")
+
+
+def _warm_up() -> None:
+    # Импорт pandas/openpyxl/plotly занимает секунды — платим его при старте, а не на первом отчёте
+    import openpyxl  # noqa: F401
+    import pandas  # noqa: F401
+    import plotly.graph_objects  # noqa: F401
+    import utils.excel  # noqa: F401
+
+
+def _spawn_executor() -> ProcessPoolExecutor:
+    # spawn: дочерние процессы не наследуют цикл событий и соединения с БД родителя
+    return ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+
+
+class RenderPool:
+    """
+    Общий пул процессов для CPU-тяжёлой отрисовки (Excel через pandas/openpyxl, PNG через Kaleido),
+    чтобы она не останавливала цикл событий: polling, напоминания и других пользователей.
+    Каждый процесс — отдельный исполнитель на один процесс: задача занимает свободный процесс
+    целиком, поэтому зависшую отрисовку можно убить, не трогая чужие. Таймаут считается
+    с начала выполнения, а не с ожидания свободного процесса.
+    Пока пул не запущен (или workers=0), задачи выполняются в потоке — так работают тесты и скрипты.
+    """
+
+    def __init__(self, workers: int, timeout: float):
+        self.workers = workers
+        self.timeout = timeout
+        # Прогретые процессы, готовые взять задачу; None — пул не запущен
+        self._idle: asyncio.Queue[ProcessPoolExecutor] | None = None
+        self._executors: set[ProcessPoolExecutor] = set()
+        self._warming: set[asyncio.Task] = set()
+
+    @property
+    def started(self) -> bool:
+        return self._idle is not None
+
+    async def start(self) -> None:
+        """Запускает процессы и прогревает их импортами; повторный вызов ничего не делает."""
+        if self.workers <= 0 or self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        executors = [self._spawn() for _ in range(self.workers)]
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(executor, _warm_up) for executor in executors))
+        for executor in executors:
+            self._idle.put_nowait(executor)
+        logger.info("Пул отрисовки запущен: %s процесс(ов)", self.workers)
+
+    def _spawn(self) -> ProcessPoolExecutor:
+        executor = _spawn_executor()
+        self._executors.add(executor)
+        return executor
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Выполняет func(*args, **kwargs) в свободном процессе пула и ждёт не дольше timeout.
+        func и аргументы должны сериализоваться pickle (функции уровня модуля, простые данные).
+        """
+        call = partial(func, *args, **kwargs)
+        name = getattr(func, "__name__", func)
+        idle = self._idle
+        if idle is None:
+            try:
+                return await asyncio.wait_for(asyncio.to_thread(call), self.timeout)
+            except asyncio.TimeoutError:
+                logger.error("Отрисовка %s не уложилась в %s с", name, self.timeout)
+                raise RenderTimeout()
+
+        executor = await idle.get()
+        healthy = True
+        try:
+            future = asyncio.get_running_loop().run_in_executor(executor, call)
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            logger.error("Отрисовка %s не уложилась в %s с", name, self.timeout)
+            healthy = False
+            raise RenderTimeout()
+        except BrokenProcessPool:
+            logger.error("Процесс отрисовки %s завершился аварийно", name)
+            healthy = False
+            raise RenderError()
+        except asyncio.CancelledError:
+            # Отменили ожидание, но процесс продолжает рисовать: следующая задача встала бы за ним
+            healthy = False
+            raise
+        finally:
+            if not healthy:
+                # Занятый процесс не освободится сам: убиваем только его и поднимаем замену
+                self._replace(executor)
+            elif idle is self._idle:
+                idle.put_nowait(executor)
+
+    def _replace(self, executor: ProcessPoolExecutor) -> None:
+        self._executors.discard(executor)
+        self._terminate(executor)
+        if self._idle is None:
+            return
+        task = asyncio.create_task(self._warm_replacement(self._idle))
+        self._warming.add(task)
+        task.add_done_callback(self._warming.discard)
+
+    async def _warm_replacement(self, idle: asyncio.Queue) -> None:
+        # Задачи ждут в очереди свободных процессов, пока замена не прогреется. Пробуем до успеха:
+        # потерянная замена навсегда уменьшила бы пул
+        while True:
+            executor = None
+            try:
+                executor = self._spawn()
+                await asyncio.get_running_loop().run_in_executor(executor, _warm_up)
+            except Exception:
+                logger.exception("Не удалось поднять процесс отрисовки, повторим через %s с", RESPAWN_DELAY)
+                if executor is not None:
+                    self._executors.discard(executor)
+                    self._terminate(executor)
+                await asyncio.sleep(RESPAWN_DELAY)
+                continue
+            idle.put_nowait(executor)
+            return
+
+    @staticmethod
+    def _terminate(executor: ProcessPoolExecutor) -> None:
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    async def shutdown(self) -> None:
+        if self._idle is None:
+            return
+        self._idle = None
+        for task in list(self._warming):
+            task.cancel()
+        executors, self._executors = self._executors, set()
+        for executor in executors:
+            await asyncio.to_thread(executor.shutdown, True, cancel_futures=True)
+
+
+render_pool = RenderPool(RENDER_WORKERS, RENDER_TIMEOUT)
@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class CachedReport:
+    version: int
+    content: bytes
+    filename: str
+    file_id: str | None = None
+
+
+class ReportCache:
+    """
+    Последний сгенерированный файл каждого отчёта, привязанный к версии данных.
+    Пока версия не изменилась, отчёт не пересобирается, а после первой отправки
+    повторно уходит по file_id Telegram без повторной загрузки.
+    """
+
+    def __init__(self):
+        self._reports: dict[str, CachedReport] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, version: int) -> CachedReport | None:
+        report = self._reports.get(key)
+        if report is None or report.version != version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return report
+
+    def put(self, key: str, version: int, content: bytes, filename: str) -> CachedReport:
+        # Храним только последнюю версию каждого отчёта; отчёты прошлых версий данных
+        # (в том числе по другим фильтрам) больше не отдадутся — выбрасываем их сразу
+        report = CachedReport(version=version, content=content, filename=filename)
+        self._reports = {k: r for k, r in self._reports.items() if r.version == version}
+        self._reports[key] = report
+        return report
+
+    def set_file_id(self, key: str, version: int, file_id: str | None) -> None:
+        report = self._reports.get(key)
+        if report is not None and report.version == version:
+            report.file_id = file_id
+
+    def clear(self) -> None:
+        self._reports.clear()
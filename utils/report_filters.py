@@ -0,0 +1,130 @@
+import re
+from calendar import monthrange
+from dataclasses import dataclass
+from datetime import date
+
+# Статусы в аргументах отчётов; "closed" — все закрытые сделки (status != 'active')
+STATUS_ALIASES = {
+    "active": "active",
+    "активные": "active",
+    "closed": "closed",
+    "закрытые": "closed",
+    "buyout": "buyout",
+    "выкуп": "buyout",
+    "returned": "returned",
+    "возврат": "returned",
+    "damaged": "damaged",
+    "повреждена": "damaged",
+}
+
+# Текущий период: большая часть отчётов — за текущий квартал
+CURRENT_PERIODS = {
+    "month": "month", "месяц": "month",
+    "quarter": "quarter", "квартал": "quarter",
+    "year": "year", "год": "year",
+}
+
+_PERIOD_RE = re.compile(r"(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?|-?[QqКк]([1-4]))?")
+
+FILTERS_USAGE = (
+    "Период: 2025, 2025-03, 2025-Q1, 2025-03-15, диапазон 2025-01..2025-06 "
+    "(можно без начала или конца), либо month / quarter / year.\n"
+    "Статусы: active, closed, buyout, returned, damaged."
+)
+
+
+@dataclass(frozen=True)
+class ReportFilters:
+    """Период (включительно) и статусы сделок для /report, /profit и /export."""
+    date_from: date | None = None
+    date_to: date | None = None
+    statuses: tuple[str, ...] = ()
+
+    @property
+    def has_period(self) -> bool:
+        return self.date_from is not None or self.date_to is not None
+
+    def _suffix(self) -> str:
+        parts = []
+        if self.has_period:
+            parts.append(f"{self.date_from or ''}..{self.date_to or ''}")
+        parts.extend(self.statuses)
+        return "_".join(parts)
+
+    def cache_key(self, base: str) -> str:
+        """Ключ кэша отчётов: у каждого набора фильтров — свой файл."""
+        suffix = self._suffix()
+        return f"{base}:{suffix}" if suffix else base
+
+    def filename(self, filename: str) -> str:
+        """Имя файла с фильтрами перед расширением: coffee_report_2025-01-01..2025-06-30_active.xlsx"""
+        suffix = self._suffix()
+        if not suffix:
+            return filename
+        stem, dot, ext = filename.rpartition(".")
+        return f"{stem}_{suffix}{dot}{ext}"
+
+
+NO_FILTERS = ReportFilters()
+
+
+def _period_bounds(token: str) -> tuple[date, date]:
+    match = _PERIOD_RE.fullmatch(token)
+    if match is None:
+        raise ValueError(f"Не понял период «{token}»")
+    year, month, day, quarter = match.groups()
+    year = int(year)
+    try:
+        if quarter:
+            first_month = (int(quarter) - 1) * 3 + 1
+            return date(year, first_month, 1), date(year, first_month + 2, monthrange(year, first_month + 2)[1])
+        if day:
+            exact = date(year, int(month), int(day))
+            return exact, exact
+        if month:
+            month = int(month)
+            return date(year, month, 1), date(year, month, monthrange(year, month)[1])
+    except ValueError:
+        raise ValueError(f"Нет такой даты: «{token}»")
+    return date(year, 1, 1), date(year, 12, 31)
+
+
+def _current_period(kind: str, today: date) -> tuple[date, date]:
+    if kind == "month":
+        return _period_bounds(f"{today.year}-{today.month}")
+    if kind == "quarter":
+        return _period_bounds(f"{today.year}-Q{(today.month - 1) // 3 + 1}")
+    return _period_bounds(str(today.year))
+
+
+def parse_report_filters(args: str | None, today: date | None = None) -> ReportFilters:
+    """
+    Аргументы команды в фильтры: не больше одного периода и любые статусы, в любом порядке.
+    Например «2025-01..2025-06 active» или «quarter closed». Ошибка — ValueError с текстом для пользователя.
+    """
+    date_from = date_to = None
+    has_period = False
+    statuses = set()
+    for token in (args or "").lower().split():
+        if token in STATUS_ALIASES:
+            statuses.add(STATUS_ALIASES[token])
+            continue
+        if has_period:
+            raise ValueError("Укажите только один период")
+        has_period = True
+        if token in CURRENT_PERIODS:
+            date_from, date_to = _current_period(CURRENT_PERIODS[token], today or date.today())
+        elif ".." in token:
+            start, _, end = token.partition("..")
+            if not start and not end:
+                raise ValueError(f"Не понял период «{token}»")
+            date_from = _period_bounds(start)[0] if start else None
+            date_to = _period_bounds(end)[1] if end else None
+            if date_from and date_to and date_from > date_to:
+                raise ValueError("Начало периода позже конца")
+        else:
+            date_from, date_to = _period_bounds(token)
+    # "closed" уже включает конкретные закрытые статусы
+    if "closed" in statuses:
+        statuses -= {"buyout", "returned", "damaged"}
+    return ReportFilters(date_from, date_to, tuple(sorted(statuses)))
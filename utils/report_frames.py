@@ -0,0 +1,253 @@
+import importlib.util
+import zipfile
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from utils.excel import generate_excel_report, generate_profit_share_report
+
+# Подписи статусов закрытых сделок; прочие закрытые — просто «Закрыта»
+CLOSED_STATUS_LABELS = {
+    "buyout": "Закрыта (выкуп)",
+    "returned": "Закрыта (возврат)",
+    "damaged": "Закрыта (повреждена)",
+}
+
+MACHINE_SHEET_COLUMNS = [
+    "Дата начала", "Арендатор", "Модель", "Штрих-код", "Оплата", "Залог", "Полная стоимость",
+    "Телефон", "1С_статус", "Статус", "Тип сделки", "Комментарий", "Остаток к выплате",
+]
+# Parquet пишется через pyarrow — необязательная зависимость, без неё доступен только CSV
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+# Файлы выгрузки /export в порядке листов отчёта
+EXPORT_FILES = ("active", "payments", "closed")
+
+PROFIT_SHARE_BASE_COLUMNS = [
+    "Месяц старта", "Дата первого платежа", "Дата оформления", "Арендатор", "Тип сделки", "Модель", "Аренда", "Статус",
+]
+PAYMENT_SHEET_COLUMNS = ["Модель кофемашины", "Арендатор", "Сумма", "Дата платежа", "Тип", "Остаток к доплате"]
+
+
+def _column(values: list, dtype=None) -> np.ndarray:
+    # Даты, строки и колонки с NULL остаются object — в Excel они пишутся как раньше
+    if dtype is not None:
+        return np.array(values, dtype=dtype)
+    # fromiter не разворачивает значения-последовательности в лишнее измерение
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+def _dates(values: list) -> pd.Series:
+    return pd.Series(pd.to_datetime(_column(values)), dtype="datetime64[ns]")
+
+
+def _month_labels(dates: pd.Series) -> np.ndarray:
+    # Метка «YYYY-MM»: strftime только по уникальным датам (их единицы), дальше — раздача по кодам
+    codes, uniques = pd.factorize(dates.dt.to_period("M"))
+    return np.asarray(uniques.strftime("%Y-%m"), dtype=object)[codes]
+
+
+def build_report_frames(
+    machines: dict[str, list],
+    payments: dict[str, list],
+    model_prices: dict[str, float],
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Листы Excel-отчёта (активные сделки, платежи, закрытые сделки) из столбцов fetch_report_columns.
+    Все вычисления — по столбцам: полная стоимость, остатки, подписи статусов и типов платежей.
+    Для отчёта за период на листы сделок попадают только машины с listed, а остаток
+    на дату платежа учитывает оплаченное до периода (paid_before).
+    """
+    m = pd.DataFrame({
+        "id": _column(machines["id"], np.int64),
+        "start_date": _column(machines["start_date"]),
+        "tenant": _column(machines["tenant"]),
+        "model": _column(machines["model"]),
+        "barcode": _column(machines["barcode"]),
+        "rent_price": _column(machines["rent_price"], np.float64),
+        "deposit": _column(machines["deposit"], np.float64),
+        "full_price": _column(machines["full_price"]),
+        "phone": _column(machines["phone"]),
+        "in_1C": _column(machines["in_1C"]),
+        "status": _column(machines["status"]),
+        "deal_type": _column(machines["deal_type"]),
+        "comment": _column(machines["comment"]),
+        "total_paid": _column(machines["total_paid"], np.float64),
+    })
+    active = (m["status"] == "active").to_numpy(dtype=bool)
+    count = len(m)
+    listed = _column(machines["listed"], bool) if "listed" in machines else np.ones(count, dtype=bool)
+    paid_before = _column(machines["paid_before"], np.float64) if "paid_before" in machines else np.zeros(count)
+
+    # Индивидуальная стоимость, иначе стоимость модели, иначе 0
+    own_price = m["full_price"]
+    has_own_price = own_price.notna() & (own_price != 0)
+    model_price = m["model"].map(model_prices).fillna(0)
+    full_price = own_price.where(has_own_price, model_price).astype(np.float64)
+
+    # Активные: остаток с учётом депозита (может уйти в минус), закрытые — не меньше нуля
+    remain = np.where(
+        active,
+        full_price - (m["total_paid"] + m["deposit"].fillna(0)),
+        (full_price - m["total_paid"]).clip(lower=0),
+    )
+    status = np.where(active, "Открыта", m["status"].map(CLOSED_STATUS_LABELS).fillna("Закрыта"))
+
+    sheet = pd.DataFrame({
+        "Дата начала": m["start_date"],
+        "Арендатор": m["tenant"],
+        "Модель": m["model"],
+        "Штрих-код": m["barcode"],
+        "Оплата": m["rent_price"],
+        "Залог": m["deposit"],
+        "Полная стоимость": full_price,
+        "Телефон": m["phone"],
+        "1С_статус": m["in_1C"],
+        "Статус": status,
+        "Тип сделки": m["deal_type"],
+        "Комментарий": m["comment"].fillna(""),
+        "Остаток к выплате": remain,
+    })
+    active_sheet = sheet[active & listed].reset_index(drop=True)
+    closed_sheet = sheet[~active & listed].reset_index(drop=True)
+
+    payments_sheet = _payments_sheet(payments, m["id"], m["model"], full_price, paid_before, active)
+    return active_sheet, payments_sheet, closed_sheet
+
+
+def _payments_sheet(payments: dict[str, list], machine_ids, models, full_price, paid_before, active) -> pd.DataFrame:
+    p = pd.DataFrame({
+        "id": _column(payments["id"], np.int64),
+        "machine_id": _column(payments["machine_id"], np.int64),
+        "tenant": _column(payments["tenant"]),
+        "amount": _column(payments["amount"], np.float64),
+        "payment_date": _column(payments["payment_date"]),
+        "is_deposit": _column(payments["is_deposit"]),
+        "is_buyout": _column(payments["is_buyout"]),
+    })
+    # Платежи только по машинам из выборки, как при обходе машин с их платежами
+    position = pd.Index(machine_ids).get_indexer(p["machine_id"])
+    p = p[position >= 0]
+    position = position[position >= 0]
+
+    # Оплачено на дату платежа: накопленная сумма по машине, у платежей одной даты — итог на конец дня.
+    # Строки уже отсортированы по (machine_id, payment_date, id), поэтому порядок сложения прежний
+    paid = p.groupby("machine_id", sort=False)["amount"].cumsum()
+    paid = paid.groupby([p["machine_id"], p["payment_date"]], sort=False).transform("last")
+    # Для отчёта за период — плюс оплаченное до его начала
+    paid = paid_before[position] + paid.to_numpy()
+
+    kind = np.select(
+        [p["is_deposit"].eq(True).to_numpy(), p["is_buyout"].eq(True).to_numpy()],
+        ["Депозит", "Выкуп"],
+        default="Аренда",
+    )
+    sheet = pd.DataFrame({
+        "Модель кофемашины": models.to_numpy()[position],
+        "Арендатор": p["tenant"].to_numpy(),
+        "Сумма": p["amount"].to_numpy(),
+        "Дата платежа": p["payment_date"].to_numpy(),
+        "Тип": kind,
+        "Остаток к доплате": (full_price.to_numpy()[position] - paid).clip(min=0),
+    }, columns=PAYMENT_SHEET_COLUMNS)
+    # Сначала платежи по открытым сделкам, затем по закрытым (внутри — по машинам, как раньше)
+    is_active = active[position]
+    return pd.concat([sheet[is_active], sheet[~is_active]], ignore_index=True)
+
+
+def render_excel_report(machines: dict[str, list], payments: dict[str, list], model_prices: dict[str, float]) -> BytesIO:
+    """Сборка листов и запись Excel — целиком в процессе пула отрисовки."""
+    active, payments_sheet, closed = build_report_frames(machines, payments, model_prices)
+    return generate_excel_report(active, payments_sheet, closed)
+
+
+def _export_frames(machines: dict[str, list], payments: dict[str, list], model_prices: dict[str, float]) -> dict:
+    active, payments_sheet, closed = build_report_frames(machines, payments, model_prices)
+    return dict(zip(EXPORT_FILES, (active, payments_sheet, closed)))
+
+
+def render_csv_export(machines: dict[str, list], payments: dict[str, list], model_prices: dict[str, float]) -> BytesIO:
+    """
+    Те же листы, что в /report, — CSV-файлами в zip, без книги Excel.
+    utf-8-sig: Excel открывает кириллицу без выбора кодировки; пустой лист — только заголовок.
+    """
+    output = BytesIO()
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, frame in _export_frames(machines, payments, model_prices).items():
+            archive.writestr(f"{name}.csv", frame.to_csv(index=False).encode("utf-8-sig"))
+    output.seek(0)
+    return output
+
+
+def render_parquet_export(machines: dict[str, list], payments: dict[str, list], model_prices: dict[str, float]) -> BytesIO:
+    """Листы /report Parquet-файлами (pyarrow, сжатие внутри файла) в zip без повторного сжатия."""
+    output = BytesIO()
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, frame in _export_frames(machines, payments, model_prices).items():
+            buffer = BytesIO()
+            frame.to_parquet(buffer, engine="pyarrow", index=False)
+            archive.writestr(f"{name}.parquet", buffer.getvalue())
+    output.seek(0)
+    return output
+
+
+def build_profit_share_sheets(machines: dict[str, list], payouts: dict[str, list]) -> list[tuple[str, pd.DataFrame]]:
+    """
+    Листы отчёта по распределению прибыли: лист = месяц первого платежа (без платежей — месяц оформления).
+    machines — столбцы машин, payouts — длинная таблица помесячных сумм (machine_id, month, amount_sum,
+    first_payment_date). Колонки месяцев — один pivot_table по возрастанию; месяцы без выплат на листе
+    отбрасываются одним groupby(...).any() по всем листам сразу.
+    """
+    ids = pd.Index(_column(machines["id"], np.int64))
+    if ids.empty:
+        return []
+    # Даты — в datetime64: min и метки месяцев по ним векторные, а не поэлементные по объектам date
+    p = pd.DataFrame({
+        "machine_id": _column(payouts["machine_id"], np.int64),
+        "month": _month_labels(_dates(payouts["month"])),
+        "amount_sum": _column(payouts["amount_sum"], np.float64),
+        "first_payment_date": _dates(payouts["first_payment_date"]),
+    })
+    start_date = _column(machines["start_date"])
+
+    # Дата первого платежа машины, без платежей — дата оформления
+    first_payment = p.groupby("machine_id")["first_payment_date"].min().reindex(ids).reset_index(drop=True)
+    first_payment = first_payment.fillna(_dates(machines["start_date"]))
+    start_month = pd.Series(_month_labels(first_payment))
+
+    if p.empty:
+        wide = pd.DataFrame(index=ids)
+    else:
+        # Строки сводки уникальны по (машина, месяц), sum лишь раскладывает их по колонкам
+        wide = p.pivot_table(index="machine_id", columns="month", values="amount_sum", aggfunc="sum", sort=True)
+        wide = wide.reindex(ids)
+    wide.columns = list(wide.columns)
+
+    frame = pd.concat([
+        pd.DataFrame({
+            "Месяц старта": start_month,
+            "Дата первого платежа": first_payment.dt.date,
+            "Дата оформления": start_date,
+            "Арендатор": _column(machines["tenant"]),
+            "Тип сделки": _column(machines["deal_type"]),
+            "Модель": _column(machines["model"]),
+            "Аренда": _column(machines["rent_price"]),
+            "Статус": _column(machines["status"]),
+        }),
+        wide.reset_index(drop=True),
+    ], axis=1)
+
+    # Одна группировка по месяцу старта даёт и строки листов, и месяцы с выплатами на каждом листе
+    grouped = wide.fillna(0).ne(0).reset_index(drop=True).groupby(start_month)
+    has_payouts = grouped.any()
+    sheets = []
+    for label, positions in sorted(grouped.indices.items()):
+        months = [month for month, keep in zip(wide.columns, has_payouts.loc[label]) if keep]
+        sheets.append((label, frame.iloc[positions][PROFIT_SHARE_BASE_COLUMNS + months].reset_index(drop=True)))
+    return sheets
+
+
+def render_profit_share_report(machines: dict[str, list], payouts: dict[str, list]) -> BytesIO:
+    """Сборка листов распределения прибыли и запись Excel — в процессе пула отрисовки."""
+    return generate_profit_share_report(build_profit_share_sheets(machines, payouts))
@@ -0,0 +1,90 @@
+"""
+Режим webhook: Telegram сам присылает обновления на aiohttp-сервер бота
+(обычно за обратным прокси с TLS), вместо того чтобы бот опрашивал getUpdates.
+
+Каждый запрос проверяется по заголовку X-Telegram-Bot-Api-Secret-Token, ответ
+Telegram отдаётся сразу, а обработка идёт в фоне. За балансировщиком может работать
+несколько реплик одного бота: состояние диалогов общее (FSM в PostgreSQL, см. fsm_storage.py),
+кэши в памяти процесса сбрасываются по записям других реплик (LISTEN/NOTIFY, см. cache_sync.py),
+а автонапоминания включают только в одной реплике (REMINDERS_ENABLED).
+"""
+
+import asyncio
+import logging
+import re
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger("webhook")
+
+# Telegram принимает секрет из 1–256 символов A-Z, a-z, 0-9, _ и -
+_SECRET_RE = re.compile(r"^[A-Za-z0-9_-]{1,256}$")
+
+
+def webhook_url(base_url: str, path: str) -> str:
+    """Публичный адрес webhook: внешний URL прокси + путь маршрута бота."""
+    return base_url.rstrip("/") + "/" + path.lstrip("/")
+
+
+def validate_webhook_config(base_url: str, secret: str) -> None:
+    if not base_url.startswith("https://"):
+        raise RuntimeError("WEBHOOK_BASE_URL должен быть внешним https-адресом бота")
+    if not _SECRET_RE.match(secret or ""):
+        raise RuntimeError("WEBHOOK_SECRET обязателен: 1–256 символов A-Z, a-z, 0-9, _ и -")
+
+
+async def health(request: web.Request) -> web.Response:
+    """Проверка живости для прокси и балансировщика (без обращения к Telegram и БД)."""
+    return web.json_response({"status": "ok"})
+
+
+def create_webhook_app(bot: Bot, dp: Dispatcher, path: str, secret: str, health_path: str) -> web.Application:
+    app = web.Application()
+    app.router.add_get(health_path, health)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def set_bot_webhook(bot: Bot, url: str, secret: str, allowed_updates: list[str]) -> None:
+    """
+    Регистрирует webhook в Telegram. Вызывается каждой репликой при старте: setWebhook
+    идемпотентен и заодно применяет сменившийся секрет; накопившиеся обновления не сбрасываются.
+    """
+    try:
+        await bot.set_webhook(url, secret_token=secret, allowed_updates=allowed_updates)
+    except TelegramRetryAfter as e:
+        # Реплики стартуют одновременно и упираются в лимит частоты setWebhook
+        await asyncio.sleep(e.retry_after)
+        await bot.set_webhook(url, secret_token=secret, allowed_updates=allowed_updates)
+    logger.info("Webhook установлен: %s", url)
+
+
+async def run_webhook(
+    bot: Bot,
+    dp: Dispatcher,
+    base_url: str,
+    path: str,
+    secret: str,
+    host: str,
+    port: int,
+    health_path: str,
+) -> None:
+    """
+    Запускает aiohttp-сервер и регистрирует webhook, затем работает до отмены.
+    При остановке webhook не удаляется: обновления продолжат получать остальные реплики.
+    """
+    validate_webhook_config(base_url, secret)
+    app = create_webhook_app(bot, dp, path, secret, health_path)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        logger.info("Сервер webhook слушает %s:%s%s", host, port, path)
+        await set_bot_webhook(bot, webhook_url(base_url, path), secret, dp.resolve_used_update_types())
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()